@@ -0,0 +1,140 @@
+"""
+Compact serialization of inventory objects used in the update protocol between the applications,
+the server, and the remote servers.
+
+An object is encoded into a tuple (type code, constructor arguments...) of python primitives. The
+arguments are the same as those appearing in the repr of the object, so that decoding is a plain
+constructor call. Batches of (cmd, code) pairs are packed into a single string with marshal.
+"""
+
+import marshal
+
+import dynamo.dataformat as df
+
+# Increment when the encoding of any of the classes changes
+CODEC_VERSION = 1
+
+T_DATASET, T_BLOCK, T_FILE, T_SITE, T_SITEPARTITION, T_GROUP, T_DATASETREPLICA, T_BLOCKREPLICA, T_PARTITION = range(9)
+
+def _encode_dataset(dataset):
+    return (T_DATASET, dataset.name, dataset.status, dataset.data_type, dataset.software_version, \
+        dataset.last_update, dataset.is_open, dataset.id)
+
+def _encode_block(block):
+    return (T_BLOCK, block.real_name(), block._dataset_name(), block.size, block.num_files, \
+        block.is_open, block.last_update, block.id, False)
+
+def _encode_file(lfile):
+    return (T_FILE, lfile.lfn, lfile._block_full_name(), lfile.size, lfile.checksum, lfile.id)
+
+def _encode_site(site):
+    mapping = dict((protocol, m._chains) for protocol, m in site.filename_mapping.iteritems())
+    return (T_SITE, site.name, site.host, site.storage_type, site.backend, site.status, mapping, site.id)
+
+def _encode_sitepartition(site_partition):
+    return (T_SITEPARTITION, site_partition._site_name(), site_partition._partition_name(), site_partition._quota)
+
+def _encode_group(group):
+    return (T_GROUP, group.name, group.olevel, group.id)
+
+def _encode_datasetreplica(replica):
+    return (T_DATASETREPLICA, replica._dataset_name(), replica._site_name(), replica.growing, replica._group_name())
+
+def _encode_blockreplica(replica):
+    # Same convention as BlockReplica.__repr__: size is -1 if the replica is complete
+    if replica.is_complete():
+        size = -1
+        file_ids = None
+    else:
+        size = replica.size
+        file_ids = replica.file_ids
+
+    return (T_BLOCKREPLICA, replica._block_full_name(), replica._site_name(), replica._group_name(), \
+        replica.is_custodial, size, replica.last_update, file_ids)
+
+def _encode_partition(partition):
+    return (T_PARTITION, partition.name, None, partition.id)
+
+_encoders = {
+    df.Dataset: _encode_dataset,
+    df.Block: _encode_block,
+    df.File: _encode_file,
+    df.Site: _encode_site,
+    df.SitePartition: _encode_sitepartition,
+    df.Group: _encode_group,
+    df.DatasetReplica: _encode_datasetreplica,
+    df.BlockReplica: _encode_blockreplica,
+    df.Partition: _encode_partition
+}
+
+_classes = [
+    df.Dataset,
+    df.Block,
+    df.File,
+    df.Site,
+    df.SitePartition,
+    df.Group,
+    df.DatasetReplica,
+    df.BlockReplica,
+    df.Partition
+]
+
+def encode(obj):
+    """
+    @param obj  An inventory object
+    @return A tuple of primitives representing the object.
+    """
+
+    try:
+        encoder = _encoders[type(obj)]
+    except KeyError:
+        raise df.ObjectError('Cannot encode object of type %s' % type(obj).__name__)
+
+    return encoder(obj)
+
+def decode(code):
+    """
+    @param code  A tuple returned by encode()
+    @return A new (unlinked) object represented by the code.
+    """
+
+    return _classes[code[0]](*code[1:])
+
+def pack_batch(commands):
+    """
+    @param commands  List of (cmd, code)
+    @return A string containing the versioned batch.
+    """
+
+    return marshal.dumps((CODEC_VERSION, commands))
+
+def unpack_batch(packed):
+    """
+    @param packed  A string returned by pack_batch()
+    @return List of (cmd, code)
+    """
+
+    version, commands = marshal.loads(packed)
+    if version != CODEC_VERSION:
+        raise df.OperationalError('Update batch codec version %d does not match the current version %d' % (version, CODEC_VERSION))
+
+    return commands
+
+def pack(code):
+    """
+    Serialize a single object code into a string (e.g. for storage in a database).
+    """
+
+    return marshal.dumps((CODEC_VERSION, code))
+
+def unpack(packed):
+    """
+    @param packed  A string returned by pack()
+    @return The object code
+    """
+
+    version, code = marshal.loads(packed)
+    if version != CODEC_VERSION:
+        raise df.OperationalError('Object codec version %d does not match the current version %d' % (version, CODEC_VERSION))
+
+    return code
@@ -1,8 +1,13 @@
+import logging
+
 from dynamo.core.components.board import UpdateBoard
 from dynamo.core.inventory import DynamoInventory
+import dynamo.core.codec as codec
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import Configuration
 
+LOG = logging.getLogger(__name__)
+
 class MySQLUpdateBoard(UpdateBoard):
     def __init__(self, config):
         UpdateBoard.__init__(self, config)
@@ -12,6 +17,8 @@ class MySQLUpdateBoard(UpdateBoard):
 
         self._mysql = MySQL(db_params)
 
+        self._upgrade_table()
+
     def lock(self): #override
         self._mysql.lock_tables(write = ['inventory_updates'])
 
@@ -21,9 +28,9 @@ class MySQLUpdateBoard(UpdateBoard):
     def get_updates(self): #override
         for cmd, obj in self._mysql.xquery('SELECT `cmd`, `obj` FROM `inventory_updates` ORDER BY `id`'):
             if cmd == 'update':
-                yield DynamoInventory.CMD_UPDATE, obj
+                yield DynamoInventory.CMD_UPDATE, self._unpack(obj)
             elif cmd == 'delete':
-                yield DynamoInventory.CMD_DELETE, obj
+                yield DynamoInventory.CMD_DELETE, self._unpack(obj)
 
     def flush(self): #override
         self._mysql.query('DELETE FROM `inventory_updates`')
@@ -33,16 +40,37 @@ class MySQLUpdateBoard(UpdateBoard):
         self._mysql.lock_tables(write = ['inventory_updates'])
 
         try:
-            sql = 'INSERT INTO `inventory_updates` (`cmd`, `obj`) VALUES (%s, %s)'
+            fields = ('cmd', 'obj')
+            mapping = lambda (cmd, code): (DynamoInventory._cmd_str[cmd].lower(), codec.pack(code))
 
-            for cmd, sobj in update_commands:
-                if cmd == DynamoInventory.CMD_UPDATE:
-                    self._mysql.query(sql, 'update', sobj)
-                elif cmd == DynamoInventory.CMD_DELETE:
-                    self._mysql.query(sql, 'delete', sobj)
+            self._mysql.insert_many('inventory_updates', fields, mapping, update_commands, do_update = False)
 
         finally:
             self._mysql.unlock_tables()
 
     def disconnect(self):
         self._mysql.close()
+
+    def _upgrade_table(self):
+        """
+        Tables created before the binary codec have a text obj column, which cannot hold packed codes.
+        """
+
+        sql = 'SELECT `DATA_TYPE` FROM `information_schema`.`COLUMNS`'
+        sql += ' WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = \'inventory_updates\' AND `COLUMN_NAME` = \'obj\''
+
+        try:
+            result = self._mysql.query(sql)
+            if len(result) != 0 and result[0].lower() != 'mediumblob':
+                LOG.info('Converting inventory_updates.obj from %s to mediumblob.', result[0])
+                self._mysql.query('ALTER TABLE `inventory_updates` MODIFY `obj` mediumblob NOT NULL')
+        except:
+            # Not fatal as long as the table is empty or holds legacy rows only
+            LOG.warning('Could not upgrade the inventory_updates table.')
+
+    def _unpack(self, obj):
+        try:
+            return codec.unpack(obj)
+        except (ValueError, TypeError, EOFError):
+            # Row written by a server predating the binary codec; make_object accepts the repr string
+            return str(obj)
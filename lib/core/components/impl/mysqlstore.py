@@ -2,6 +2,7 @@ import time
 import logging
 import fnmatch
 import hashlib
+import threading
 
 from dynamo.core.components.persistency import InventoryStore
 from dynamo.utils.interface.mysql import MySQL
@@ -9,6 +10,70 @@ from dynamo.dataformat import Configuration, Partition, Dataset, Block, File, Si
 
 LOG = logging.getLogger(__name__)
 
+class MySQLWriteBatch(object):
+    """
+    Replica-level writes deferred by MySQLInventoryStore within a batch_write() context.
+    Block replicas are keyed by (block_id, site_id) and dataset replicas by (dataset_id, site_id).
+    Registering a write supersedes the pending writes it would have overwritten, so that executing
+    all deletions first and then all insertions reproduces the result of the sequential execution.
+    """
+
+    __slots__ = ['block_replicas', 'block_replica_files', 'block_replica_sizes', 'cleared_block_replicas',
+        'deleted_block_replicas', 'emptied_dataset_replicas', 'dataset_replicas', 'deleted_dataset_replicas', 'quotas']
+
+    def __init__(self):
+        self.block_replicas = {} # {(block_id, site_id): ((dataset_id, site_id), row)}
+        self.block_replica_files = {} # {(block_id, site_id): set(file_ids)}
+        self.block_replica_sizes = {} # {(block_id, site_id): (num_files, size)}
+        self.cleared_block_replicas = set() # block replicas whose file / size entries are to be deleted
+        self.deleted_block_replicas = set()
+        self.emptied_dataset_replicas = set() # dataset replicas to delete if they have no block replicas left
+        self.dataset_replicas = {} # {(dataset_id, site_id): row}
+        self.deleted_dataset_replicas = set()
+        self.quotas = {} # {(site_id, partition_id): storage}
+
+    def save_blockreplica(self, key, dataset_key, row, file_ids, size):
+        self.block_replicas[key] = (dataset_key, row)
+
+        if file_ids is None:
+            self.block_replica_files.pop(key, None)
+            self.block_replica_sizes.pop(key, None)
+            self.cleared_block_replicas.add(key)
+        elif BlockReplica._use_file_ids:
+            try:
+                self.block_replica_files[key].update(file_ids)
+            except KeyError:
+                self.block_replica_files[key] = set(file_ids)
+        else:
+            self.block_replica_sizes[key] = (file_ids, size)
+
+    def delete_blockreplica(self, key, dataset_key):
+        self.block_replicas.pop(key, None)
+        self.block_replica_files.pop(key, None)
+        self.block_replica_sizes.pop(key, None)
+        self.deleted_block_replicas.add(key)
+        self.emptied_dataset_replicas.add(dataset_key)
+
+    def save_datasetreplica(self, dataset_key, row):
+        self.dataset_replicas[dataset_key] = row
+        # the replica is saved after the emptiness check of the sequential execution
+        self.emptied_dataset_replicas.discard(dataset_key)
+
+    def delete_datasetreplica(self, dataset_key):
+        self.dataset_replicas.pop(dataset_key, None)
+        self.emptied_dataset_replicas.discard(dataset_key)
+        self.deleted_dataset_replicas.add(dataset_key)
+
+        for key in [k for k, (dk, _) in self.block_replicas.iteritems() if dk == dataset_key]:
+            self.block_replicas.pop(key)
+            self.block_replica_files.pop(key, None)
+            self.block_replica_sizes.pop(key, None)
+
+    def is_empty(self):
+        return len(self.block_replicas) == 0 and len(self.cleared_block_replicas) == 0 and \
+            len(self.deleted_block_replicas) == 0 and len(self.dataset_replicas) == 0 and \
+            len(self.deleted_dataset_replicas) == 0 and len(self.quotas) == 0
+
 class MySQLInventoryStore(InventoryStore):
     """InventoryStore with a MySQL backend."""
 
@@ -17,6 +82,13 @@ class MySQLInventoryStore(InventoryStore):
 
         self._mysql = MySQL(config.db_params)
 
+        # Number of dataset id ranges loaded in parallel in load_data (1 -> serial load)
+        self.num_load_shards = config.get('num_load_shards', 1)
+
+        # MySQLWriteBatch when within batch_write()
+        self._batch = None
+        self._batch_depth = 0
+
     def close(self):
         self._mysql.close()
 
@@ -29,9 +101,39 @@ class MySQLInventoryStore(InventoryStore):
         return True
 
     def new_handle(self): #override
-        config = Configuration(db_params = self._mysql.config())
+        config = Configuration(db_params = self._mysql.config(), num_load_shards = self.num_load_shards)
         return MySQLInventoryStore(config)
 
+    def begin_batch(self): #override
+        if self._batch_depth == 0:
+            self._mysql.begin_transaction()
+            self._batch = MySQLWriteBatch()
+
+        self._batch_depth += 1
+
+    def commit_batch(self): #override
+        self._batch_depth -= 1
+        if self._batch_depth != 0:
+            return
+
+        try:
+            self._write_batch()
+        except:
+            self._batch = None
+            self._mysql.rollback_transaction()
+            raise
+
+        self._batch = None
+        self._mysql.commit_transaction()
+
+    def abort_batch(self): #override
+        if self._batch is not None and not self._batch.is_empty():
+            LOG.warning('Discarding deferred inventory store writes.')
+
+        self._batch = None
+        self._batch_depth = 0
+        self._mysql.rollback_transaction()
+
     def get_partitions(self, conditions): #override
         partition_names = set(self._mysql.query('SELECT `name` FROM `partitions`'))
 
@@ -210,6 +312,22 @@ class MySQLInventoryStore(InventoryStore):
 
         LOG.info('Loaded %d sites.', num)
 
+        if self.num_load_shards > 1:
+            self._load_sharded(inventory, id_group_map, id_site_map, group_names, site_names, dataset_names)
+        else:
+            self._load_serial(inventory, id_group_map, id_site_map, groups_tmp, sites_tmp, dataset_names)
+
+        ## Cleanup
+        if group_names is not None:
+            self._mysql.drop_tmp_table('groups_load')
+        if site_names is not None:
+            self._mysql.drop_tmp_table('sites_load')
+        if dataset_names is not None:
+            self._mysql.drop_tmp_table('datasets_load')
+
+        self._mysql.reuse_connection = reuse_connection_orig
+
+    def _load_serial(self, inventory, id_group_map, id_site_map, groups_tmp, sites_tmp, dataset_names):
         ## Load datasets
         LOG.info('Loading datasets.')
         start = time.time()
@@ -253,15 +371,135 @@ class MySQLInventoryStore(InventoryStore):
 
         LOG.info('Loaded %d dataset replicas and %d block replicas in %.1f seconds.', num_dataset_replicas, num_block_replicas, time.time() - start)
 
-        ## Cleanup
-        if group_names is not None:
-            self._mysql.drop_tmp_table('groups_load')
-        if site_names is not None:
-            self._mysql.drop_tmp_table('sites_load')
-        if dataset_names is not None:
-            self._mysql.drop_tmp_table('datasets_load')
+    def _load_sharded(self, inventory, id_group_map, id_site_map, group_names, site_names, dataset_names):
+        """
+        Load datasets, blocks, and replicas by splitting the dataset id space into num_load_shards ranges
+        with roughly equal numbers of datasets. Each range is streamed through its own connection in a
+        separate thread and merged into the inventory as it is read.
+        """
 
-        self._mysql.reuse_connection = reuse_connection_orig
+        self._load_software_versions()
+
+        id_ranges = self._get_dataset_id_ranges(self.num_load_shards)
+
+        LOG.info('Loading datasets, blocks, and replicas in %d shards.', len(id_ranges))
+        start = time.time()
+
+        # Serializes modifications to objects shared among the shards (inventory dicts and sites)
+        merge_lock = threading.Lock()
+
+        threads = []
+        for id_range in id_ranges:
+            result = {'range': id_range}
+            thread = threading.Thread(target = self._load_shard, name = 'load_shard_%d' % len(threads), \
+                args = (inventory, id_group_map, id_site_map, group_names, site_names, dataset_names, id_range, merge_lock, result))
+            thread.daemon = True
+            thread.start()
+            threads.append((thread, result))
+
+        results = []
+        for thread, result in threads:
+            thread.join()
+            results.append(result)
+
+        for result in results:
+            if 'exception' in result:
+                raise result['exception']
+
+        for result in results:
+            low, high = result['range']
+            LOG.info('Shard [%s, %s): %d datasets in %.1fs, %d blocks in %.1fs, %d dataset replicas and %d block replicas in %.1fs.', \
+                low, high, result['datasets'], result['datasets_time'], result['blocks'], result['blocks_time'], \
+                result['dataset_replicas'], result['block_replicas'], result['replicas_time'])
+
+        LOG.info('Loaded %d datasets, %d blocks, %d dataset replicas, and %d block replicas in %.1f seconds.', \
+            sum(r['datasets'] for r in results), sum(r['blocks'] for r in results), \
+            sum(r['dataset_replicas'] for r in results), sum(r['block_replicas'] for r in results), time.time() - start)
+
+    def _load_shard(self, inventory, id_group_map, id_site_map, group_names, site_names, dataset_names, id_range, merge_lock, result):
+        """
+        Thread function of _load_sharded. Temporary constraint tables live in a connection, so they
+        are recreated in the new handle. Counts and timings are written into the result dict.
+        """
+
+        store = self.new_handle()
+        store._mysql.reuse_connection = True
+
+        try:
+            if group_names is not None:
+                groups_tmp = store._setup_constraints('groups', group_names)
+            else:
+                groups_tmp = None
+
+            if site_names is not None:
+                sites_tmp = store._setup_constraints('sites', site_names)
+            else:
+                sites_tmp = None
+
+            if dataset_names is not None:
+                datasets_tmp = store._setup_constraints('datasets', dataset_names)
+            else:
+                datasets_tmp = None
+
+            start = time.time()
+            id_dataset_map = {}
+            result['datasets'] = store._load_datasets(inventory, id_dataset_map, datasets_tmp, id_range = id_range, merge_lock = merge_lock)
+            result['datasets_time'] = time.time() - start
+
+            start = time.time()
+            id_block_maps = {}
+            store._load_blocks(inventory, id_dataset_map, id_block_maps, datasets_tmp, id_range = id_range)
+            result['blocks'] = sum(len(m) for m in id_block_maps.itervalues())
+            result['blocks_time'] = time.time() - start
+
+            start = time.time()
+            store._load_replicas(
+                inventory, id_group_map, id_site_map, id_dataset_map, id_block_maps,
+                groups_tmp, sites_tmp, datasets_tmp, id_range = id_range, merge_lock = merge_lock
+            )
+            result['dataset_replicas'] = 0
+            result['block_replicas'] = 0
+            for dataset in id_dataset_map.itervalues():
+                result['dataset_replicas'] += len(dataset.replicas)
+                result['block_replicas'] += sum(len(r.block_replicas) for r in dataset.replicas)
+            result['replicas_time'] = time.time() - start
+
+        except Exception as ex:
+            LOG.error('Exception while loading dataset id range [%s, %s).', id_range[0], id_range[1])
+            result['exception'] = ex
+
+        finally:
+            store.close()
+
+    def _get_dataset_id_ranges(self, num_shards):
+        """
+        Split the dataset id space into at most num_shards half-open ranges [low, high) containing
+        roughly equal numbers of datasets. high is None for the last range.
+        """
+
+        num_datasets = self._mysql.query('SELECT COUNT(*) FROM `datasets`')[0]
+
+        boundaries = [0]
+        for ishard in xrange(1, num_shards):
+            offset = num_datasets * ishard / num_shards
+            if offset == 0:
+                continue
+
+            result = self._mysql.query('SELECT `id` FROM `datasets` ORDER BY `id` LIMIT %s, 1', offset)
+            if len(result) != 0 and result[0] > boundaries[-1]:
+                boundaries.append(result[0])
+
+        boundaries.append(None)
+
+        return zip(boundaries[:-1], boundaries[1:])
+
+    def _id_range_condition(self, column, id_range):
+        low, high = id_range
+        condition = '%s >= %d' % (column, low)
+        if high is not None:
+            condition += ' AND %s < %d' % (column, high)
+
+        return condition
 
     def _load_groups(self, inventory, id_group_map, groups_tmp):
         for group in self._yield_groups(groups_tmp = groups_tmp):
@@ -285,17 +523,22 @@ class MySQLInventoryStore(InventoryStore):
 
         return len(id_site_map)
 
-    def _load_datasets(self, inventory, id_dataset_map, datasets_tmp):
-        for dataset in self._yield_datasets(datasets_tmp = datasets_tmp):
-            inventory.datasets.add(dataset)
+    def _load_datasets(self, inventory, id_dataset_map, datasets_tmp, id_range = None, merge_lock = None):
+        for dataset in self._yield_datasets(datasets_tmp = datasets_tmp, id_range = id_range):
             id_dataset_map[dataset.id] = dataset
 
+        if merge_lock is None:
+            inventory.datasets.update((d.name, d) for d in id_dataset_map.itervalues())
+        else:
+            with merge_lock:
+                inventory.datasets.update((d.name, d) for d in id_dataset_map.itervalues())
+
         return len(id_dataset_map)
 
-    def _load_blocks(self, inventory, id_dataset_map, id_block_maps, datasets_tmp):
+    def _load_blocks(self, inventory, id_dataset_map, id_block_maps, datasets_tmp, id_range = None):
         _dataset_id = 0
         dataset = None
-        for block in self._yield_blocks(id_dataset_map = id_dataset_map, datasets_tmp = datasets_tmp):
+        for block in self._yield_blocks(id_dataset_map = id_dataset_map, datasets_tmp = datasets_tmp, id_range = id_range):
             if block.dataset.id != _dataset_id:
                 dataset = block.dataset
                 _dataset_id = dataset.id
@@ -306,7 +549,7 @@ class MySQLInventoryStore(InventoryStore):
 
             id_block_map[block.id] = block
 
-    def _load_replicas(self, inventory, id_group_map, id_site_map, id_dataset_map, id_block_maps, groups_tmp, sites_tmp, datasets_tmp):
+    def _load_replicas(self, inventory, id_group_map, id_site_map, id_dataset_map, id_block_maps, groups_tmp, sites_tmp, datasets_tmp, id_range = None, merge_lock = None):
         sql = 'SELECT dr.`dataset_id`, dr.`site_id`, dr.`growing`, dr.`group_id`, br.`block_id`, br.`group_id`,'
         sql += ' br.`is_custodial`, UNIX_TIMESTAMP(br.`last_update`),'
         if BlockReplica._use_file_ids:
@@ -331,6 +574,9 @@ class MySQLInventoryStore(InventoryStore):
         if datasets_tmp is not None:
             sql += ' INNER JOIN `%s`.`%s` AS dt ON dt.`id` = dr.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
 
+        if id_range is not None:
+            sql += ' WHERE ' + self._id_range_condition('dr.`dataset_id`', id_range)
+
         sql += ' ORDER BY dr.`dataset_id`, dr.`site_id`, b.`id`'
 
         # Blocks are left joined -> there will be (# sites) x (# blocks) x (# block files) entries per dataset
@@ -368,7 +614,7 @@ class MySQLInventoryStore(InventoryStore):
                     # this does not matter for the dataset, but for the site there is some heavy
                     # computation needed when a replica is added
                     dataset_replica.dataset.replicas.add(dataset_replica)
-                    dataset_replica.site.add_dataset_replica(dataset_replica, add_block_replicas = True)
+                    self._add_to_site(dataset_replica, merge_lock)
 
                 dataset_replica = DatasetReplica(
                     dataset,
@@ -427,12 +673,20 @@ class MySQLInventoryStore(InventoryStore):
 
         if dataset_replica is not None:
             dataset_replica.dataset.replicas.add(dataset_replica)
-            dataset_replica.site.add_dataset_replica(dataset_replica, add_block_replicas = True)
+            self._add_to_site(dataset_replica, merge_lock)
 
         if BlockReplica._use_file_ids and block_replica is not None and not block_replica_complete:
             block_replica.size = block_replica_size
             block_replica.file_ids = tuple(file_ids)
 
+    def _add_to_site(self, dataset_replica, merge_lock):
+        # sites are shared among the shards in a parallel load
+        if merge_lock is None:
+            dataset_replica.site.add_dataset_replica(dataset_replica, add_block_replicas = True)
+        else:
+            with merge_lock:
+                dataset_replica.site.add_dataset_replica(dataset_replica, add_block_replicas = True)
+
     def _setup_constraints(self, table, names):
         tmp_table = table + '_load'
         columns = ['`id` int(11) unsigned NOT NULL', 'PRIMARY KEY (`id`)']
@@ -778,8 +1032,7 @@ class MySQLInventoryStore(InventoryStore):
         for site_name, partition_name, storage in self._mysql.xquery(sql):
             yield SitePartition(Site(site_name), Partition(partition_name), quota = storage * 1.e+12)
 
-    def _yield_datasets(self, datasets_tmp = None): #override
-        # load software versions first
+    def _load_software_versions(self):
         # not COUNT(*) - list can have holes
         maxid = self._mysql.query('SELECT MAX(`id`) FROM `software_versions`')[0]
         if maxid is None: # None: no entries in the table
@@ -799,6 +1052,12 @@ class MySQLInventoryStore(InventoryStore):
             Dataset._software_versions_byid[vid] = version
             Dataset._software_versions_byvalue[value] = version
 
+    def _yield_datasets(self, datasets_tmp = None, id_range = None): #override
+        if id_range is None:
+            # load software versions first
+            # (a sharded load reads them once before starting the shards)
+            self._load_software_versions()
+
         sql = 'SELECT d.`id`, d.`name`, d.`status`+0, d.`data_type`+0,'
         sql += ' d.`software_version_id`, UNIX_TIMESTAMP(d.`last_update`), d.`is_open`'
         sql += ' FROM `datasets` AS d'
@@ -806,6 +1065,9 @@ class MySQLInventoryStore(InventoryStore):
         if datasets_tmp is not None:
             sql += ' INNER JOIN `%s`.`%s` AS t ON t.`id` = d.`id`' % (self._mysql.scratch_db, datasets_tmp)
 
+        if id_range is not None:
+            sql += ' WHERE ' + self._id_range_condition('d.`id`', id_range)
+
         for dataset_id, name, status, data_type, sw_version_id, last_update, is_open in self._mysql.xquery(sql):
             # size and num_files are reset when loading blocks
             dataset = Dataset(
@@ -820,13 +1082,16 @@ class MySQLInventoryStore(InventoryStore):
 
             yield dataset
 
-    def _yield_blocks(self, id_dataset_map = None, datasets_tmp = None): #override
+    def _yield_blocks(self, id_dataset_map = None, datasets_tmp = None, id_range = None): #override
         sql = 'SELECT b.`id`, d.`id`, d.`name`, b.`name`, b.`size`, b.`num_files`, b.`is_open`, UNIX_TIMESTAMP(b.`last_update`) FROM `blocks` AS b'
         sql += ' INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
 
         if datasets_tmp is not None:
             sql += ' INNER JOIN `%s`.`%s` AS t ON t.`id` = b.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
 
+        if id_range is not None:
+            sql += ' WHERE ' + self._id_range_condition('b.`dataset_id`', id_range)
+
         sql += ' ORDER BY b.`dataset_id`'
 
         _dataset_id = 0
@@ -1033,6 +1298,9 @@ class MySQLInventoryStore(InventoryStore):
             block.id = block_id
 
     def delete_block(self, block): #override
+        # pending replica writes must precede this statement
+        self._write_batch()
+
         dataset_id = block.dataset.id
         if dataset_id == 0:
             return
@@ -1064,6 +1332,9 @@ class MySQLInventoryStore(InventoryStore):
             lfile.id = file_id
 
     def delete_file(self, lfile): #override
+        # pending replica writes must precede this statement
+        self._write_batch()
+
         sql = 'DELETE FROM f, brf USING `files` AS f'
         sql += ' LEFT JOIN `block_replica_files` AS brf ON brf.`file_id` = f.`id`'
         sql += ' WHERE f.`name` = %s'
@@ -1080,6 +1351,17 @@ class MySQLInventoryStore(InventoryStore):
 
         is_complete = block_replica.is_complete()
 
+        if self._batch is not None:
+            row = (block_id, site_id, block_replica.group.id, block_replica.is_custodial, \
+                   time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(block_replica.last_update)), is_complete)
+            if is_complete:
+                file_ids = None
+            else:
+                file_ids = block_replica.file_ids
+
+            self._batch.save_blockreplica((block_id, site_id), (block_replica.block.dataset.id, site_id), row, file_ids, block_replica.size)
+            return
+
         fields = ('block_id', 'site_id', 'group_id', 'is_custodial', 'last_update', 'is_complete')
         self._mysql.insert_update('block_replicas', fields, block_id, site_id, \
                                   block_replica.group.id, block_replica.is_custodial, \
@@ -1118,6 +1400,10 @@ class MySQLInventoryStore(InventoryStore):
         if site_id == 0:
             return
 
+        if self._batch is not None:
+            self._batch.delete_blockreplica((block_id, site_id), (dataset_id, site_id))
+            return
+
         sql = 'DELETE FROM `block_replicas` WHERE `block_id` = %s AND `site_id` = %s'
         self._mysql.query(sql, block_id, site_id)
 
@@ -1155,6 +1441,9 @@ class MySQLInventoryStore(InventoryStore):
             dataset.id = dataset_id
 
     def delete_dataset(self, dataset): #override
+        # pending replica writes must precede this statement
+        self._write_batch()
+
         sql = 'DELETE FROM d, b, f, dr, br, brf, brs USING `datasets` AS d'
         sql += ' LEFT JOIN `blocks` AS b ON b.`dataset_id` = d.`id`'
         sql += ' LEFT JOIN `files` AS f ON f.`block_id` = b.`id`'
@@ -1175,8 +1464,14 @@ class MySQLInventoryStore(InventoryStore):
         if site_id == 0:
             return
 
+        group_id = dataset_replica.group.id if dataset_replica.growing else None
+
+        if self._batch is not None:
+            self._batch.save_datasetreplica((dataset_id, site_id), (dataset_id, site_id, dataset_replica.growing, group_id))
+            return
+
         fields = ('dataset_id', 'site_id', 'growing', 'group_id')
-        self._mysql.insert_update('dataset_replicas', fields, dataset_id, site_id, dataset_replica.growing, dataset_replica.group.id if dataset_replica.growing else None)
+        self._mysql.insert_update('dataset_replicas', fields, dataset_id, site_id, dataset_replica.growing, group_id)
 
     def delete_datasetreplica(self, dataset_replica): #override
         dataset_id = dataset_replica.dataset.id
@@ -1187,6 +1482,10 @@ class MySQLInventoryStore(InventoryStore):
         if site_id == 0:
             return
 
+        if self._batch is not None:
+            self._batch.delete_datasetreplica((dataset_id, site_id))
+            return
+
         sql = 'DELETE FROM br, brf, brs USING `blocks` AS b'
         sql += ' INNER JOIN `block_replicas` AS br ON br.`block_id` = b.`id`'
         sql += ' LEFT JOIN `block_replica_files` AS brf ON brf.`block_id` = b.`id` AND brf.`site_id` = br.`site_id`'
@@ -1207,6 +1506,9 @@ class MySQLInventoryStore(InventoryStore):
             group.id = group_id
 
     def delete_group(self, group): #override
+        # pending replica writes must precede this statement
+        self._write_batch()
+
         sql = 'DELETE FROM `groups` WHERE `id` = %s'
         self._mysql.query(sql, group.id)
 
@@ -1226,6 +1528,9 @@ class MySQLInventoryStore(InventoryStore):
         # default parameters will be created.
 
     def delete_partition(self, partition): #override
+        # pending replica writes must precede this statement
+        self._write_batch()
+
         sql = 'DELETE FROM p, q USING `partitions` AS p'
         sql += ' LEFT JOIN `quotas` AS q ON q.`partition_id` = p.`id`'
         sql += ' WHERE p.`name` = %s'
@@ -1256,6 +1561,9 @@ class MySQLInventoryStore(InventoryStore):
         # default parameters will be created.
 
     def delete_site(self, site): #override
+        # pending replica writes must precede this statement
+        self._write_batch()
+
         sql = 'DELETE FROM s, m, dr, br, brf, brs, q USING `sites` AS s'
         sql += ' LEFT JOIN `filename_mappings` AS m ON m.`site_id` = s.`id`'
         sql += ' LEFT JOIN `dataset_replicas` AS dr ON dr.`site_id` = s.`id`'
@@ -1279,9 +1587,87 @@ class MySQLInventoryStore(InventoryStore):
         if partition_id == 0:
             return
 
+        if self._batch is not None:
+            self._batch.quotas[(site_id, partition_id)] = site_partition.quota * 1.e-12
+            return
+
         fields = ('site_id', 'partition_id', 'storage')
         self._mysql.insert_update('quotas', fields, site_id, partition_id, site_partition.quota * 1.e-12)
 
+    def _write_batch(self):
+        """
+        Execute the deferred writes with multi-row statements. Deletions come first.
+        """
+
+        batch = self._batch
+        if batch is None or batch.is_empty():
+            return
+
+        LOG.debug('Writing batch: %d block replicas, %d dataset replicas saved; %d block replicas, %d dataset replicas deleted.', \
+            len(batch.block_replicas), len(batch.dataset_replicas), len(batch.deleted_block_replicas), len(batch.deleted_dataset_replicas))
+
+        br_key = ('block_id', 'site_id')
+        dr_key = ('dataset_id', 'site_id')
+
+        if len(batch.deleted_dataset_replicas) != 0:
+            sql = 'DELETE FROM br, brf, brs USING `blocks` AS b'
+            sql += ' INNER JOIN `block_replicas` AS br ON br.`block_id` = b.`id`'
+            sql += ' LEFT JOIN `block_replica_files` AS brf ON brf.`block_id` = b.`id` AND brf.`site_id` = br.`site_id`'
+            sql += ' LEFT JOIN `block_replica_sizes` AS brs ON brs.`block_id` = b.`id` AND brs.`site_id` = br.`site_id`'
+            self._mysql.execute_many(sql, MySQL.bare('(b.`dataset_id`, br.`site_id`)'), batch.deleted_dataset_replicas)
+
+            self._mysql.delete_many('dataset_replicas', dr_key, batch.deleted_dataset_replicas)
+
+        if len(batch.deleted_block_replicas) != 0:
+            for table in ['block_replicas', 'block_replica_files', 'block_replica_sizes']:
+                self._mysql.delete_many(table, br_key, batch.deleted_block_replicas)
+
+        if len(batch.cleared_block_replicas) != 0:
+            if BlockReplica._use_file_ids:
+                table = 'block_replica_files'
+            else:
+                table = 'block_replica_sizes'
+
+            self._mysql.delete_many(table, br_key, batch.cleared_block_replicas)
+
+        if len(batch.emptied_dataset_replicas) != 0:
+            # dataset replicas with pending block replica insertions are not empty
+            candidates = batch.emptied_dataset_replicas - set(dk for dk, _ in batch.block_replicas.itervalues())
+
+            sql = 'SELECT DISTINCT b.`dataset_id`, br.`site_id` FROM `block_replicas` AS br'
+            sql += ' INNER JOIN `blocks` AS b ON b.`id` = br.`block_id`'
+            nonempty = set(self._mysql.execute_many(sql, MySQL.bare('(b.`dataset_id`, br.`site_id`)'), candidates))
+
+            empty = candidates - nonempty
+            for dataset_key in empty:
+                batch.dataset_replicas.pop(dataset_key, None)
+
+            self._mysql.delete_many('dataset_replicas', dr_key, empty)
+
+        fields = ('dataset_id', 'site_id', 'growing', 'group_id')
+        self._mysql.insert_many('dataset_replicas', fields, None, batch.dataset_replicas.itervalues())
+
+        fields = ('block_id', 'site_id', 'group_id', 'is_custodial', 'last_update', 'is_complete')
+        self._mysql.insert_many('block_replicas', fields, lambda (_, row): row, batch.block_replicas.itervalues())
+
+        def filereplicas():
+            for (block_id, site_id), file_ids in batch.block_replica_files.iteritems():
+                for file_id in file_ids:
+                    yield (block_id, site_id, file_id)
+
+        fields = ('block_id', 'site_id', 'file_id')
+        self._mysql.insert_many('block_replica_files', fields, None, filereplicas())
+
+        fields = ('block_id', 'site_id', 'num_files', 'size')
+        mapping = lambda ((block_id, site_id), (num_files, size)): (block_id, site_id, num_files, size)
+        self._mysql.insert_many('block_replica_sizes', fields, mapping, batch.block_replica_sizes.iteritems())
+
+        fields = ('site_id', 'partition_id', 'storage')
+        mapping = lambda ((site_id, partition_id), storage): (site_id, partition_id, storage)
+        self._mysql.insert_many('quotas', fields, mapping, batch.quotas.iteritems())
+
+        self._batch = MySQLWriteBatch()
+
     def version(self): #override
         """
         Concatenate hex checksums of all tables and take the md5.
@@ -6,6 +6,32 @@ from dynamo.utils.classutil import get_instance
 
 LOG = logging.getLogger(__name__)
 
+class InventoryStoreBatch(object):
+    """
+    Context manager returned by InventoryStore.batch_write(). Within the context, save_X and delete_X
+    calls to the store can be deferred by the implementation and executed together when the context exits.
+    If an exception is raised in the context, the deferred writes are discarded.
+    """
+
+    def __init__(self, store):
+        # store can be None, in which case the context does nothing
+        self._store = store
+
+    def __enter__(self):
+        if self._store is not None:
+            self._store.begin_batch()
+
+        return self._store
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._store is None:
+            return
+
+        if exc_type is None:
+            self._store.commit_batch()
+        else:
+            self._store.abort_batch()
+
 class InventoryStore(object):
     """
     Interface definition for local inventory data store.
@@ -38,6 +64,34 @@ class InventoryStore(object):
 
         raise NotImplementedError('new_handle')
 
+    def batch_write(self):
+        """
+        Return a context manager for batched writes. Usage:
+          with store.batch_write():
+              obj.write_into(store)
+              ...
+        """
+
+        return InventoryStoreBatch(self)
+
+    def begin_batch(self):
+        """
+        Start deferring writes. Default implementation executes all writes immediately.
+        """
+        pass
+
+    def commit_batch(self):
+        """
+        Execute the deferred writes.
+        """
+        pass
+
+    def abort_batch(self):
+        """
+        Discard the deferred writes.
+        """
+        pass
+
     def get_partitions(self, conditions):
         """
         Return a list of partition objects.
@@ -1,13 +1,21 @@
+import time
 import logging
 import re
+import bisect
+import fnmatch
 
 from dynamo.policy.condition import Condition
 from dynamo.policy.variables import replica_variables
 import dynamo.dataformat as df
-from dynamo.core.components.persistency import InventoryStore
+from dynamo.core.components.persistency import InventoryStore, InventoryStoreBatch
+from dynamo.core.snapshot import InventorySnapshot
+import dynamo.core.codec as codec
 
 LOG = logging.getLogger(__name__)
 
+# fnmatch special characters
+_WILDCARD = re.compile(r'[*?[]')
+
 class NameKeyDict(dict):
     __slots__ = []
 
@@ -15,12 +23,184 @@ class NameKeyDict(dict):
         self[obj.name] = obj
 
 
+class DatasetKeyDict(NameKeyDict):
+    """
+    NameKeyDict of datasets with an index of the names for wildcard lookups. The names are kept in a
+    sorted list, so that the datasets matching a pattern with a literal head (/Primary*/...) are found
+    by bisection, and in sets keyed by the data tier (the last component of the name).
+    Insertions and deletions are recorded and merged into the sorted list at the next lookup.
+    """
+
+    __slots__ = ['_sorted_names', '_added', '_removed', '_tiers']
+
+    def __init__(self, *args, **kwd):
+        dict.__init__(self)
+
+        self._sorted_names = []
+        self._added = set()
+        self._removed = set()
+        # {tier: set(names)}
+        self._tiers = {}
+
+        if len(args) != 0 or len(kwd) != 0:
+            self.update(*args, **kwd)
+
+    def __reduce__(self):
+        return (DatasetKeyDict, (dict(self),))
+
+    def __setitem__(self, name, dataset):
+        if name not in self:
+            self._index_add(name)
+
+        dict.__setitem__(self, name, dataset)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self._index_remove(name)
+
+    def pop(self, name, *args):
+        if name in self:
+            self._index_remove(name)
+
+        return dict.pop(self, name, *args)
+
+    def popitem(self):
+        name, dataset = dict.popitem(self)
+        self._index_remove(name)
+        return name, dataset
+
+    def setdefault(self, name, default = None):
+        if name not in self:
+            self[name] = default
+
+        return dict.__getitem__(self, name)
+
+    def update(self, *args, **kwd):
+        if len(args) > 1:
+            raise TypeError('update expected at most 1 arguments, got %d' % len(args))
+
+        if len(args) != 0:
+            source = args[0]
+            if hasattr(source, 'keys'):
+                for name in source.keys():
+                    self[name] = source[name]
+            else:
+                for name, dataset in source:
+                    self[name] = dataset
+
+        for name, dataset in kwd.iteritems():
+            self[name] = dataset
+
+    def clear(self):
+        dict.clear(self)
+        self._sorted_names = []
+        self._added.clear()
+        self._removed.clear()
+        self._tiers.clear()
+
+    def match_names(self, pattern):
+        """
+        Find the names of the datasets matching a shell-style wildcard pattern.
+        @param pattern  fnmatch pattern
+        @return Sorted list of dataset names
+        """
+
+        if not _WILDCARD.search(pattern):
+            if pattern in self:
+                return [pattern]
+            else:
+                return []
+
+        self._sync()
+
+        prefix = _WILDCARD.split(pattern, 1)[0]
+        if prefix:
+            begin = bisect.bisect_left(self._sorted_names, prefix)
+            # names starting with the prefix sort below the prefix with its last character incremented
+            last = ord(prefix[-1])
+            if last < 0xff:
+                end = bisect.bisect_left(self._sorted_names, prefix[:-1] + chr(last + 1), begin)
+            else:
+                end = len(self._sorted_names)
+        else:
+            begin = 0
+            end = len(self._sorted_names)
+
+        candidates = None
+
+        head, _, tier = pattern.rpartition('/')
+        if head and not _WILDCARD.search(tier):
+            tier_names = self._tiers.get(tier, ())
+            if len(tier_names) < end - begin:
+                candidates = sorted(tier_names)
+
+        if candidates is None:
+            candidates = self._sorted_names[begin:end]
+
+        regex = re.compile(fnmatch.translate(pattern))
+        return [name for name in candidates if regex.match(name)]
+
+    def match(self, pattern):
+        """
+        @param pattern  fnmatch pattern
+        @return List of datasets with names matching the pattern, sorted by name
+        """
+
+        return [dict.__getitem__(self, name) for name in self.match_names(pattern)]
+
+    def _index_add(self, name):
+        if name in self._removed:
+            self._removed.remove(name)
+        else:
+            self._added.add(name)
+
+        self._tiers.setdefault(name.rpartition('/')[2], set()).add(name)
+
+    def _index_remove(self, name):
+        if name in self._added:
+            self._added.remove(name)
+        else:
+            self._removed.add(name)
+
+        tier = name.rpartition('/')[2]
+        try:
+            tier_names = self._tiers[tier]
+        except KeyError:
+            return
+
+        tier_names.discard(name)
+        if len(tier_names) == 0:
+            self._tiers.pop(tier)
+
+    def _sync(self):
+        """Merge the pending insertions and deletions into the sorted name list."""
+
+        num_changes = len(self._added) + len(self._removed)
+        if num_changes == 0:
+            return
+
+        if num_changes * 16 > len(self._sorted_names):
+            self._sorted_names = sorted(self.iterkeys())
+        else:
+            names = self._sorted_names
+            for name in self._removed:
+                ipos = bisect.bisect_left(names, name)
+                if ipos != len(names) and names[ipos] == name:
+                    names.pop(ipos)
+
+            for name in self._added:
+                bisect.insort_left(names, name)
+
+        self._added.clear()
+        self._removed.clear()
+
+
 class ObjectRepository(object):
     """Base class of the inventory which is just a bundle of dicts"""
     def __init__(self):
         self.groups = NameKeyDict()
         self.sites = NameKeyDict()
-        self.datasets = NameKeyDict()
+        self.datasets = DatasetKeyDict()
         self.partitions = NameKeyDict()
 
         # Null group always exist
@@ -32,6 +212,14 @@ class ObjectRepository(object):
     def update(self, obj):
         return obj.embed_into(self)
 
+    def update_many(self, objs):
+        """
+        Update a list of objects in the given order.
+        @param objs  List of objects to embed into this inventory.
+        @return List of embedded objects.
+        """
+        return [self.update(obj) for obj in objs]
+
     def delete(self, obj):
         try:
             return obj.unlink_from(self)
@@ -45,16 +233,20 @@ class ObjectRepository(object):
             LOG.error('Exception in inventory.delete(%s)' % str(obj))
             raise
 
-    def make_object(self, repstr):
+    def make_object(self, code):
         """
-        Create an object from its representation string.
+        Create an object from its serialized representation.
 
-        @param repstr  A string returned by repr(obj)
+        @param code  A tuple returned by codec.encode(obj) or a string returned by repr(obj)
 
         @return A new object represented by the input.
         """
 
-        return eval('df.' + repstr)
+        if type(code) is str:
+            # legacy representation string
+            return eval('df.' + code)
+        else:
+            return codec.decode(code)
 
     def find_file(self, lfn):
         """
@@ -120,16 +312,46 @@ class DynamoInventoryProxy(ObjectRepository):
 
         return embedded_clone
 
+    def update_many(self, objs): #override
+        """
+        Update a list of objects (e.g. new dataset replicas each followed by its block replicas).
+        The changed objects are registered as a single bulk command, which is sent to the Dynamo
+        server in one message and applied there within one store transaction.
+        @param objs   List of objects to embed into this inventory.
+        @return List of embedded clones.
+        """
+
+        embedded_clones = []
+        codes = []
+
+        for obj in objs:
+            try:
+                embedded_clone, updated = obj.embed_into(self, check = True)
+            except:
+                LOG.error('Exception in inventory.update_many(%s)', str(obj))
+                raise
+
+            embedded_clones.append(embedded_clone)
+
+            if updated and self._update_commands is not None:
+                codes.append(codec.encode(embedded_clone))
+
+        if len(codes) != 0:
+            LOG.debug('Adding %d updated objects as a bulk command.', len(codes))
+            self._update_commands.append((DynamoInventory.CMD_BULK, codes))
+
+        return embedded_clones
+
     def register_update(self, obj): #override
         """
-        Put the text representation of obj to _update_commands.
+        Put the serialized representation of obj to _update_commands.
         """
 
         if self._update_commands is None:
             return
 
         LOG.debug('%s has changed. Adding a clone to updated objects list.', str(obj))
-        self._update_commands.append((DynamoInventory.CMD_UPDATE, repr(obj)))
+        self._update_commands.append((DynamoInventory.CMD_UPDATE, codec.encode(obj)))
 
     def delete(self, obj): #override
         """
@@ -145,7 +367,7 @@ class DynamoInventoryProxy(ObjectRepository):
 
         if self._update_commands is not None:
             LOG.debug('%s is deleted.', str(obj))
-            self._update_commands.append((DynamoInventory.CMD_DELETE, repr(deleted_object)))
+            self._update_commands.append((DynamoInventory.CMD_DELETE, codec.encode(deleted_object)))
 
         return deleted_object
 
@@ -164,8 +386,8 @@ class DynamoInventory(ObjectRepository):
     Inventory class. ObjectRepository with a persistent store backend.
     """
 
-    CMD_UPDATE, CMD_DELETE, CMD_EOM = range(3)
-    _cmd_str = ['UPDATE', 'DELETE', 'EOM']
+    CMD_UPDATE, CMD_DELETE, CMD_EOM, CMD_BATCH, CMD_BULK = range(5)
+    _cmd_str = ['UPDATE', 'DELETE', 'EOM', 'BATCH', 'BULK']
 
     @property
     def has_store(self):
@@ -188,6 +410,15 @@ class DynamoInventory(ObjectRepository):
 
         self.partition_def_path = config.partition_def_path
 
+        # Check the site partition occupancy counters against a full recount at every use (for debugging)
+        df.SitePartition.verify_occupancy = config.get('verify_occupancy', False)
+
+        # Binary image of the inventory for fast restarts
+        if config.get('snapshot_path', ''):
+            self.snapshot = InventorySnapshot(config.snapshot_path)
+        else:
+            self.snapshot = None
+
     def init_store(self, module, config):
         if self._store:
             self._store.close()
@@ -211,12 +442,96 @@ class DynamoInventory(ObjectRepository):
         """
         return self._store.check_connection()
 
+    def batch_store_writes(self):
+        """
+        Return a context manager within which the store writes of update() and delete() are batched.
+        """
+        if self._has_store:
+            return self._store.batch_write()
+        else:
+            return InventoryStoreBatch(None)
+
     def flush_to_store(self):
         """
-        Save the full inventory content to store.
+        Save the full inventory content to store. Also write the snapshot if configured.
         """
         self._store.save_data(self)
 
+        if self.snapshot is not None:
+            self.save_snapshot()
+
+    def save_snapshot(self, version = None):
+        """
+        Write the full inventory content to the snapshot file.
+        @param version  Store version corresponding to the current content. Queried if None.
+        """
+
+        if version is None:
+            version = self.store_version()
+
+        LOG.info('Writing inventory snapshot to %s.', self.snapshot.path)
+        start = time.time()
+
+        num = self.snapshot.write(self, version)
+
+        LOG.info('Wrote %d datasets to the snapshot in %.1f seconds.', num, time.time() - start)
+
+    def load_snapshot(self):
+        """
+        Load inventory content from the snapshot file and replay the journal on top of it.
+        Journal entries are applied only in memory (the store already has them).
+
+        @return  Store version the loaded content corresponds to.
+        """
+
+        self.loaded = False
+
+        self.groups.clear()
+        self.groups[None] = df.Group.null_group
+        self.sites.clear()
+        self.datasets.clear()
+        self.partitions.clear()
+
+        LOG.info('Loading data from snapshot %s.', self.snapshot.path)
+        start = time.time()
+
+        version = self.snapshot.read(self, self._read_partition_conditions())
+
+        LOG.info('Snapshot loaded in %.1f seconds.', time.time() - start)
+
+        num_batches = 0
+        for version_before, version_after, update_commands in self.snapshot.read_journal():
+            if version_before != version:
+                # entry from before the snapshot
+                continue
+
+            for cmd, code in update_commands:
+                obj = self.make_object(code)
+                if cmd == DynamoInventory.CMD_UPDATE:
+                    ObjectRepository.update(self, obj)
+                elif cmd == DynamoInventory.CMD_DELETE:
+                    try:
+                        ObjectRepository.delete(self, obj)
+                    except (KeyError, df.ObjectError):
+                        pass
+
+            version = version_after
+            num_batches += 1
+
+        if num_batches != 0:
+            LOG.info('Applied %d update batches from the snapshot journal.', num_batches)
+
+        self.loaded = True
+
+        return version
+
+    def journal_updates(self, version_before, version_after, update_commands):
+        """
+        Record update commands applied after the last snapshot.
+        """
+        if self.snapshot is not None:
+            self.snapshot.append_journal(version_before, version_after, update_commands)
+
     def new_store_handle(self):
         return self._store.new_handle()
 
@@ -270,6 +585,16 @@ class DynamoInventory(ObjectRepository):
     def _load_partitions(self):
         """Load partition data from a text table."""
 
+        conditions = self._read_partition_conditions()
+
+        partitions = self._store.get_partitions(conditions)
+
+        for partition in partitions:
+            self.partitions.add(partition)
+
+    def _read_partition_conditions(self):
+        """Parse the partition definition file into {name: condition or list of subpartition names}."""
+
         conditions = {}
         with open(self.partition_def_path) as defsource:
             subpartitions = {}
@@ -289,10 +614,7 @@ class DynamoInventory(ObjectRepository):
 
                 conditions[name] = condition
 
-        partitions = self._store.get_partitions(conditions)
-
-        for partition in partitions:
-            self.partitions.add(partition)
+        return conditions
 
     def _get_group_names(self, included, excluded):
         """Return the list of group names or None according to the arguments."""
@@ -387,6 +709,16 @@ class DynamoInventory(ObjectRepository):
 
         return embedded_clone
 
+    def update_many(self, objs): #override
+        """
+        Update a list of objects in memory and write them to store in one transaction.
+        @param objs   List of objects to embed into this inventory.
+        @return List of embedded clones.
+        """
+
+        with self.batch_store_writes():
+            return [self.update(obj) for obj in objs]
+
     def delete(self, obj): #override
         """
         Delete an object from memory and write the change to store.
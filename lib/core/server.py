@@ -4,6 +4,7 @@ import shutil
 import time
 import logging
 import signal
+import errno
 import code
 import hashlib
 import multiprocessing
@@ -13,6 +14,7 @@ import traceback
 import shlex
 
 from dynamo.core.inventory import DynamoInventory
+import dynamo.core.codec as codec
 from dynamo.core.manager import ServerManager
 import dynamo.core.serverutils as serverutils
 from dynamo.core.components.appserver import AppServer
@@ -26,6 +28,12 @@ from dynamo.dataformat import Configuration
 LOG = logging.getLogger(__name__)
 CHANGELOG = logging.getLogger('changelog')
 
+# Number of update commands packed into one message of the update queue
+UPDATE_BATCH_SIZE = 10000
+
+# Written by the snapshot writer process upon success
+SNAPSHOT_WRITER_DONE = 'done'
+
 class DynamoServer(object):
     """Main daemon class."""
 
@@ -79,10 +87,23 @@ class DynamoServer(object):
         ## Queue to send / receive inventory updates
         self.inventory_update_queue = multiprocessing.JoinableQueue()
 
+        ## Inventory snapshot writing interval (given in hours; 0 -> write only at startup)
+        self.snapshot_interval = config.inventory.get('snapshot_interval', 0) * 3600.
+        self.last_snapshot_time = 0
+        ## (pid, pipe read end, store version, start time) of the process writing the periodic snapshot
+        self.snapshot_writer = None
+
+        ## Store version the in-memory inventory corresponds to (tracked only when writing snapshots)
+        self.inventory_version = None
+
         ## Recipient of error message emails
         self.notification_recipient = config.notification_recipient
 
     def load_inventory(self):
+        if self.snapshot_writer is not None:
+            # Snapshot from before a restart is still being written
+            self._collect_snapshot_writer(wait = True)
+
         ## Wait until there is no write process
         while self.manager.master.get_writing_process_id() is not None:
             LOG.debug('A write-enabled process is running. Checking again in 5 seconds.')
@@ -116,8 +137,27 @@ class DynamoServer(object):
                 # Use this remote store as mine (read-only)
                 self._setup_remote_store(hostname, module, config)
 
-        LOG.info('Loading the inventory.')
-        self.inventory.load(**self.inventory_load_opts)
+        if self.inventory.snapshot is not None and len(self.inventory_load_opts) == 0 and self.inventory.snapshot.exists():
+            LOG.info('Loading the inventory from snapshot.')
+            try:
+                version = self.inventory.load_snapshot()
+            except:
+                log_exception(LOG)
+                version = None
+
+            store_version = self.inventory.store_version()
+            if version == store_version:
+                self.inventory_version = version
+            else:
+                LOG.info('Snapshot does not match the store version. Loading from the store.')
+
+        if self.inventory_version is None:
+            LOG.info('Loading the inventory.')
+            self.inventory.load(**self.inventory_load_opts)
+
+            if self.inventory.snapshot is not None and len(self.inventory_load_opts) == 0:
+                self.inventory_version = self.inventory.store_version()
+                self._write_snapshot()
 
         LOG.info('Inventory is ready.')
 
@@ -132,6 +172,7 @@ class DynamoServer(object):
             self.manager.set_status(ServerHost.STAT_STARTING)
 
             self.inventory = DynamoInventory(self.inventory_config)
+            self.inventory_version = None
 
             if self.webserver:
                 self.webserver.start()
@@ -244,6 +285,9 @@ class DynamoServer(object):
 
                 if self.webserver is not None:
                     self._collect_updates_from_web()
+                    self.webserver.check_image()
+
+                self._check_snapshot()
 
                 ## Step 6 (easier to do here because we use "continue"s)
                 cleanup_timer += 1
@@ -396,6 +440,9 @@ class DynamoServer(object):
 
                 if self.webserver is not None:
                     self._collect_updates_from_web()
+                    self.webserver.check_image()
+
+                self._check_snapshot()
     
                 ## Step 2
                 time.sleep(self.poll_interval)
@@ -505,6 +552,7 @@ class DynamoServer(object):
 
     def _collect_updates(self):
         print_every = 100000
+        next_print = print_every
         updates_received = 0
         deletes_received = 0
 
@@ -515,7 +563,7 @@ class DynamoServer(object):
             try:
                 # Once we have an item sent, we'll read until the end (EOM).
                 # If the child dies in the middle of messaging, we get out of the while loop by timeout = 60
-                cmd, objstr = self.inventory_update_queue.get(block = reading, timeout = 60)
+                cmd, packed = self.inventory_update_queue.get(block = reading, timeout = 60)
             except Queue.Empty:
                 if reading:
                     # The child process crashed or timed out
@@ -527,21 +575,32 @@ class DynamoServer(object):
 
                 reading = True # Now we have to read until the end - start blocking queue.get
 
-                if LOG.getEffectiveLevel() == logging.DEBUG:
-                    if cmd == DynamoInventory.CMD_UPDATE:
-                        LOG.debug('Update %d from queue: %s', updates_received, objstr)
-                    elif cmd == DynamoInventory.CMD_DELETE:
-                        LOG.debug('Delete %d from queue: %s', deletes_received, objstr)
-
-                if cmd == DynamoInventory.CMD_UPDATE:
-                    updates_received += 1
-                    update_commands.append((cmd, objstr))
-                elif cmd == DynamoInventory.CMD_DELETE:
-                    deletes_received += 1
-                    update_commands.append((cmd, objstr))
-
-                if cmd == DynamoInventory.CMD_EOM or len(update_commands) % print_every == 0:
+                if cmd == DynamoInventory.CMD_BATCH:
+                    for bcmd, code in codec.unpack_batch(packed):
+                        if bcmd == DynamoInventory.CMD_BULK:
+                            # list of object codes from inventory.update_many(); the rest of the
+                            # update chain (store, journal, remote servers) sees plain updates
+                            LOG.debug('Bulk update of %d objects from queue', len(code))
+                            updates_received += len(code)
+                            update_commands.extend((DynamoInventory.CMD_UPDATE, c) for c in code)
+                            continue
+
+                        if LOG.getEffectiveLevel() == logging.DEBUG:
+                            if bcmd == DynamoInventory.CMD_UPDATE:
+                                LOG.debug('Update %d from queue: %s', updates_received, str(code))
+                            elif bcmd == DynamoInventory.CMD_DELETE:
+                                LOG.debug('Delete %d from queue: %s', deletes_received, str(code))
+
+                        if bcmd == DynamoInventory.CMD_UPDATE:
+                            updates_received += 1
+                        elif bcmd == DynamoInventory.CMD_DELETE:
+                            deletes_received += 1
+
+                        update_commands.append((bcmd, code))
+
+                if cmd == DynamoInventory.CMD_EOM or len(update_commands) >= next_print:
                     LOG.info('Received %d updates and %d deletes.', updates_received, deletes_received)
+                    next_print += print_every
 
                 if cmd == DynamoInventory.CMD_EOM:
                     return 1, update_commands
@@ -619,31 +678,168 @@ class DynamoServer(object):
             # The server which sent the updates has set this server's status to updating
             self.manager.set_status(ServerHost.STAT_ONLINE)
 
+    def _check_snapshot(self):
+        """
+        Write a new inventory snapshot if the interval has passed.
+        """
+        if self.snapshot_writer is not None:
+            self._collect_snapshot_writer()
+            return
+
+        if self.inventory_version is None or self.snapshot_interval <= 0:
+            return
+
+        if time.time() - self.last_snapshot_time > self.snapshot_interval:
+            self._start_snapshot_writer()
+
+    def _start_snapshot_writer(self):
+        """
+        Fork a process that writes the snapshot from its copy-on-write image of the inventory, so that
+        the main loop keeps processing updates. Updates applied in the meantime go to the journal, which
+        is trimmed when the writer has finished.
+        """
+
+        self.last_snapshot_time = time.time()
+
+        try:
+            read_end, write_end = os.pipe()
+            pid = os.fork()
+        except OSError:
+            log_exception(LOG)
+            return
+
+        if pid == 0:
+            # Child process: no logging (the lock of a handler may be held by a thread of the parent)
+            # and no cleanup of the inherited connections at exit.
+            os.close(read_end)
+            try:
+                self.inventory.snapshot.write(self.inventory, self.inventory_version, reset_journal = False)
+            except:
+                os.write(write_end, traceback.format_exc())
+                os._exit(1)
+
+            # Tells the parent that the snapshot is complete even if it cannot get the exit status
+            os.write(write_end, SNAPSHOT_WRITER_DONE)
+            os._exit(0)
+
+        os.close(write_end)
+
+        LOG.info('Writing inventory snapshot to %s (process %d).', self.inventory.snapshot.path, pid)
+        self.snapshot_writer = (pid, read_end, self.inventory_version, time.time())
+
+    def _collect_snapshot_writer(self, wait = False):
+        """
+        Reap the snapshot writer process if it has finished and trim the journal.
+        @param wait  Block until the writer finishes.
+        """
+
+        pid, read_end, version, start = self.snapshot_writer
+
+        if wait:
+            options = 0
+        else:
+            options = os.WNOHANG
+
+        while True:
+            try:
+                wpid, status = os.waitpid(pid, options)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                elif err.errno == errno.ECHILD:
+                    # Child was reaped elsewhere; it has exited and the pipe tells how it went
+                    wpid, status = pid, None
+                else:
+                    raise
+
+            break
+
+        if wpid == 0:
+            return
+
+        message = ''
+        while True:
+            data = os.read(read_end, 4096)
+            if not data:
+                break
+            message += data
+
+        os.close(read_end)
+        self.snapshot_writer = None
+
+        if status is None:
+            if message != SNAPSHOT_WRITER_DONE:
+                LOG.error('Failed to write the inventory snapshot (exit status unknown).\n%s', message)
+                return
+
+        elif os.WIFSIGNALED(status):
+            LOG.error('Inventory snapshot writer was killed by signal %d.', os.WTERMSIG(status))
+            return
+
+        elif os.WEXITSTATUS(status) != 0:
+            LOG.error('Failed to write the inventory snapshot (exit status %d).\n%s', os.WEXITSTATUS(status), message)
+            return
+
+        LOG.info('Wrote inventory snapshot in %.1f seconds.', time.time() - start)
+
+        try:
+            self.inventory.snapshot.trim_journal(version)
+        except:
+            log_exception(LOG)
+
+    def _write_snapshot(self):
+        try:
+            self.inventory.save_snapshot(self.inventory_version)
+        except:
+            # Failure to write a snapshot is not fatal
+            log_exception(LOG)
+
+        self.last_snapshot_time = time.time()
+
     def _exec_updates(self, update_commands):
         num_updates = 0
         num_deletes = 0
-        for cmd, objstr in update_commands:
-            # Create a python object from its representation string
-            obj = self.inventory.make_object(objstr)
 
-            if cmd == DynamoInventory.CMD_UPDATE:
-                num_updates += 1
-                embedded_object = self.inventory.update(obj)
-                CHANGELOG.info('Saved %s', str(embedded_object))
+        if self.inventory_version is not None:
+            # keep the list to write into the snapshot journal
+            journal_commands = []
+        else:
+            journal_commands = None
 
-            elif cmd == DynamoInventory.CMD_DELETE:
-                num_deletes += 1
-                deleted_object = self.inventory.delete(obj)
-                if deleted_object is not None:
-                    CHANGELOG.info('Deleting %s', str(deleted_object))
+        # Store writes are accumulated and executed in one transaction at the end of the block
+        with self.inventory.batch_store_writes():
+            for cmd, code in update_commands:
+                if journal_commands is not None:
+                    journal_commands.append((cmd, code))
+
+                # Create a python object from its serialized representation
+                obj = self.inventory.make_object(code)
+
+                if cmd == DynamoInventory.CMD_UPDATE:
+                    num_updates += 1
+                    embedded_object = self.inventory.update(obj)
+                    CHANGELOG.info('Saved %s', str(embedded_object))
+
+                elif cmd == DynamoInventory.CMD_DELETE:
+                    num_deletes += 1
+                    deleted_object = self.inventory.delete(obj)
+                    if deleted_object is not None:
+                        CHANGELOG.info('Deleting %s', str(deleted_object))
 
         if num_updates + num_deletes != 0:
+            if self.inventory.has_store or self.inventory_version is not None:
+                version = self.inventory.store_version()
+
             if self.inventory.has_store:
-                self.manager.master.advertise_store_version(self.inventory.store_version())
+                self.manager.master.advertise_store_version(version)
+
+            if self.inventory_version is not None:
+                self.inventory.journal_updates(self.inventory_version, version, journal_commands)
+                self.inventory_version = version
 
             if self.webserver:
-                # Restart the web server so it gets the latest inventory image
-                self.webserver.restart()
+                # Give the web server the latest inventory image
+                self.webserver.refresh(update_commands)
 
         return num_updates, num_deletes
 
@@ -866,16 +1062,18 @@ class DynamoServer(object):
         sys.stderr.flush()
 
         wm = 0.
-        for iobj, (cmd, objstr) in enumerate(inventory._update_commands):
+        for iobj in xrange(0, nobj, UPDATE_BATCH_SIZE):
             if float(iobj) / nobj * 100. > wm:
                 sys.stderr.write(' %.0f%%..' % (float(iobj) / nobj * 100.))
                 sys.stderr.flush()
                 wm += 5.
-    
+
+            batch = inventory._update_commands[iobj:iobj + UPDATE_BATCH_SIZE]
+
             try:
-                self.inventory_update_queue.put((cmd, objstr))
+                self.inventory_update_queue.put((DynamoInventory.CMD_BATCH, codec.pack_batch(batch)))
             except:
-                sys.stderr.write('Exception while sending %s %s\n' % (DynamoInventory._cmd_str[cmd], objstr))
+                sys.stderr.write('Exception while sending updates %d-%d\n' % (iobj, iobj + len(batch)))
                 sys.stderr.flush()
                 raise
     
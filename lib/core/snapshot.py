@@ -0,0 +1,359 @@
+"""
+Binary on-disk image of the server inventory.
+
+A snapshot file is a sequence of marshal-serialized python objects:
+ header: (FORMAT_TAG, FORMAT_VERSION, store_version, timestamp, use_file_ids)
+ sections: for each of software_versions, partitions, groups, sites, quotas, and datasets,
+           the section name followed by lists of records and a closing None.
+Objects are referenced by their position in the file (not by store ids) so that the
+snapshot is self-contained. A dataset record carries its blocks and its replicas.
+
+The journal is a companion append-only file of update batches applied to the inventory
+after the snapshot was taken:
+ (version_before, version_after, [(cmd, code), ...])
+"""
+
+import os
+import time
+import marshal
+import logging
+
+from dynamo.dataformat import Dataset, Block, Site, SitePartition, Group, DatasetReplica, BlockReplica, Partition
+from dynamo.dataformat import IntegrityError
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_TAG = 'dynamo-inventory-snapshot'
+FORMAT_VERSION = 1
+
+# Number of records per marshal.dump call
+CHUNK_SIZE = 10000
+
+class InventorySnapshot(object):
+    """Reader and writer of inventory snapshot and journal files."""
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def write(self, inventory, store_version, reset_journal = True):
+        """
+        Write the full inventory content into the snapshot file and start a new journal.
+        The file is first written to a temporary path and then moved in place.
+
+        @param inventory      DynamoInventory object
+        @param store_version  Version of the store the inventory content corresponds to.
+        @param reset_journal  Empty the journal after writing. When the snapshot is written while updates
+                              are still being journaled (e.g. from a forked process), pass False and call
+                              trim_journal(store_version) once the snapshot is in place.
+        """
+
+        tmp_path = self.path + '.tmp'
+
+        with open(tmp_path, 'wb') as output:
+            marshal.dump((FORMAT_TAG, FORMAT_VERSION, store_version, time.time(), BlockReplica._use_file_ids), output)
+
+            ## Software versions
+            records = [(v.id, v.value) for v in Dataset._software_versions_byid if v.value is not None]
+            self._write_section(output, 'software_versions', records)
+
+            ## Partitions
+            partitions = inventory.partitions.values()
+            records = []
+            for partition in partitions:
+                if partition.subpartitions is None:
+                    subp_names = None
+                else:
+                    subp_names = [p.name for p in partition.subpartitions]
+
+                records.append((partition.name, partition.id, subp_names))
+
+            self._write_section(output, 'partitions', records)
+
+            ## Groups
+            groups = [g for g in inventory.groups.itervalues() if g.name is not None]
+            group_index = {None: -1}
+            records = []
+            for igroup, group in enumerate(groups):
+                group_index[group.name] = igroup
+                records.append((group.name, group.olevel, group.id))
+
+            self._write_section(output, 'groups', records)
+
+            ## Sites
+            sites = inventory.sites.values()
+            site_index = {}
+            records = []
+            for isite, site in enumerate(sites):
+                site_index[site.name] = isite
+                mapping = dict((protocol, m._chains) for protocol, m in site.filename_mapping.iteritems())
+                records.append((site.name, site.host, site.storage_type, site.backend, site.status, mapping, site.id))
+
+            self._write_section(output, 'sites', records)
+
+            ## Quotas
+            records = []
+            for isite, site in enumerate(sites):
+                for partition, site_partition in site.partitions.iteritems():
+                    if partition.subpartitions is None:
+                        records.append((isite, partition.name, site_partition.quota))
+
+            self._write_section(output, 'quotas', records)
+
+            ## Datasets with blocks and replicas
+            def dataset_records():
+                for dataset in inventory.datasets.itervalues():
+                    blocks = list(dataset.blocks)
+                    block_index = dict((block, iblock) for iblock, block in enumerate(blocks))
+
+                    block_records = [(b.name, b.id, b.size, b.num_files, b.is_open, b.last_update) for b in blocks]
+
+                    replica_records = []
+                    for replica in dataset.replicas:
+                        block_replica_records = []
+                        for block_replica in replica.block_replicas:
+                            if block_replica.is_complete():
+                                content = None
+                            else:
+                                content = (block_replica.size, block_replica.file_ids)
+
+                            block_replica_records.append((block_index[block_replica.block], group_index[block_replica.group.name], \
+                                block_replica.is_custodial, block_replica.last_update, content))
+
+                        if replica.growing:
+                            replica_group = group_index[replica.group.name]
+                        else:
+                            replica_group = None
+
+                        replica_records.append((site_index[replica.site.name], replica.growing, replica_group, block_replica_records))
+
+                    yield (dataset.name, dataset.id, dataset.status, dataset.data_type, dataset._software_version_id, \
+                        dataset.last_update, dataset.is_open, block_records, replica_records)
+
+            num_datasets = self._write_section(output, 'datasets', dataset_records())
+
+        os.rename(tmp_path, self.path)
+
+        if reset_journal:
+            # Updates up to now are contained in the snapshot
+            with open(self.journal_path, 'wb'):
+                pass
+
+        return num_datasets
+
+    def read(self, inventory, conditions):
+        """
+        Fill an empty inventory from the snapshot file.
+
+        @param inventory   DynamoInventory object (should be cleared beforehand)
+        @param conditions  {partition name: condition} from the partition definition
+
+        @return Store version the snapshot corresponds to.
+        """
+
+        with open(self.path, 'rb') as source:
+            header = marshal.load(source)
+            if header[0] != FORMAT_TAG or header[1] != FORMAT_VERSION:
+                raise IntegrityError('%s is not an inventory snapshot of format version %d' % (self.path, FORMAT_VERSION))
+
+            store_version, timestamp, use_file_ids = header[2:]
+            if use_file_ids != BlockReplica._use_file_ids:
+                raise IntegrityError('Snapshot %s was written with use_file_ids = %s' % (self.path, use_file_ids))
+
+            LOG.info('Reading inventory snapshot written at %s.', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)))
+
+            ## Software versions
+            versions = list(self._read_section(source, 'software_versions'))
+            if len(versions) == 0:
+                maxid = 0
+            else:
+                maxid = max(vid for vid, _ in versions)
+
+            Dataset._software_versions_byid = [Dataset.SoftwareVersion(None, 0)] * (maxid + 1)
+            Dataset._software_versions_byvalue = {}
+            for vid, value in versions:
+                version = Dataset.SoftwareVersion(value, vid)
+                Dataset._software_versions_byid[vid] = version
+                Dataset._software_versions_byvalue[value] = version
+
+            ## Partitions
+            partition_records = list(self._read_section(source, 'partitions'))
+            for name, pid, subp_names in partition_records:
+                try:
+                    condition = conditions[name]
+                except KeyError:
+                    raise RuntimeError('Condition undefined for partition %s' % name)
+
+                if subp_names is None:
+                    inventory.partitions.add(Partition(name, condition = condition, pid = pid))
+                else:
+                    inventory.partitions.add(Partition(name, pid = pid))
+
+            for name, pid, subp_names in partition_records:
+                if subp_names is None:
+                    continue
+
+                partition = inventory.partitions[name]
+                subpartitions = []
+                for subp_name in subp_names:
+                    subp = inventory.partitions[subp_name]
+                    subp._parent = partition
+                    subpartitions.append(subp)
+
+                partition._subpartitions = tuple(subpartitions)
+
+            ## Groups
+            groups = []
+            for name, olevel, gid in self._read_section(source, 'groups'):
+                group = Group(name, olevel = olevel, gid = gid)
+                inventory.groups.add(group)
+                groups.append(group)
+
+            # index -1 is the null group
+            groups.append(inventory.groups[None])
+
+            ## Sites
+            sites = []
+            for name, host, storage_type, backend, status, mapping, sid in self._read_section(source, 'sites'):
+                site = Site(name, host = host, storage_type = storage_type, backend = backend, status = status, filename_mapping = mapping, sid = sid)
+                inventory.sites.add(site)
+                sites.append(site)
+
+                for partition in inventory.partitions.itervalues():
+                    site.partitions[partition] = SitePartition(site, partition)
+
+            ## Quotas
+            for isite, partition_name, quota in self._read_section(source, 'quotas'):
+                site = sites[isite]
+                site.partitions[inventory.partitions[partition_name]].set_quota(quota)
+
+            ## Datasets with blocks and replicas
+            num_datasets = 0
+            num_block_replicas = 0
+            for name, did, status, data_type, sw_version_id, last_update, is_open, block_records, replica_records in self._read_section(source, 'datasets'):
+                dataset = Dataset(name, status = status, data_type = data_type, last_update = last_update, is_open = is_open, did = did)
+                dataset._software_version_id = sw_version_id
+                inventory.datasets.add(dataset)
+                num_datasets += 1
+
+                blocks = []
+                for bname, bid, size, num_files, b_is_open, b_last_update in block_records:
+                    block = Block(bname, dataset, size = size, num_files = num_files, is_open = b_is_open, last_update = b_last_update, bid = bid)
+                    dataset.blocks.add(block)
+                    blocks.append(block)
+
+                for isite, growing, igroup, block_replica_records in replica_records:
+                    site = sites[isite]
+                    replica = DatasetReplica(dataset, site)
+                    if growing:
+                        replica.growing = True
+                        replica.group = groups[igroup]
+
+                    for iblock, igroup, is_custodial, br_last_update, content in block_replica_records:
+                        block = blocks[iblock]
+                        block_replica = BlockReplica(block, site, groups[igroup], is_custodial = is_custodial, last_update = br_last_update)
+                        if content is not None:
+                            block_replica.size, block_replica.file_ids = content
+
+                        replica.block_replicas.add(block_replica)
+                        block.replicas.add(block_replica)
+
+                    num_block_replicas += len(replica.block_replicas)
+
+                    dataset.replicas.add(replica)
+                    site.add_dataset_replica(replica, add_block_replicas = True)
+
+        LOG.info('Read %d datasets and %d block replicas from the snapshot.', num_datasets, num_block_replicas)
+
+        return store_version
+
+    def append_journal(self, version_before, version_after, update_commands):
+        """
+        Record a batch of update commands applied after the snapshot was written.
+        @param version_before   Store version before the updates.
+        @param version_after    Store version after the updates.
+        @param update_commands  List of (cmd, code)
+        """
+
+        with open(self.journal_path, 'ab') as output:
+            marshal.dump((version_before, version_after, list(update_commands)), output)
+
+    def trim_journal(self, store_version):
+        """
+        Drop the journal entries preceding the given store version, i.e. keep the chain of entries
+        starting from the first one with version_before == store_version.
+        @param store_version  Version of the store the current snapshot corresponds to.
+        """
+
+        entries = []
+        for entry in self.read_journal():
+            if len(entries) == 0 and entry[0] != store_version:
+                continue
+
+            entries.append(entry)
+
+        tmp_path = self.journal_path + '.tmp'
+
+        with open(tmp_path, 'wb') as output:
+            for entry in entries:
+                marshal.dump(entry, output)
+
+        os.rename(tmp_path, self.journal_path)
+
+    def read_journal(self):
+        """
+        Iterate over the journal entries.
+        @return  Generator of (version_before, version_after, update_commands)
+        """
+
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, 'rb') as source:
+            while True:
+                try:
+                    entry = marshal.load(source)
+                except EOFError:
+                    break
+                except ValueError:
+                    # an incomplete entry at the end of the file (e.g. the server died while writing)
+                    LOG.warning('Truncated entry in journal %s.', self.journal_path)
+                    break
+
+                yield entry
+
+    def _write_section(self, output, name, records):
+        marshal.dump(name, output)
+
+        num_records = 0
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == CHUNK_SIZE:
+                marshal.dump(chunk, output)
+                num_records += len(chunk)
+                chunk = []
+
+        if len(chunk) != 0:
+            marshal.dump(chunk, output)
+            num_records += len(chunk)
+
+        marshal.dump(None, output)
+
+        return num_records
+
+    def _read_section(self, source, name):
+        section_name = marshal.load(source)
+        if section_name != name:
+            raise IntegrityError('Expected section %s in %s but found %s' % (name, self.path, section_name))
+
+        while True:
+            chunk = marshal.load(source)
+            if chunk is None:
+                break
+
+            for record in chunk:
+                yield record
@@ -11,7 +11,7 @@ class Block(object):
     Smallest data unit for data management.
     """
 
-    __slots__ = ['_name', '_dataset', 'id', '_size', '_num_files', 'is_open', 'replicas', 'last_update', '_files']
+    __slots__ = ['_name', '_dataset', 'id', '_size', '_num_files', 'is_open', 'replicas', 'last_update', '_files', '_files_index', '_replicas_index']
 
     # Container for the file-set "originals" - Block._files will normally be a weakref pointing to a value of this dict
     _files_cache = collections.OrderedDict()
@@ -40,7 +40,7 @@ class Block(object):
     def num_files(self, value):
         if value != self._num_files:
             self._check_and_load_files(cache = False)
-            self._num_files = value
+            self._set_num_files(value)
 
     @property
     def size(self):
@@ -50,7 +50,7 @@ class Block(object):
     def size(self, value):
         if value != self._size:
             self._check_and_load_files(cache = False)
-            self._size = value
+            self._set_size(value)
 
     @property
     def files(self):
@@ -74,8 +74,12 @@ class Block(object):
         self.id = bid
 
         self.replicas = set()
+        # {site name: replica}, built at the first call to find_replica
+        self._replicas_index = None
 
         self._files = None
+        # {lfn: file}, built at the first call to find_file and dropped when the files are released
+        self._files_index = None
 
     def __str__(self):
         replica_sites = '[%s]' % (','.join([r.site.name for r in self.replicas]))
@@ -116,6 +120,7 @@ class Block(object):
         if block is None:
             block = Block(self._name, dataset, self._size, self._num_files, self.is_open, self.last_update, self.id)
             dataset.blocks.add(block)
+            dataset._index_block(block)
             updated = True
         elif check and (block is self or block == self):
             # identical object -> return False if check is requested
@@ -149,12 +154,15 @@ class Block(object):
         # not unlinking individual files - they are not linked to anything other than this block
 
         self._dataset.blocks.remove(self)
+        self._dataset._unindex_block(self)
 
         try:
             Block._files_cache.pop(self)
         except KeyError:
             pass
 
+        self._files_index = None
+
     def write_into(self, store):
         store.save_block(self)
 
@@ -180,14 +188,24 @@ class Block(object):
         @param lfn        File name
         @param must_find  Raise an exception if file is not found.
         """
-        try:
-            return next(f for f in self.files if f._lfn == lfn)
+        files = self.files
+
+        if self._files is None:
+            # Files are not retained in memory (server side) - index would be discarded immediately
+            try:
+                return next(f for f in files if f._lfn == lfn)
+            except StopIteration:
+                lfile = None
+        else:
+            if self._files_index is None or len(self._files_index) != len(files):
+                self._files_index = dict((f._lfn, f) for f in files)
 
-        except StopIteration:
-            if must_find:
-                raise ObjectError('Cannot find file %s' % str(lfn))
-            else:
-                return None
+            lfile = self._files_index.get(lfn)
+
+        if lfile is None and must_find:
+            raise ObjectError('Cannot find file %s' % str(lfn))
+
+        return lfile
 
     def add_file(self, lfile):
         """
@@ -197,6 +215,9 @@ class Block(object):
         self._check_and_load_files(cache = False)
         self._files.add(lfile)
 
+        if self._files_index is not None:
+            self._files_index[lfile._lfn] = lfile
+
     def remove_file(self, lfile):
         """
         Remove a file from self._files. This function does *not* decrement _num_files or _size.
@@ -208,18 +229,42 @@ class Block(object):
         self._check_and_load_files(cache = False)
         self._files.remove(lfile)
 
+        if self._files_index is not None:
+            self._files_index.pop(lfile._lfn, None)
+
     def find_replica(self, site, must_find = False):
+        if type(site) is str:
+            site_name = site
+        else:
+            site_name = site.name
+
+        # Same logic as Dataset.find_replica
+        if self._replicas_index is None or len(self._replicas_index) != len(self.replicas):
+            self._replicas_index = dict((r.site.name, r) for r in self.replicas)
+
         try:
-            if type(site) is str:
-                return next(r for r in self.replicas if r.site.name == site)
-            else:
-                return next(r for r in self.replicas if r.site == site)
+            replica = self._replicas_index[site_name]
+        except KeyError:
+            replica = None
+        else:
+            if replica not in self.replicas:
+                self._replicas_index = dict((r.site.name, r) for r in self.replicas)
+                replica = self._replicas_index.get(site_name)
 
-        except StopIteration:
-            if must_find:
-                raise ObjectError('Cannot find replica at %s for %s' % (site.name, self.full_name()))
-            else:
-                return None
+        if replica is None and must_find:
+            raise ObjectError('Cannot find replica at %s for %s' % (site_name, self.full_name()))
+
+        return replica
+
+    def _index_replica(self, replica):
+        # called from BlockReplica.embed_into
+        if self._replicas_index is not None:
+            self._replicas_index[replica.site.name] = replica
+
+    def _unindex_replica(self, replica):
+        # called from BlockReplica.unlink
+        if self._replicas_index is not None:
+            self._replicas_index.pop(replica.site.name, None)
 
     def _dataset_name(self):
         if type(self._dataset) is str:
@@ -245,6 +290,7 @@ class Block(object):
                     except ReferenceError:
                         # expired proxy
                         self._files = None
+                        self._files_index = None
     
                 if self._files is None:
                     files = frozenset(self._load_files())
@@ -255,7 +301,9 @@ class Block(object):
 
                     while len(Block._files_cache) >= Block._MAX_FILES_CACHE_DEPTH:
                         # Keep _files_cache FIFO to Block._MAX_FILES_CACHE_DEPTH
-                        Block._files_cache.popitem(last = False)
+                        # The file index of the evicted block would keep the files alive - drop it too
+                        evicted, _ = Block._files_cache.popitem(last = False)
+                        evicted._files_index = None
 
                     Block._files_cache[self] = files
                     self._files = weakref.proxy(files)
@@ -270,6 +318,7 @@ class Block(object):
                     except ReferenceError:
                         # expired proxy
                         self._files = None
+                        self._files_index = None
 
                     try:
                         Block._files_cache.pop(self)
@@ -307,7 +356,33 @@ class Block(object):
             # updating file parameters -> need to load files permanently
             self._check_and_load_files(cache = False)
 
-        self._size = other._size
-        self._num_files = other._num_files
+        if self._size != other._size:
+            self._set_size(other._size)
+
+        if self._num_files != other._num_files:
+            self._set_num_files(other._num_files)
+
+    def _set_size(self, value):
+        # logical sizes of the replicas enter the occupancy counters of site partitions
+        for replica in self.replicas:
+            replica.site.count_block_replica(replica, -1)
+
+        if type(self._dataset) is not str and self in self._dataset.blocks:
+            self._dataset._add_block_sizes(0, value - self._size, 0)
+
+        self._size = value
+
+        for replica in self.replicas:
+            replica.site.count_block_replica(replica, 1)
+
+            dataset_replica = replica.site.find_dataset_replica(self._dataset)
+            if dataset_replica is not None:
+                dataset_replica.invalidate_size()
+
+    def _set_num_files(self, value):
+        if type(self._dataset) is not str and self in self._dataset.blocks:
+            self._dataset._add_block_sizes(0, 0, value - self._num_files)
+
+        self._num_files = value
 
 customize_block(Block)
@@ -169,7 +169,9 @@ class BlockReplica(object):
     
             dataset_replica = site.find_dataset_replica(dataset, must_find = True)
             dataset_replica.block_replicas.add(replica)
+            dataset_replica.invalidate_size()
             block.replicas.add(replica)
+            block._index_replica(replica)
             site.add_block_replica(replica)
 
             updated = True
@@ -177,6 +179,9 @@ class BlockReplica(object):
             # identical object -> return False if check is requested
             pass
         else:
+            # size and group can change - take the replica out of the occupancy counters while updating
+            site.count_block_replica(replica, -1)
+
             replica.copy(self)
             if type(self.group) is str or self.group is None:
                 # can happen if self is an unlinked clone
@@ -185,7 +190,13 @@ class BlockReplica(object):
                 # self represents a full block replica without the knowledge of the actual size (again an unlinked clone)
                 replica.size = block.size
 
-            site.update_partitioning(replica)
+            site._update_block_replica_partitioning(replica)
+            site.count_block_replica(replica, 1)
+
+            dataset_replica = site.find_dataset_replica(dataset)
+            if dataset_replica is not None:
+                dataset_replica.invalidate_size()
+
             updated = True
 
         if check:
@@ -209,6 +220,8 @@ class BlockReplica(object):
         if dataset_replica is None:
             dataset_replica = self._site.find_dataset_replica(self._block._dataset, must_find = True)
 
+        self._site.count_block_replica(self, -1)
+
         for site_partition in self._site.partitions.itervalues():
             try:
                 block_replicas = site_partition.replicas[dataset_replica]
@@ -230,6 +243,7 @@ class BlockReplica(object):
                 site_partition.replicas.pop(dataset_replica)
 
         dataset_replica.block_replicas.remove(self)
+        dataset_replica.invalidate_size()
 
         if unlink_dataset_replica and len(dataset_replica.block_replicas) == 0:
             # Cannot be growing in this case. We want to trigger its deletion.
@@ -239,6 +253,7 @@ class BlockReplica(object):
             dataset_replica.unlink()
 
         self._block.replicas.remove(self)
+        self._block._unindex_replica(self)
 
     def write_into(self, store):
         if BlockReplica._use_file_ids and self.file_ids is not None:
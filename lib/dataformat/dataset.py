@@ -10,7 +10,7 @@ class Dataset(object):
 
     __slots__ = ['_name', 'id', 'status', 'data_type',
         '_software_version_id', 'last_update', 'is_open',
-        'blocks', 'replicas', 'attr']
+        'blocks', 'replicas', 'attr', '_blocks_index', '_replicas_index', '_sizes']
 
     _statuses = ['unknown', 'deleted', 'deprecated', 'invalid', 'production', 'valid', 'ignored']
     STAT_UNKNOWN, STAT_DELETED, STAT_DEPRECATED, STAT_INVALID, STAT_PRODUCTION, STAT_VALID, STAT_IGNORED = range(1, len(_statuses) + 1)
@@ -65,11 +65,11 @@ class Dataset(object):
 
     @property
     def size(self):
-        return sum(b.size for b in self.blocks)
+        return self._get_sizes()[1]
 
     @property
     def num_files(self):
-        return sum(b.num_files for b in self.blocks)
+        return self._get_sizes()[2]
 
     @property
     def files(self):
@@ -114,6 +114,9 @@ class Dataset(object):
 
         # "transient" members - excluded in __getstate__
         self.attr = {} # freeform key-value pairs
+        self._blocks_index = None # {block name: block}, built at the first call to find_block
+        self._replicas_index = None # {site name: replica}, built at the first call to find_replica
+        self._sizes = None # [number of blocks, size, num_files], computed at the first access to size or num_files
 
     def __str__(self):
         replica_sites = '[%s]' % (','.join([r.site.name for r in self.replicas]))
@@ -138,8 +141,11 @@ class Dataset(object):
         return not self.__eq__(other)
 
     def __getstate__(self):
-        state = dict((s, getattr(self, s)) for s in Dataset.__slots__ if s != 'attr')
+        state = dict((s, getattr(self, s)) for s in Dataset.__slots__ if s not in ('attr', '_blocks_index', '_replicas_index', '_sizes'))
         state['attr'] = {}
+        state['_blocks_index'] = None
+        state['_replicas_index'] = None
+        state['_sizes'] = None
         return state
 
     def __setstate__(self, state):
@@ -201,14 +207,47 @@ class Dataset(object):
         store.delete_dataset(self)
 
     def find_block(self, block_name, must_find = False):
+        # Blocks can be added to or removed from the set without going through Block.embed_into / unlink
+        # (e.g. when loading the inventory). Rebuild the index if it is obviously out of sync.
+        if self._blocks_index is None or len(self._blocks_index) != len(self.blocks):
+            self._blocks_index = dict((b.name, b) for b in self.blocks)
+
         try:
-            return next(b for b in self.blocks if b.name == block_name)
-        except StopIteration:
+            return self._blocks_index[block_name]
+        except KeyError:
             if must_find:
                 raise ObjectError('Could not find block %s in %s', block_name, self._name)
             else:
                 return None
 
+    def _index_block(self, block):
+        # called from Block.embed_into
+        if self._blocks_index is not None:
+            self._blocks_index[block.name] = block
+
+        self._add_block_sizes(1, block.size, block.num_files)
+
+    def _unindex_block(self, block):
+        # called from Block.unlink
+        if self._blocks_index is not None:
+            self._blocks_index.pop(block.name, None)
+
+        self._add_block_sizes(-1, -block.size, -block.num_files)
+
+    def _get_sizes(self):
+        # Blocks can be added to or removed from the set directly (see find_block); recompute if the count disagrees
+        if self._sizes is None or self._sizes[0] != len(self.blocks):
+            self._sizes = [len(self.blocks), sum(b.size for b in self.blocks), sum(b.num_files for b in self.blocks)]
+
+        return self._sizes
+
+    def _add_block_sizes(self, num_blocks, size, num_files):
+        # called when blocks are added, removed, or resized
+        if self._sizes is not None:
+            self._sizes[0] += num_blocks
+            self._sizes[1] += size
+            self._sizes[2] += num_files
+
     def find_file(self, path, must_find = False):
         for block in self.blocks:
             f = block.find_file(path)
@@ -221,16 +260,37 @@ class Dataset(object):
             return None
 
     def find_replica(self, site, must_find = False):
+        if type(site) is str:
+            site_name = site
+        else:
+            site_name = site.name
+
+        # See find_block for the rebuild condition. A hit is also checked because the loaders clear and refill the set.
+        if self._replicas_index is None or len(self._replicas_index) != len(self.replicas):
+            self._replicas_index = dict((r.site.name, r) for r in self.replicas)
+
         try:
-            if type(site) is str:
-                return next(r for r in self.replicas if r.site.name == site)
-            else:
-                return next(r for r in self.replicas if r.site == site)
+            replica = self._replicas_index[site_name]
+        except KeyError:
+            replica = None
+        else:
+            if replica not in self.replicas:
+                self._replicas_index = dict((r.site.name, r) for r in self.replicas)
+                replica = self._replicas_index.get(site_name)
 
-        except StopIteration:
-            if must_find:
-                raise ObjectError('Could not find replica on %s of %s', str(site), self._name)
-            else:
-                return None
+        if replica is None and must_find:
+            raise ObjectError('Could not find replica on %s of %s', str(site), self._name)
+
+        return replica
+
+    def _index_replica(self, replica):
+        # called from DatasetReplica.embed_into
+        if self._replicas_index is not None:
+            self._replicas_index[replica.site.name] = replica
+
+    def _unindex_replica(self, replica):
+        # called from DatasetReplica.unlink
+        if self._replicas_index is not None:
+            self._replicas_index.pop(replica.site.name, None)
 
 customize_dataset(Dataset)
@@ -4,7 +4,7 @@ from group import Group
 class DatasetReplica(object):
     """Represents a dataset replica. Just a container for block replicas."""
 
-    __slots__ = ['_dataset', '_site', 'growing', 'group', 'block_replicas']
+    __slots__ = ['_dataset', '_site', 'growing', 'group', 'block_replicas', '_sizes']
 
     @property
     def dataset(self):
@@ -26,6 +26,9 @@ class DatasetReplica(object):
 
         self.block_replicas = set()
 
+        # [number of block replicas, physical size, logical size], computed at the first call to size()
+        self._sizes = None
+
     def __str__(self):
         if self.growing:
             growing = 'True (%s)' % self._group_name()
@@ -79,6 +82,7 @@ class DatasetReplica(object):
             replica = DatasetReplica(dataset, site, self.growing, group)
     
             dataset.replicas.add(replica)
+            dataset._index_replica(replica)
             site.add_dataset_replica(replica, add_block_replicas = False)
 
             updated = True
@@ -115,9 +119,14 @@ class DatasetReplica(object):
     def unlink(self):
         for site_partition in self._site.partitions.itervalues():
             try:
-                site_partition.replicas.pop(self)
+                block_replicas = site_partition.replicas.pop(self)
             except KeyError:
-                pass
+                continue
+
+            if block_replicas is None:
+                block_replicas = self.block_replicas
+
+            site_partition._add_size(-sum(br.size for br in block_replicas), -sum(br.block.size for br in block_replicas))
 
         self._site._dataset_replicas.pop(self._dataset)
 
@@ -125,6 +134,7 @@ class DatasetReplica(object):
             block_replica.unlink(dataset_replica = self, unlink_dataset_replica = False)
 
         self._dataset.replicas.remove(self)
+        self._dataset._unindex_replica(self)
 
     def write_into(self, store):
         store.save_datasetreplica(self)
@@ -166,10 +176,21 @@ class DatasetReplica(object):
             return max(br.last_update for br in self.block_replicas)
 
     def size(self, physical = True):
+        # block_replicas can be modified directly; recompute if the count disagrees
+        if self._sizes is None or self._sizes[0] != len(self.block_replicas):
+            self._sizes = [len(self.block_replicas), sum(r.size for r in self.block_replicas), sum(r.block.size for r in self.block_replicas)]
+
         if physical:
-            return sum(r.size for r in self.block_replicas)
+            return self._sizes[1]
         else:
-            return sum(r.block.size for r in self.block_replicas)
+            return self._sizes[2]
+
+    def invalidate_size(self):
+        """
+        Discard the cached size. Must be called when the size of a block replica or its block changes.
+        """
+
+        self._sizes = None
 
     def find_block_replica(self, block, must_find = False):
         try:
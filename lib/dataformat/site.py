@@ -223,10 +223,18 @@ class Site(object):
 
         if add_block_replicas:
             for partition, site_partition in self.partitions.iteritems():
+                if replica in site_partition.replicas:
+                    # previous content of the partition is unknown
+                    site_partition.reset_occupancy()
+
                 block_replicas = set()
+                physical_size = 0
+                logical_size = 0
                 for block_replica in replica.block_replicas:
                     if partition.contains(block_replica):
                         block_replicas.add(block_replica)
+                        physical_size += block_replica.size
+                        logical_size += block_replica.block.size
     
                 if len(block_replicas) == 0:
                     continue
@@ -236,6 +244,8 @@ class Site(object):
                 else:
                     site_partition.replicas[replica] = block_replicas
 
+                site_partition._add_size(physical_size, logical_size)
+
     def add_block_replica(self, replica):
         # this function should be called automatically to avoid integrity errors
         try:
@@ -269,6 +279,42 @@ class Site(object):
                     # replica will not make the dataset replica in this partition complete
                     block_replica_list.add(replica)
 
+        # The replica was already in dataset_replica.block_replicas but was not counted yet
+        self.count_block_replica(replica, 1)
+
+    def count_block_replica(self, replica, sign):
+        """
+        Add (sign = 1) or subtract (sign = -1) the size of the block replica to / from the occupancy
+        counters of the site partitions that currently include it.
+        """
+
+        try:
+            dataset_replica = self._dataset_replicas[replica.block.dataset]
+        except KeyError:
+            return
+
+        for site_partition in self.partitions.itervalues():
+            try:
+                block_replicas = site_partition.replicas[dataset_replica]
+            except KeyError:
+                continue
+
+            if block_replicas is None:
+                # all block replicas of the dataset replica are in the partition
+                block_replicas = dataset_replica.block_replicas
+
+            if replica in block_replicas:
+                site_partition._add_size(sign * replica.size, sign * replica.block.size)
+
+    def reset_occupancy(self):
+        """
+        Discard the occupancy counters of all site partitions. Call after modifying the replica
+        contents of the partitions without going through the Site and replica methods.
+        """
+
+        for site_partition in self.partitions.itervalues():
+            site_partition.reset_occupancy()
+
     def update_partitioning(self, replica):
         if replica.site is not self:
             raise ObjectError('%s passed to update_partitioning of %s' % (str(replica), str(self)))
@@ -277,6 +323,9 @@ class Site(object):
             if replica not in self._dataset_replicas:
                 return
 
+            # block replicas may have been added or removed without accounting
+            self.reset_occupancy()
+
             for partition, site_partition in self.partitions.iteritems():
                 try:
                     block_replicas = site_partition.replicas[replica]
@@ -321,46 +370,56 @@ class Site(object):
 
         else:
             # BlockReplica
-            dataset_replica = self.find_dataset_replica(replica.block.dataset)
+            # Only the membership of this block replica changes - take it out of the counters and add back in
+            self.count_block_replica(replica, -1)
+            self._update_block_replica_partitioning(replica)
+            self.count_block_replica(replica, 1)
 
-            if dataset_replica is None:
-                return
+    def _update_block_replica_partitioning(self, replica):
+        """
+        Partitioning part of update_partitioning(block_replica) without the occupancy accounting.
+        """
 
-            for partition, site_partition in self.partitions.iteritems():
-                try:
-                    block_replicas = site_partition.replicas[dataset_replica]
-                except KeyError:
-                    block_replicas = set()
+        dataset_replica = self.find_dataset_replica(replica.block.dataset)
 
-                if partition.contains(replica):
-                    if block_replicas is None or replica in block_replicas:
-                        # already included
-                        continue
-                    else:
-                        block_replicas.add(replica)
-                else:
-                    if block_replicas is None:
-                        # this dataset replica used to be fully included but now it's not
-                        # make a copy of the full list of block replicas
-                        block_replicas = set(dataset_replica.block_replicas)
-                        block_replicas.remove(replica)
-                    else:
-                        try:
-                            block_replicas.remove(replica)
-                        except KeyError:
-                            # not included already
-                            pass
+        if dataset_replica is None:
+            return
 
-                if len(block_replicas) == 0:
+        for partition, site_partition in self.partitions.iteritems():
+            try:
+                block_replicas = site_partition.replicas[dataset_replica]
+            except KeyError:
+                block_replicas = set()
+
+            if partition.contains(replica):
+                if block_replicas is None or replica in block_replicas:
+                    # already included
+                    continue
+                else:
+                    block_replicas.add(replica)
+            else:
+                if block_replicas is None:
+                    # this dataset replica used to be fully included but now it's not
+                    # make a copy of the full list of block replicas
+                    block_replicas = set(dataset_replica.block_replicas)
+                    block_replicas.remove(replica)
+                else:
                     try:
-                        site_partition.replicas.pop(dataset_replica)
+                        block_replicas.remove(replica)
                     except KeyError:
+                        # not included already
                         pass
 
-                elif block_replicas == dataset_replica.block_replicas:
-                    site_partition.replicas[dataset_replica] = None
-                else:
-                    site_partition.replicas[dataset_replica] = block_replicas
+            if len(block_replicas) == 0:
+                try:
+                    site_partition.replicas.pop(dataset_replica)
+                except KeyError:
+                    pass
+
+            elif block_replicas == dataset_replica.block_replicas:
+                site_partition.replicas[dataset_replica] = None
+            else:
+                site_partition.replicas[dataset_replica] = block_replicas
 
     def to_pfn(self, lfn, protocol):
         try:
@@ -5,7 +5,10 @@ from exceptions import ObjectError, IntegrityError
 class SitePartition(object):
     """State of a partition at a site."""
 
-    __slots__ = ['_site', '_partition', '_quota', 'replicas']
+    __slots__ = ['_site', '_partition', '_quota', 'replicas', '_physical_size', '_logical_size']
+
+    # If True, occupancy_fraction() verifies the running size counters against a full recount
+    verify_occupancy = False
 
     @property
     def site(self):
@@ -38,6 +41,10 @@ class SitePartition(object):
         self._quota = quota
         # {dataset_replica: set(block_replicas) or None (if all blocks are in)}
         self.replicas = {}
+        # Running totals of the replica sizes. None -> not counted yet (done at the first use)
+        # Kept up to date by Site and the replica objects; call reset_occupancy() after modifying replicas directly.
+        self._physical_size = None
+        self._logical_size = None
 
     def __str__(self):
         if type(self._partition) is str:
@@ -129,16 +136,56 @@ class SitePartition(object):
         elif quota < 0:
             return 0.
         else:
-            total_size = 0.
-            for replica, block_replicas in self.replicas.iteritems():
-                if block_replicas is None:
-                    total_size += replica.size(physical = physical)
-                elif physical:
-                    total_size += sum(br.size for br in block_replicas)
-                else:
-                    total_size += sum(br.block.size for br in block_replicas)
-
-            return total_size / quota
+            if self._physical_size is None:
+                self._physical_size, self._logical_size = self._count_sizes()
+            elif SitePartition.verify_occupancy:
+                self.check_occupancy()
+
+            if physical:
+                total_size = self._physical_size
+            else:
+                total_size = self._logical_size
+
+            return float(total_size) / quota
+
+    def reset_occupancy(self):
+        """
+        Discard the size counters. They will be recounted at the next call to occupancy_fraction.
+        """
+
+        self._physical_size = None
+        self._logical_size = None
+
+    def check_occupancy(self):
+        """
+        Verify the size counters against a full recount.
+        """
+
+        if self._physical_size is None:
+            return
+
+        sizes = self._count_sizes()
+        if sizes != (self._physical_size, self._logical_size):
+            raise IntegrityError('Occupancy counters of %s/%s (physical %d, logical %d) do not match the content (physical %d, logical %d)' % \
+                (self._site_name(), self._partition_name(), self._physical_size, self._logical_size, sizes[0], sizes[1]))
+
+    def _add_size(self, physical, logical):
+        if self._physical_size is not None:
+            self._physical_size += physical
+            self._logical_size += logical
+
+    def _count_sizes(self):
+        physical_size = 0
+        logical_size = 0
+        for replica, block_replicas in self.replicas.iteritems():
+            if block_replicas is None:
+                block_replicas = replica.block_replicas
+
+            for block_replica in block_replicas:
+                physical_size += block_replica.size
+                logical_size += block_replica.block.size
+
+        return physical_size, logical_size
 
     def embed_tree(self, inventory):
         if self._partition._subpartitions is not None:
@@ -3,6 +3,7 @@ import fnmatch
 import random
 
 from dynamo.dataformat import Site, BlockReplica
+from dynamo.dealer.destinations import DestinationIndex
 
 LOG = logging.getLogger(__name__)
 
@@ -43,16 +44,45 @@ class DealerPolicy(object):
 
         # To be set at runtime
         self.target_sites = set()
+        # {partition: DestinationIndex} of the target sites
+        self._destination_indices = {}
+        # {block: True if the block is available in full from its replicas}, valid for one cycle
+        self._block_completeness = {}
 
     def set_target_sites(self, sites, partition):
         """
+        Called at the beginning of each cycle. Also resets the block completeness cache.
         @param sites   List of Site objects
         """
 
+        self._block_completeness.clear()
+
         for site in sites:
             if self.is_target_site(site.partitions[partition]):
                 self.target_sites.add(site)
 
+        self._destination_indices[partition] = DestinationIndex(self.target_sites, partition)
+
+    def remove_target_site(self, site):
+        self.target_sites.remove(site)
+        for index in self._destination_indices.itervalues():
+            index.remove(site)
+
+    def book_destination(self, site, partition, volume):
+        """
+        Reduce the free space of the site seen by find_destination_for.
+        @param site       Destination site
+        @param partition  Partition
+        @param volume     Volume to be copied to the site in this cycle
+        """
+
+        try:
+            index = self._destination_indices[partition]
+        except KeyError:
+            return
+
+        index.book(site, volume)
+
     def is_target_site(self, site_partition, additional_volume = 0.):
         site = site_partition.site
         quota = site_partition.quota
@@ -124,86 +154,45 @@ class DealerPolicy(object):
         return True
 
     def validate_source(self, request):
-        if request.blocks is not None:
-            for block in request.blocks:
-                for replica in block.replicas:
-                    if replica.is_complete():
-                        break
-                else:
-                    # no block complete
-                    if BlockReplica._use_file_ids:
-                        # can determine completion at file level
-                        block_files = set(f.id for f in block.files)
-                        replica_files = set()
-                        for replica in block.replicas:
-                            if replica.file_ids is None:
-                                # can't happen but hey
-                                replica_files = block_files
-                                break
-                            else:
-                                replica_files.update(replica.file_ids)
-
-                        if block_files != replica_files:
-                            # some files missing
-                            return False
-                    else:
-                        return False
+        """
+        Check that every block of the requested item has a complete source, i.e. that the block is
+        either fully replicated at a site or the partial replicas together cover all of its files.
+        Block completeness is cached for the duration of the cycle (see set_target_sites).
+        @param request  DealerRequest
 
-        elif request.block is not None:
-            for replica in request.block.replicas:
-                if replica.is_complete():
-                    break
-            else:
-                # no block complete
-                if BlockReplica._use_file_ids:
-                    # can determine completion at file level
-                    block_files = set(f.id for f in request.block.files)
-                    replica_files = set()
-                    for replica in request.block.replicas:
-                        if replica.file_ids is None:
-                            # can't happen but hey
-                            replica_files = block_files
-                            break
-                        else:
-                            replica_files.update(replica.file_ids)
-
-                    if block_files != replica_files:
-                        # some files missing
-                        return False
-                else:
-                    return False
+        @return True if the item can be copied.
+        """
 
+        if request.blocks is not None:
+            blocks = request.blocks
+        elif request.block is not None:
+            blocks = [request.block]
         else:
-            replica_blocks = set()
-            for replica in request.dataset.replicas:
-                if replica.is_complete():
-                    return True
-
-                for block_replica in replica.block_replicas:
-                    if block_replica.is_complete():
-                        replica_blocks.add(block_replica.block)
-
-            if request.dataset.blocks == replica_blocks:
-                return True
-
-            if BlockReplica._use_file_ids:
-                # some blocks missing - go to file level
-                dataset_files = set(f.id for f in request.dataset.files)
-                replica_files = set()
-                for replica in request.dataset.replicas:
-                    for block_replica in replica.block_replicas:
-                        replica_files.update(f.id for f in block_replica.files())
-    
-                if dataset_files != replica_files:
-                    return False
-            else:
+            blocks = request.dataset.blocks
+
+        for block in blocks:
+            if not self._block_source_complete(block):
                 return False
 
         return True
 
     def find_destination_for(self, request, partition, candidates = None):
+        """
+        Choose a destination randomly with probability proportional to the free fraction of the quota.
+        @param request     DealerRequest. Destination is set when found.
+        @param partition   Partition
+        @param candidates  List of candidate sites. If None, target sites are used.
+
+        @return None if a destination is found, otherwise the reason of rejection.
+        """
+
         if candidates is None:
-            candidates = self.target_sites
+            try:
+                index = self._destination_indices[partition]
+            except KeyError:
+                candidates = self.target_sites
+            else:
+                return self._draw_destination(request, index)
 
         item_size = request.item_size()
 
@@ -248,6 +237,58 @@ class DealerPolicy(object):
 
         return None
 
+    def _draw_destination(self, request, index):
+        # only the sites with a replica of the item can already hold it
+        if request.block is not None:
+            sites = [r.site for r in request.block.replicas]
+        elif request.blocks is not None:
+            sites = [r.site for r in request.blocks[0].replicas]
+        else:
+            sites = [r.site for r in request.dataset.replicas]
+
+        excluded = set(site for site in sites if site in index and request.item_already_exists(site) != 0)
+
+        site = index.draw(request.item_size(), excluded, accept = lambda site: self.is_allowed_destination(request, site))
+
+        if site is None:
+            LOG.warning('%s has no copy destination.', request.item_name())
+            return 'No destination available'
+
+        request.destination = site
+
+        return None
+
+    def _block_source_complete(self, block):
+        try:
+            return self._block_completeness[block]
+        except KeyError:
+            pass
+
+        complete = False
+
+        if BlockReplica._use_file_ids:
+            # file_ids is None for a complete replica; otherwise partial replicas can complement each other.
+            # Comparing the number of distinct file ids with Block.num_files avoids loading the file list.
+            file_ids = set()
+            for replica in block.replicas:
+                if replica.is_complete():
+                    complete = True
+                    break
+
+                file_ids.update(replica.file_ids)
+            else:
+                complete = (len(file_ids) == block.num_files)
+
+        else:
+            for replica in block.replicas:
+                if replica.is_complete():
+                    complete = True
+                    break
+
+        self._block_completeness[block] = complete
+
+        return complete
+
     def check_destination(self, request, partition):
         if request.destination not in self.target_sites:
             LOG.debug('Destination %s for %s is not a target site.', request.destination.name, request.item_name())
@@ -0,0 +1,156 @@
+import logging
+import random
+
+from dynamo.utils.sampling import WeightedSampler
+
+LOG = logging.getLogger(__name__)
+
+# Number of rejections in one draw after which the candidates are weighted explicitly
+MAX_REJECTIONS = 100
+
+class DestinationIndex(object):
+    """
+    Copy destination candidates in a partition, drawn at random with probabilities proportional to
+    the fraction of the quota that would remain free after placing the item. Sites without a positive
+    quota have a fixed weight of 1.
+    The sampler holds the free fractions of the sites without the item; the item size is accounted for
+    by accepting a drawn site with probability (free - size) / free, which makes the draw exact.
+    """
+
+    def __init__(self, sites, partition):
+        """
+        @param sites      Candidate sites
+        @param partition  Partition
+        """
+
+        self.partition = partition
+
+        # {site: free volume}; None if the site has no positive quota
+        self._free = {}
+
+        weights = []
+        for site in sites:
+            site_partition = site.partitions[partition]
+            quota = site_partition.quota
+
+            if quota > 0.:
+                free = quota * (1. - site_partition.occupancy_fraction(physical = False))
+            else:
+                free = None
+
+            self._free[site] = free
+            weights.append((site, self._weight(site, free)))
+
+        self._sampler = WeightedSampler(weights)
+
+    def __contains__(self, site):
+        return site in self._free
+
+    def book(self, site, volume):
+        """
+        Reduce the free space of the site.
+        @param site    Site
+        @param volume  Volume to be copied to the site
+        """
+
+        try:
+            free = self._free[site]
+        except KeyError:
+            return
+
+        if free is None:
+            return
+
+        free -= volume
+        self._free[site] = free
+        self._sampler.set_weight(site, self._weight(site, free))
+
+    def remove(self, site):
+        if site in self._free:
+            self._free.pop(site)
+            self._sampler.remove(site)
+
+    def draw(self, size, excluded = set(), accept = None):
+        """
+        @param size      Size of the item to place
+        @param excluded  Sites that cannot receive the item
+        @param accept    If not None, a function that takes a site and returns False if the site cannot receive the item.
+
+        @return  A site or None if no site can receive the item.
+        """
+
+        # sites taken out of the sampler during this draw; [(site, weight)]
+        held_out = []
+
+        num_rejections = 0
+
+        try:
+            while len(self._sampler) != 0:
+                site = self._sampler.sample()
+                free = self._free[site]
+
+                # a site the item would fill completely has zero weight
+                if site in excluded or (free is not None and free <= size) or (accept is not None and not accept(site)):
+                    held_out.append((site, self._sampler.weight(site)))
+                    self._sampler.remove(site)
+                    continue
+
+                if free is not None and random.random() * free >= free - size:
+                    # rejected in proportion to the volume the item takes
+                    num_rejections += 1
+                    if num_rejections == MAX_REJECTIONS:
+                        # the remaining candidates barely fit the item; avoid spinning
+                        return self._draw_weighted(size, excluded, accept)
+
+                    continue
+
+                return site
+
+            return None
+
+        finally:
+            for site, weight in held_out:
+                self._sampler.set_weight(site, weight)
+
+    def _draw_weighted(self, size, excluded, accept):
+        """
+        Draw from the sites remaining in the sampler with the exact weights (free - size) / quota.
+        Same distribution as draw() at a cost linear in the number of sites.
+        """
+
+        candidates = []
+        total = 0.
+        for site, free in self._free.iteritems():
+            if site not in self._sampler or site in excluded:
+                continue
+
+            if free is None:
+                weight = 1.
+            elif free <= size:
+                continue
+            else:
+                weight = (free - size) / site.partitions[self.partition].quota
+
+            if accept is not None and not accept(site):
+                continue
+
+            candidates.append((site, weight))
+            total += weight
+
+        x = random.random() * total
+        for site, weight in candidates:
+            x -= weight
+            if x < 0.:
+                return site
+
+        if len(candidates) != 0:
+            # rounding error
+            return candidates[-1][0]
+
+        return None
+
+    def _weight(self, site, free):
+        if free is None:
+            return 1.
+        else:
+            return max(free, 0.) / site.partitions[self.partition].quota
@@ -3,7 +3,6 @@ import datetime
 import collections
 import fnmatch
 import logging
-import random
 
 from dynamo.dataformat import Dataset, DatasetReplica, BlockReplica
 from dynamo.dataformat.history import CopiedReplica, HistoryRecord
@@ -11,6 +10,7 @@ from dynamo.dealer.dealerpolicy import DealerPolicy
 from dynamo.dealer.history import DealerHistory
 from dynamo.operation.copy import CopyInterface
 from dynamo.utils.signaling import SignalBlocker
+from dynamo.utils.sampling import WeightedSampler
 from dynamo.policy.producers import get_producers
 from dynamo.policy.condition import Condition
 from dynamo.policy.variables import site_variables
@@ -187,7 +187,8 @@ class Dealer(object):
         # Default group for newly created replicas
         default_group = inventory.groups[self.policy.group_name]
 
-        reqlists = {} # {plugin: reqlist} reqlist is [DealerRequest]
+        reqlists = {} # {plugin: reqlist} reqlist is deque([DealerRequest])
+        plugin_weights = []
 
         for plugin, priority in self._plugin_priorities.items():
             if priority == 0:
@@ -200,7 +201,11 @@ class Dealer(object):
             LOG.debug('%s requesting %d items', plugin.name, len(plugin_requests))
 
             if len(plugin_requests) != 0:
-                reqlists[plugin] = plugin_requests
+                reqlists[plugin] = collections.deque(plugin_requests)
+                plugin_weights.append((plugin, 1. / priority))
+
+        # Plugins are picked at random with probabilities proportional to 1 / priority
+        sampler = WeightedSampler(plugin_weights)
 
         # Flattened list of (DealerRequest, plugin)
         requests = []
@@ -211,26 +216,16 @@ class Dealer(object):
             'Dataset is not valid': 0
         }
 
-        while len(reqlists) != 0:
-            # Classic weighted random-picking algorithm
-            plugins = reqlists.keys()
-
-            pvalues = [1. / self._plugin_priorities[p] for p in plugins]
-            sums = [sum(pvalues[:i + 1]) for i in range(len(pvalues))]
-
-            # Select k if sum(w_{i})_{i <= k-1} w_{k} < x < sum(w_{i})_{i <= k} for x in Uniform(0, sum(w_{i}))
-            x = random.uniform(0., sums[-1])
-
-            # Index of the selected plugin
-            ip = next(k for k in range(len(sums)) if x < sums[k])
-            plugin = plugins[ip]
+        while len(sampler) != 0:
+            plugin = sampler.sample()
 
             reqlist = reqlists[plugin]
-            request = reqlist.pop(0)
+            request = reqlist.popleft()
 
             if len(reqlist) == 0:
                 LOG.debug('No more requests from %s', plugin.name)
                 reqlists.pop(plugin)
+                sampler.remove(plugin)
 
             # check that there is at least one source (allow it to be incomplete - could be in production)
             no_source = False
@@ -356,10 +351,11 @@ class Dealer(object):
             copy_list[plugin].append(new_replica)
             # New replicas may not be in the target partition, but we add the size up to be conservative
             copy_volumes[request.destination] += request.item_size()
+            self.policy.book_destination(request.destination, partition, request.item_size())
 
             if not self.policy.is_target_site(request.destination.partitions[partition], copy_volumes[request.destination]):
                 LOG.info('%s is not a target site any more.', request.destination.name)
-                self.policy.target_sites.remove(request.destination)
+                self.policy.remove_target_site(request.destination)
 
             if sum(copy_volumes.itervalues()) > self.policy.max_total_cycle_volume:
                 LOG.warning('Total copy volume has exceeded the limit. No more copies will be made.')
@@ -400,12 +396,16 @@ class Dealer(object):
 
                 scheduled_replicas = self.copy_op[site.name].schedule_copies(replicas, history_record.operation_id, comments = comment)
 
+                # all new replicas of the site are committed as one bulk update
+                new_replicas = []
+
                 for replica in scheduled_replicas:
                     history_record.replicas.append(CopiedReplica(replica.dataset.name, replica.size(physical = False), HistoryRecord.ST_ENROUTE))
 
-                    inventory.update(replica)
-                    for block_replica in replica.block_replicas:
-                        inventory.update(block_replica)
+                    new_replicas.append(replica)
+                    new_replicas.extend(replica.block_replicas)
+
+                inventory.update_many(new_replicas)
 
                 self.history.update_entry(history_record)
 
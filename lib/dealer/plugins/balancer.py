@@ -1,5 +1,5 @@
 import logging
-import random
+import heapq
 
 from base import BaseHandler, DealerRequest
 from dynamo.dataformat import Site
@@ -36,10 +36,14 @@ class BalancingHandler(BaseHandler):
 
         partition = inventory.partitions[policy.partition_name]
 
-        protected_fractions = {} # {site: fraction}
-        last_copies = {} # {site: [datasets]}
+        # Heap of sites keyed by the protected fraction (largest first) and per-site heaps of the candidate
+        # datasets (smallest first). Whether a candidate is really a last copy is only checked when it
+        # reaches the top of its heap.
+        site_heap = [] # [(-fraction, site name, site)]
+        candidates = {} # {site: [(size, serial, ds_name, num_rep)]}
+        min_fraction = None
 
-        for site in inventory.sites.values():
+        for site in inventory.sites.itervalues():
             quota = site.partitions[partition].quota
 
             LOG.debug('Site %s quota %f TB', site.name, quota * 1.e-12)
@@ -55,22 +59,17 @@ class BalancingHandler(BaseHandler):
             except KeyError:
                 continue
 
-            protections = [(ds_name, size, reason) for ds_name, size, decision, _, reason in decisions if decision == 'protect']
-            protected_fraction = float(sum(size for _, size, _ in protections)) / quota
+            protected_size = 0
+            site_candidates = []
 
-            LOG.debug('Site %s protected fraction %f', site.name, protected_fraction)
-
-            protected_fractions[site] = protected_fraction
-
-            # sort protected datasets by size (small ones first)
-            protections.sort(key = lambda x: x[1])
+            for ds_name, size, decision, _, reason in decisions:
+                if decision != 'protect':
+                    continue
 
-            last_copies[site] = []
+                protected_size += size
 
-            for ds_name, size, reason in protections:
                 if self.max_dataset_size > 0 and size > self.max_dataset_size:
-                    # protections is ordered -> there are no more
-                    break
+                    continue
 
                 try:
                     num_rep = self.target_reasons[reason]
@@ -78,59 +77,98 @@ class BalancingHandler(BaseHandler):
                     # protected not because it was the last copy
                     continue
 
-                try:
-                    dataset = inventory.datasets[ds_name]
-                except KeyError:
-                    continue
+                site_candidates.append((size, len(site_candidates), ds_name, num_rep))
 
-                if dataset.find_replica(site) is None:
-                    # this replica has disappeared since then
-                    continue
+            protected_fraction = float(protected_size) / quota
+
+            LOG.debug('Site %s protected fraction %f', site.name, protected_fraction)
 
-                num_nonpartial = 0
-                for replica in dataset.replicas:
-                    if replica.site.storage_type == Site.TYPE_MSS:
-                        continue
+            heapq.heapify(site_candidates)
+            candidates[site] = site_candidates
 
-                    if replica.is_partial():
-                        continue
+            site_heap.append((-protected_fraction, site.name, site))
 
-                    if replica in replica.site.partitions[partition].replicas:
-                        num_nonpartial += 1
+            if min_fraction is None or protected_fraction < min_fraction:
+                min_fraction = protected_fraction
 
-                if num_nonpartial <= num_rep:
-                    LOG.debug('%s is a last copy at %s', ds_name, site.name)
-                    last_copies[site].append(dataset)
+        heapq.heapify(site_heap)
 
-        for site, frac in sorted(protected_fractions.items(), key = lambda (s, f): f):
-            LOG.debug('Site %s fraction %f', site.name, frac)
+        if LOG.getEffectiveLevel() == logging.DEBUG:
+            for neg_frac, site_name, _ in sorted(site_heap, reverse = True):
+                LOG.debug('Site %s fraction %f', site_name, -neg_frac)
 
         requests = []
 
         total_size = 0
-        variation = 1.
 
-        while len(protected_fractions) != 0 and (self.max_cycle_volume <= 0. or total_size < self.max_cycle_volume):
-            maxsite, maxfrac = max(protected_fractions.items(), key = lambda x: x[1])
-            minsite, minfrac = min(protected_fractions.items(), key = lambda x: x[1])
+        while len(site_heap) != 0 and (self.max_cycle_volume <= 0. or total_size < self.max_cycle_volume):
+            maxfrac = -site_heap[0][0]
+            maxsite = site_heap[0][2]
 
-            LOG.debug('Protected fraction variation %f', maxfrac - minfrac)
+            LOG.debug('Protected fraction variation %f', maxfrac - min_fraction)
             LOG.debug('Max site: %s', maxsite.name)
 
             # if max - min is less than 5%, we are done
-            if maxfrac - minfrac < 0.05:
+            # (the site with the minimum fraction never changes unless it is the maximum at the same time)
+            if maxfrac - min_fraction < 0.05:
                 break
 
-            try:
-                dataset = last_copies[maxsite].pop(0)
-            except IndexError: # nothing to copy from this site
-                protected_fractions.pop(maxsite)
+            dataset = self._next_last_copy(inventory, maxsite, partition, candidates[maxsite])
+
+            if dataset is None:
+                # nothing to copy from this site
+                heapq.heappop(site_heap)
                 continue
 
             requests.append(DealerRequest(dataset))
 
             size = dataset.size
-            protected_fractions[maxsite] -= float(size) / maxsite.partitions[partition].quota
+            maxfrac -= float(size) / maxsite.partitions[partition].quota
             total_size += size
 
+            heapq.heapreplace(site_heap, (-maxfrac, maxsite.name, maxsite))
+
+            if maxfrac < min_fraction:
+                min_fraction = maxfrac
+
         return requests
+
+    def _next_last_copy(self, inventory, site, partition, site_candidates):
+        """
+        Pop candidates from the heap until a dataset whose replica at the site is a last copy is found.
+        @param inventory        DynamoInventory
+        @param site             Site
+        @param partition        Partition
+        @param site_candidates  Heap of (size, serial, dataset name, number of replicas considered last copies)
+
+        @return A Dataset or None if the heap is exhausted.
+        """
+
+        while len(site_candidates) != 0:
+            _, _, ds_name, num_rep = heapq.heappop(site_candidates)
+
+            try:
+                dataset = inventory.datasets[ds_name]
+            except KeyError:
+                continue
+
+            if dataset.find_replica(site) is None:
+                # this replica has disappeared since then
+                continue
+
+            num_nonpartial = 0
+            for replica in dataset.replicas:
+                if replica.site.storage_type == Site.TYPE_MSS:
+                    continue
+
+                if replica.is_partial():
+                    continue
+
+                if replica in replica.site.partitions[partition].replicas:
+                    num_nonpartial += 1
+
+            if num_nonpartial <= num_rep:
+                LOG.debug('%s is a last copy at %s', ds_name, site.name)
+                return dataset
+
+        return None
@@ -0,0 +1,92 @@
+import heapq
+import itertools
+
+class CandidateQueue(object):
+    """
+    Priority queue of dataset replicas ordered by a SortKey, supporting removal and key updates.
+    Removed entries are only invalidated and are discarded when they reach the top of the heap.
+    """
+
+    def __init__(self, sort_key):
+        """
+        @param sort_key  Callable returning the ordering key of a replica (smallest first)
+        """
+
+        self.sort_key = sort_key
+
+        # heap of [key, serial, replica]; replica is None for removed entries
+        self._heap = []
+        # {replica: entry}
+        self._entries = {}
+        # serial number breaks ties between equal keys without comparing the replicas
+        self._serial = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, replica):
+        return replica in self._entries
+
+    def __iter__(self):
+        """Iterate over the replicas in the queue in no particular order."""
+        return self._entries.iterkeys()
+
+    def push(self, replica):
+        """
+        Insert the replica, or recompute its key if it is already in the queue.
+        """
+
+        if replica in self._entries:
+            self.remove(replica)
+
+        entry = [self.sort_key(replica), next(self._serial), replica]
+        self._entries[replica] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, replica):
+        entry = self._entries.pop(replica)
+        entry[-1] = None
+
+        # rebuild the heap when it is mostly made of removed entries
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [e for e in self._heap if e[-1] is not None]
+            heapq.heapify(self._heap)
+
+    def discard(self, replica):
+        if replica in self._entries:
+            self.remove(replica)
+
+    def peek(self):
+        """
+        @return  Replica with the smallest key without removing it, or None if the queue is empty.
+        """
+
+        self._prune()
+
+        if len(self._heap) == 0:
+            return None
+
+        return self._heap[0][-1]
+
+    def pop(self):
+        """
+        @return  Replica with the smallest key, or None if the queue is empty.
+        """
+
+        self._prune()
+
+        if len(self._heap) == 0:
+            return None
+
+        replica = heapq.heappop(self._heap)[-1]
+        self._entries.pop(replica)
+
+        return replica
+
+    def clear(self):
+        self._heap = []
+        self._entries = {}
+
+    def _prune(self):
+        while len(self._heap) != 0 and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
@@ -0,0 +1,249 @@
+"""
+Columnar archive of the replica decisions of a Detox cycle.
+
+The file consists of
+ header: marshal-serialized (FORMAT_TAG, FORMAT_VERSION)
+ blocks: for each site, the zlib-compressed little-endian arrays of the columns
+         dataset_id, size, decision, and condition, with rows sorted by dataset_id
+ index:  marshal-serialized {'data_start': offset of the first block, 'decisions': [decision names],
+         'sites': {site_id: (status, quota, number of rows, {decision: volume}, [(offset, length) of the blocks])}}
+ trailer: 8-byte little-endian offset of the index
+A reader only loads the index when opening the file and decompresses the column blocks
+needed for each query.
+"""
+
+import os
+import sys
+import zlib
+import array
+import struct
+import bisect
+import marshal
+import logging
+
+from dynamo.dataformat import IntegrityError
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_TAG = 'dynamo-detox-columnar'
+FORMAT_VERSION = 1
+
+TRAILER_FORMAT = '<Q'
+
+# (name, array typecode)
+COLUMNS = [('dataset_id', 'I'), ('size', 'd'), ('decision', 'B'), ('condition', 'i')]
+
+# Elements of the site entries in the index
+SITE_STATUS, SITE_QUOTA, SITE_NUM_ROWS, SITE_VOLUMES, SITE_BLOCKS = range(5)
+
+class ColumnarSnapshot(object):
+    """Writer and reader of a columnar cycle archive."""
+
+    def __init__(self, path):
+        self.path = path
+
+        # Filled when reading
+        self._index = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def write(self, sites, replicas):
+        """
+        Write the archive. The file is first written to a temporary path and then moved in place.
+        @param sites     Iterable of (site_id, status, quota)
+        @param replicas  Iterable of (site_id, dataset_id, size, decision, condition), ordered by site_id then dataset_id
+        """
+
+        tmp_path = self.path + '.tmp'
+
+        decisions = []
+        decision_codes = {}
+
+        site_entries = {}
+        for site_id, status, quota in sites:
+            site_entries[site_id] = [status, quota, 0, {}, None]
+
+        with open(tmp_path, 'wb') as output:
+            marshal.dump((FORMAT_TAG, FORMAT_VERSION), output)
+
+            data_start = output.tell()
+
+            def write_site(site_id, columns):
+                try:
+                    entry = site_entries[site_id]
+                except KeyError:
+                    entry = site_entries[site_id] = [None, 0, 0, {}, None]
+
+                blocks = []
+                for column in columns:
+                    if sys.byteorder != 'little':
+                        column.byteswap()
+
+                    compressed = zlib.compress(column.tostring())
+                    blocks.append((output.tell() - data_start, len(compressed)))
+                    output.write(compressed)
+
+                entry[SITE_NUM_ROWS] = len(columns[0])
+                entry[SITE_BLOCKS] = blocks
+
+            current_site = None
+            columns = None
+
+            for site_id, dataset_id, size, decision, condition in replicas:
+                if site_id != current_site:
+                    if current_site is not None:
+                        write_site(current_site, columns)
+
+                    current_site = site_id
+                    columns = [array.array(typecode) for _, typecode in COLUMNS]
+
+                try:
+                    code = decision_codes[decision]
+                except KeyError:
+                    code = decision_codes[decision] = len(decisions)
+                    decisions.append(decision)
+
+                columns[0].append(dataset_id)
+                columns[1].append(size)
+                columns[2].append(code)
+                columns[3].append(condition)
+
+                volumes = site_entries.setdefault(site_id, [None, 0, 0, {}, None])[SITE_VOLUMES]
+                try:
+                    volumes[decision] += size
+                except KeyError:
+                    volumes[decision] = size
+
+            if current_site is not None:
+                write_site(current_site, columns)
+
+            index_offset = output.tell()
+            marshal.dump({'data_start': data_start, 'decisions': decisions, 'sites': dict((k, tuple(v)) for k, v in site_entries.iteritems())}, output)
+            output.write(struct.pack(TRAILER_FORMAT, index_offset))
+
+        os.rename(tmp_path, self.path)
+
+    def get_sites(self):
+        """
+        @return {site_id: (status, quota, number of replica rows)}
+        """
+
+        index = self._load_index()
+
+        return dict((site_id, (e[SITE_STATUS], e[SITE_QUOTA], e[SITE_NUM_ROWS])) for site_id, e in index['sites'].iteritems())
+
+    def get_volumes(self):
+        """
+        @return {site_id: {decision: total size}}; read from the index only.
+        """
+
+        index = self._load_index()
+
+        return dict((site_id, dict(e[SITE_VOLUMES])) for site_id, e in index['sites'].iteritems())
+
+    def get_site_replicas(self, site_id):
+        """
+        @param site_id  Site id
+        @return List of (dataset_id, size, decision, condition)
+        """
+
+        columns = self._read_columns(site_id, range(len(COLUMNS)))
+        if columns is None:
+            return []
+
+        decisions = self._index['decisions']
+
+        dataset_ids, sizes, codes, conditions = columns
+        return [(dataset_ids[i], sizes[i], decisions[codes[i]], conditions[i]) for i in xrange(len(dataset_ids))]
+
+    def get_dataset_replicas(self, dataset_id):
+        """
+        Only the dataset_id column of each site is decompressed unless the dataset is found at the site.
+        @param dataset_id  Dataset id
+        @return List of (site_id, size, decision, condition)
+        """
+
+        index = self._load_index()
+        decisions = index['decisions']
+
+        result = []
+
+        for site_id in sorted(index['sites'].iterkeys()):
+            columns = self._read_columns(site_id, [0])
+            if columns is None:
+                continue
+
+            dataset_ids = columns[0]
+            begin = bisect.bisect_left(dataset_ids, dataset_id)
+            end = bisect.bisect_right(dataset_ids, dataset_id, begin)
+            if begin == end:
+                continue
+
+            _, sizes, codes, conditions = self._read_columns(site_id, [1, 2, 3])
+            for irow in xrange(begin, end):
+                result.append((site_id, sizes[irow], decisions[codes[irow]], conditions[irow]))
+
+        return result
+
+    def iterate(self):
+        """
+        @return Generator of (site_id, dataset_id, size, decision, condition) for all replicas
+        """
+
+        index = self._load_index()
+
+        for site_id in sorted(index['sites'].iterkeys()):
+            for row in self.get_site_replicas(site_id):
+                yield (site_id,) + row
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+
+        with open(self.path, 'rb') as source:
+            header = marshal.load(source)
+            if header != (FORMAT_TAG, FORMAT_VERSION):
+                raise IntegrityError('%s is not a columnar Detox archive of format version %d' % (self.path, FORMAT_VERSION))
+
+            trailer_size = struct.calcsize(TRAILER_FORMAT)
+            source.seek(-trailer_size, os.SEEK_END)
+            index_offset = struct.unpack(TRAILER_FORMAT, source.read(trailer_size))[0]
+
+            source.seek(index_offset)
+            self._index = marshal.load(source)
+
+        return self._index
+
+    def _read_columns(self, site_id, icolumns):
+        """
+        @param site_id   Site id
+        @param icolumns  Indices of the columns to read
+        @return List of arrays with None for the columns not read, or None if the site has no replicas.
+        """
+
+        index = self._load_index()
+
+        try:
+            blocks = index['sites'][site_id][SITE_BLOCKS]
+        except KeyError:
+            return None
+
+        if blocks is None:
+            return None
+
+        columns = [None] * len(COLUMNS)
+
+        with open(self.path, 'rb') as source:
+            for icol in icolumns:
+                offset, length = blocks[icol]
+                source.seek(index['data_start'] + offset)
+
+                column = array.array(COLUMNS[icol][1])
+                column.fromstring(zlib.decompress(source.read(length)))
+                if sys.byteorder != 'little':
+                    column.byteswap()
+
+                columns[icol] = column
+
+        return columns
@@ -216,14 +216,28 @@ class DetoxPolicy(object):
 
         self.attr_producers = list(set(get_producers(attr_names, attrs_config).itervalues()))
 
+        # Largest extent of inputs the policy decisions and the candidate ordering depend on (see Attr.SCOPE_*)
+        self.dependency_scope = attrs.Attr.SCOPE_STATIC
+        for line in self.policy_lines:
+            for pred in line.condition.predicates:
+                self.dependency_scope = max(self.dependency_scope, pred.variable.scope)
+        for variable, _ in self.candidate_sort_key.vars:
+            self.dependency_scope = max(self.dependency_scope, variable.scope)
+
         LOG.info('Policy stack for %s: %d lines using dataset attr producers [%s]', \
                  self.partition_name, len(self.policy_lines), ' '.join(type(p).__name__ for p in self.attr_producers))
 
-    def evaluate(self, replica):
+    def evaluate(self, replica, first_line = 0):
+        """
+        @param replica     DatasetReplica
+        @param first_line  Index of the policy line to start the evaluation from (previous lines are known not to match)
+        @return  List of actions
+        """
+
         actions = []
         block_replicas_tmp = set()
 
-        for line in self.policy_lines:
+        for line in self.policy_lines[first_line:]:
             action = line.evaluate(replica)
             if action is None:
                 continue
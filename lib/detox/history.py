@@ -4,15 +4,20 @@ import sqlite3
 import lzma
 import hashlib
 import signal
+import subprocess
 import logging
 
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import Site
 from dynamo.operation.history import DeletionHistoryDatabase
+from dynamo.detox.columnar import ColumnarSnapshot
 from dynamo.dataformat import Configuration
 
 LOG = logging.getLogger(__name__)
 
+# Size of the chunks read when compressing and decompressing snapshot files
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
 class DetoxHistoryBase(DeletionHistoryDatabase):
     """
     Parts of the DetoxHistory that can be used by the web detox monitor.
@@ -36,6 +41,10 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         self.snapshots_spool_dir = config.snapshots_spool_dir
         self.snapshots_archive_dir = config.snapshots_archive_dir
 
+        # xz compression level (0-9) and number of compression threads (0 = number of CPUs) of the archived snapshots
+        self.archive_preset = config.get('archive_preset', 6)
+        self.archive_threads = config.get('archive_threads', 1)
+
     def get_cycles(self, partition, first = -1, last = -1):
         """
         Get a list of deletion cycles in range first <= cycle <= last. If first == -1, pick only the latest before last.
@@ -79,6 +88,22 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         @return {site_name:  (id, status, quota)}
         """
 
+        archive = self._get_columnar_archive(cycle_number)
+        if archive is not None:
+            site_names = dict(self.db.query('SELECT `id`, `name` FROM `sites`'))
+
+            sites_dict = {}
+            for site_id, (status, quota, num_rows) in archive.get_sites().iteritems():
+                if skip_unused and num_rows == 0:
+                    continue
+
+                try:
+                    sites_dict[site_names[site_id]] = (status, quota)
+                except KeyError:
+                    pass
+
+            return sites_dict
+
         self._fill_snapshot_cache('sites', cycle_number)
 
         table_name = 'sites_%d' % cycle_number
@@ -98,16 +123,50 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
 
         return sites_dict
 
-    def get_deletion_decisions(self, cycle_number, size_only = True, decisions = None):
+    def get_deletion_decisions(self, cycle_number, size_only = True, decisions = None, datasets = None):
         """
         @param cycle_number   Cycle number
         @param size_only      Boolean
         @param decisions      If a list, limit to specified decisions
+        @param datasets       If a list, limit to the named datasets (size_only = False only)
         
         @return If size_only = True: a dict {site: (protect_size, delete_size, keep_size)}
                 If size_only = False: a massive dict {site: [(dataset, size, decision, reason)]}
         """
 
+        if type(decisions) is not list:
+            decisions = None
+
+        archive = self._get_columnar_archive(cycle_number)
+        if archive is not None:
+            if size_only:
+                site_names = dict(self.db.query('SELECT `id`, `name` FROM `sites`'))
+
+                product = {}
+                for site_id, volumes in archive.get_volumes().iteritems():
+                    if decisions is not None:
+                        volumes = dict((d, v) for d, v in volumes.iteritems() if d in decisions)
+
+                    if len(volumes) == 0 or site_id not in site_names:
+                        continue
+
+                    product[site_names[site_id]] = tuple(volumes.get(d, 0) * 1.e-12 for d in ['protect', 'delete', 'keep'])
+
+                return product
+
+            if datasets is None:
+                rows = archive.iterate()
+            else:
+                rows = []
+                for dataset_id in self.db.select_many('datasets', 'id', 'name', datasets):
+                    for site_id, size, decision, condition_id in archive.get_dataset_replicas(dataset_id):
+                        rows.append((site_id, dataset_id, size, decision, condition_id))
+
+            if decisions is not None:
+                rows = [r for r in rows if r[3] in decisions]
+
+            return self._name_columnar_rows(rows)
+
         self._fill_snapshot_cache('replicas', cycle_number)
 
         table_name = 'replicas_%d' % cycle_number
@@ -122,7 +181,7 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
             query += ' WHERE r.`decision` LIKE %s'
             query += ' GROUP BY r.`site_id`'
 
-            if type(decisions) is not list:
+            if decisions is None:
                 decisions = ['protect', 'delete', 'keep']
 
             for decision in decisions:
@@ -149,8 +208,13 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
             query += ' INNER JOIN `{0}`.`sites` AS s ON s.`id` = r.`site_id`'.format(self.history_db)
             query += ' INNER JOIN `{0}`.`datasets` AS d ON d.`id` = r.`dataset_id`'.format(self.history_db)
             query += ' LEFT JOIN `{0}`.`policy_conditions` AS p ON p.`id` = r.`condition`'.format(self.history_db)
-            if type(decisions) is list:
-                query += ' WHERE r.`decision` IN (%s)' % ','.join('\'%s\'' % d for d in decisions)
+            conditions = []
+            if decisions is not None:
+                conditions.append('r.`decision` IN (%s)' % ','.join('\'%s\'' % d for d in decisions))
+            if datasets is not None:
+                conditions.append('d.`name` IN %s' % MySQL.stringify_sequence(datasets))
+            if len(conditions) != 0:
+                query += ' WHERE ' + ' AND '.join(conditions)
             query += ' ORDER BY s.`name` ASC, r.`size` DESC'
 
             product = {}
@@ -172,6 +236,17 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         @return  site-specific version of get_deletion_decisions with size_only = False
         """
 
+        archive = self._get_columnar_archive(cycle_number)
+        if archive is not None:
+            site_ids = self.db.query('SELECT `id` FROM `sites` WHERE `name` = %s', site_name)
+            if len(site_ids) == 0:
+                return []
+
+            site_id = site_ids[0]
+            rows = [(site_id,) + row for row in archive.get_site_replicas(site_id)]
+
+            return self._name_columnar_rows(rows).get(site_name, [])
+
         self._fill_snapshot_cache('replicas', cycle_number)
 
         table_name = 'replicas_%d' % cycle_number
@@ -184,6 +259,55 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
 
         return self.db.query(query, site_name)
 
+    def _get_columnar_archive(self, cycle_number):
+        """
+        @return ColumnarSnapshot of the cycle, or None if cycle_number is a partition name or the cycle has no columnar archive.
+        """
+
+        try:
+            cycle_number += 0
+        except TypeError:
+            return None
+
+        archive = ColumnarSnapshot(self._archive_path(cycle_number, 'col'))
+        if archive.exists():
+            return archive
+        else:
+            return None
+
+    def _name_columnar_rows(self, rows):
+        """
+        Translate the ids in the rows read from a columnar archive to names.
+        @param rows  Iterable of (site_id, dataset_id, size, decision, condition_id)
+
+        @return {site_name: [(dataset_name, size, decision, condition_id, condition_text)]} sorted by size in descending order
+        """
+
+        rows = list(rows)
+
+        site_names = dict(self.db.query('SELECT `id`, `name` FROM `sites`'))
+        dataset_names = dict(self.db.select_many('datasets', ('id', 'name'), 'id', set(r[1] for r in rows)))
+        condition_texts = dict(self.db.select_many('policy_conditions', ('id', 'text'), 'id', set(r[4] for r in rows)))
+
+        product = {}
+        for site_id, dataset_id, size, decision, condition_id in rows:
+            try:
+                site_name = site_names[site_id]
+                dataset_name = dataset_names[dataset_id]
+            except KeyError:
+                continue
+
+            product.setdefault(site_name, []).append((dataset_name, long(size), decision, condition_id, condition_texts.get(condition_id)))
+
+        for site_decisions in product.itervalues():
+            site_decisions.sort(key = lambda d: d[1], reverse = True)
+
+        return product
+
+    def _archive_path(self, cycle_number, suffix):
+        scycle = '%09d' % cycle_number
+        return '%s/%s/%s/snapshot_%09d.%s' % (self.snapshots_archive_dir, scycle[:3], scycle[3:6], cycle_number, suffix)
+
     def _fill_snapshot_cache(self, template, cycle_number):
         self.db.use_db(self.cache_db)
 
@@ -209,14 +333,19 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
                     except OSError:
                         pass
 
-                    scycle = '%09d' % cycle_number
-                    xz_file_name = '%s/%s/%s/snapshot_%09d.db.xz' % (self.snapshots_archive_dir, scycle[:3], scycle[3:6], cycle_number)
+                    xz_file_name = self._archive_path(cycle_number, 'db.xz')
                     if not os.path.exists(xz_file_name):
                         raise RuntimeError('Archived snapshot DB ' + xz_file_name + ' does not exist')
     
+                    decompressor = lzma.LZMADecompressor()
                     with open(xz_file_name, 'rb') as xz_file:
                         with open(db_file_name, 'wb') as db_file:
-                            db_file.write(lzma.decompress(xz_file.read()))
+                            while True:
+                                chunk = xz_file.read(ARCHIVE_CHUNK_SIZE)
+                                if not chunk:
+                                    break
+
+                                db_file.write(decompressor.decompress(chunk))
 
             else:
                 db_file_name = '%s/snapshot_%s.db' % (self.snapshots_spool_dir, cycle_number)
@@ -352,6 +481,17 @@ class DetoxHistory(DetoxHistoryBase):
 
         self.db.query('UPDATE `deletion_cycles` SET `time_end` = NOW() WHERE `id` = %s', cycle_number)
 
+    def abort_cycle(self, cycle_number):
+        """
+        Remove a cycle that was started but for which no decision was recorded.
+        @param cycle_number   Cycle number
+        """
+
+        if self._read_only:
+            return
+
+        self.db.query('DELETE FROM `deletion_cycles` WHERE `id` = %s', cycle_number)
+
     def save_policy(self, policy_text):
         md5 = hashlib.md5(policy_text).hexdigest()
         result = self.db.query('SELECT `id`, `text` FROM `deletion_policies` WHERE `hash` = UNHEX(%s)', md5)
@@ -570,6 +710,10 @@ class DetoxHistory(DetoxHistoryBase):
         snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'morgue\')' % Site.STAT_MORGUE)
         snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'unknown\')' % Site.STAT_UNKNOWN)
 
+        # The file is a fresh scratch copy - no need for a rollback journal or syncs
+        snapshot_db.execute('PRAGMA journal_mode = OFF')
+        snapshot_db.execute('PRAGMA synchronous = OFF')
+
         # Fill in the replica states
         sql = 'CREATE TABLE `replicas` ('
         sql += '`site_id` SMALLINT NOT NULL,'
@@ -579,14 +723,10 @@ class DetoxHistory(DetoxHistoryBase):
         sql += '`condition` MEDIUMINT NOT NULL'
         sql += ')'
         snapshot_db.execute(sql)
-        snapshot_db.execute('CREATE INDEX `site_dataset` ON `replicas` (`site_id`, `dataset_id`)')
 
+        # Rows are streamed from MySQL; all inserts are made in one transaction
         sql = 'INSERT INTO `replicas` VALUES (?, ?, ?, ?, ?)'
-
-        for entry in self.db.xquery('SELECT `site_id`, `dataset_id`, `size`, 0+`decision`, `condition` FROM `{0}`'.format(replica_table_name)):
-            snapshot_cursor.execute(sql, entry)
-
-        snapshot_db.commit()
+        snapshot_cursor.executemany(sql, self.db.xquery('SELECT `site_id`, `dataset_id`, `size`, 0+`decision`, `condition` FROM `{0}`'.format(replica_table_name)))
 
         # Fill in the site states
         sql = 'CREATE TABLE `sites` ('
@@ -597,10 +737,12 @@ class DetoxHistory(DetoxHistoryBase):
         snapshot_db.execute(sql)
 
         sql = 'INSERT INTO `sites` VALUES (?, ?, ?)'
+        snapshot_cursor.executemany(sql, self.db.xquery('SELECT `site_id`, 0+`status`, `quota` FROM `{0}`'.format(site_table_name)))
 
-        for entry in self.db.xquery('SELECT `site_id`, 0+`status`, `quota` FROM `{0}`'.format(site_table_name)):
-            snapshot_cursor.execute(sql, entry)
+        snapshot_db.commit()
 
+        # Index after filling the table
+        snapshot_db.execute('CREATE INDEX `site_dataset` ON `replicas` (`site_id`, `dataset_id`)')
         snapshot_db.commit()
 
         # Close the sqlite file
@@ -620,9 +762,14 @@ class DetoxHistory(DetoxHistoryBase):
             except OSError:
                 pass
     
-            with open(db_file_name, 'rb') as db_file:
-                with open(xz_file_name, 'wb') as xz_file:
-                    xz_file.write(lzma.compress(db_file.read()))
+            self._archive_snapshot(db_file_name, xz_file_name)
+
+            # Directly queryable copy of the decisions (see get_deletion_decisions)
+            LOG.info('Writing columnar archive of cycle %d', cycle_number)
+            archive = ColumnarSnapshot(self._archive_path(cycle_number, 'col'))
+            sites = self.db.query('SELECT `site_id`, `status`, `quota` FROM `{0}`'.format(site_table_name))
+            replicas = self.db.xquery('SELECT `site_id`, `dataset_id`, `size`, `decision`, `condition` FROM `{0}` ORDER BY `site_id`, `dataset_id`'.format(replica_table_name))
+            archive.write(sites, replicas)
 
             self._update_cache_usage('replicas', cycle_number)
             self._update_cache_usage('sites', cycle_number)
@@ -632,6 +779,48 @@ class DetoxHistory(DetoxHistoryBase):
 
         self.db.reuse_connection = reuse
 
+    def _archive_snapshot(self, db_file_name, xz_file_name):
+        """
+        Compress the snapshot file into the archive without loading it into memory. Multi-threaded
+        compression uses the xz executable; the single-threaded fallback runs in-process.
+        @param db_file_name  Path to the SQLite3 snapshot file
+        @param xz_file_name  Path to the archive file
+        """
+
+        LOG.info('Archiving %s to %s', db_file_name, xz_file_name)
+
+        tmp_file_name = xz_file_name + '.tmp'
+
+        with open(db_file_name, 'rb') as db_file:
+            with open(tmp_file_name, 'wb') as xz_file:
+                compressed = False
+
+                if self.archive_threads != 1:
+                    command = ['xz', '--compress', '--stdout', '-%d' % self.archive_preset, '--threads=%d' % self.archive_threads]
+                    try:
+                        proc = subprocess.Popen(command, stdin = db_file, stdout = xz_file, stderr = subprocess.PIPE)
+                    except OSError as ex:
+                        LOG.warning('Cannot run xz (%s); compressing in a single thread.', str(ex))
+                    else:
+                        _, err = proc.communicate()
+                        if proc.returncode != 0:
+                            raise RuntimeError('xz failed with return code %d: %s' % (proc.returncode, err))
+
+                        compressed = True
+
+                if not compressed:
+                    compressor = lzma.LZMACompressor({'level': self.archive_preset})
+                    while True:
+                        chunk = db_file.read(ARCHIVE_CHUNK_SIZE)
+                        if not chunk:
+                            break
+
+                        xz_file.write(compressor.compress(chunk))
+
+                    xz_file.write(compressor.flush())
+
+        os.rename(tmp_file_name, xz_file_name)
+
     def make_cycle_entry(self, cycle_number, site):
         history_record = self.make_entry(site.name)
 
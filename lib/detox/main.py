@@ -1,13 +1,22 @@
+import os
 import time
+import errno
+import select
+import signal
 import logging
 import collections
+import traceback
+import cPickle as pickle
 
-from dynamo.core.inventory import ObjectRepository
-from dynamo.dataformat import Group, Site, Dataset, Block, DatasetReplica, BlockReplica
+from dynamo.dataformat import Group, Site, BlockReplica
 from dynamo.dataformat.history import DeletedReplica
+from dynamo.policy.attrs import Attr
 from dynamo.detox.detoxpolicy import DetoxPolicy
 from dynamo.detox.detoxpolicy import Ignore, Protect, Delete, Dismiss, ProtectBlock, DeleteBlock, DismissBlock
 from dynamo.detox.history import DetoxHistory
+from dynamo.detox.vectorized import VectorizedPolicyEvaluator
+from dynamo.detox.candidates import CandidateQueue
+from dynamo.detox.partitionview import PartitionView
 from dynamo.operation.deletion import DeletionInterface
 from dynamo.utils.signaling import SignalBlocker
 
@@ -27,7 +36,31 @@ class Detox(object):
 
         self.history = DetoxHistory(config.get('history', None))
 
-        self.policy = DetoxPolicy(config)
+        # policy_file can be a list, in which case the partitions are processed concurrently (see run)
+        if type(config.policy_file) is list:
+            policy_files = config.policy_file
+        else:
+            policy_files = [config.policy_file]
+
+        self.policies = []
+        self.evaluators = []
+
+        for policy_file in policy_files:
+            policy_config = config.clone()
+            policy_config.policy_file = policy_file
+            policy = DetoxPolicy(policy_config)
+            self.policies.append(policy)
+
+            # Evaluate the policy column-wise if numpy is available
+            if config.get('vectorized_evaluation', True) and VectorizedPolicyEvaluator.available():
+                self.evaluators.append(VectorizedPolicyEvaluator(policy))
+            else:
+                self.evaluators.append(None)
+
+        # Policy and evaluator of the partition being processed
+        self.policy = None
+        self.evaluator = None
+        self._use_policy(0)
 
         self.deletion_per_iteration = config.get('deletion_per_iteration', 0.01)
 
@@ -41,22 +74,21 @@ class Detox(object):
 
     def run(self, inventory, comment = '', create_cycle = True):
         """
-        Main executable.
+        Main executable. If the Detox object was configured with multiple policies, the partitions are
+        processed in parallel by forked worker processes (see _run_concurrent).
         @param inventory    Dynamo inventory
         @param comment      Passed to dynamo history
         @param create_cycle If True, assign a cycle number and make a permanent record in the history.
         """
 
-        if create_cycle:
-            # fetch the deletion cycle number
-            cycle_tag = self.history.new_cycle(self.policy.partition_name, self.policy.policy_text, comment = comment, test = self.test_run)
-            LOG.info('Detox cycle %d for %s starting', cycle_tag, self.policy.partition_name)
-        else:
-            cycle_tag = self.policy.partition_name
-            LOG.info('Detox snapshot cycle for %s starting', self.policy.partition_name)
+        if len(self.policies) > 1:
+            self._run_concurrent(inventory, comment, create_cycle)
+            return
+
+        cycle_tag = self._start_cycle(comment, create_cycle)
 
-        LOG.info('Building the object repository for the partition.')
-        # Create a full clone of the inventory limited to the partition of the policy
+        LOG.info('Building the partition view.')
+        # Create a view of the inventory limited to the partition of the policy
         partition_repository = self._build_partition(inventory)
 
         LOG.info('Loading dataset attributes.')
@@ -73,10 +105,297 @@ class Detox(object):
         partition = partition_repository.partitions[self.policy.partition_name]
         quotas = dict((s, s.partitions[partition].quota * 1.e-12) for s in partition_repository.sites.itervalues())
 
+        # Put the inventory back to its original state; decisions refer to the inventory objects
+        partition_repository.restore()
+
+        self._close_cycle(cycle_tag, inventory, deleted, kept, protected, reowned, quotas, create_cycle)
+
+    def _run_concurrent(self, inventory, comment, create_cycle):
+        """
+        Process all partitions at once. One worker process is forked per policy; the workers share the
+        inventory image with this process (copy on write) and send back the decisions by object names
+        through pipes. History DB access and the deletion commits are done only in this process, partition
+        by partition. Detox runs inside a daemonic application process, which cannot start
+        multiprocessing children, hence the plain os.fork.
+        """
+
+        cycle_tags = []
+        # number of cycles for which _close_cycle has been called
+        num_closing = 0
+
+        try:
+            target_sites = []
+
+            for ipol in xrange(len(self.policies)):
+                self._use_policy(ipol)
+
+                cycle_tags.append(self._start_cycle(comment, create_cycle))
+                target_sites.append(self._find_target_sites(inventory))
+
+                LOG.info('Saving policy conditions for %s.', self.policy.partition_name)
+                # condition ids are inherited by the worker
+                self.history.save_conditions(self.policy.policy_lines)
+
+            results = self._run_workers(inventory, target_sites)
+
+            # Block replicas already deleted for a preceding partition are not deleted again
+            deleted_block_replicas = set()
+
+            for ipol, result in enumerate(results):
+                self._use_policy(ipol)
+
+                deleted, kept, protected, reowned, quotas = self._import_result(inventory, result)
+
+                num_closing += 1
+                self._close_cycle(cycle_tags[ipol], inventory, deleted, kept, protected, reowned, quotas, create_cycle, deleted_block_replicas)
+
+        except:
+            # Cycles of the partitions not processed yet have no records; remove them. A cycle that failed
+            # while being closed may have committed deletions and is left open as in the single-partition mode.
+            if create_cycle:
+                for cycle_tag in cycle_tags[num_closing:]:
+                    try:
+                        self.history.abort_cycle(cycle_tag)
+                    except:
+                        LOG.error('Failed to abort Detox cycle %d.', cycle_tag)
+
+            raise
+
+    def _run_workers(self, inventory, target_sites):
+        """
+        Fork the workers and collect their results.
+        @param inventory     Dynamo inventory
+        @param target_sites  List of target site sets, one per policy
+        @return List of results of _run_worker, one per policy
+        """
+
+        # {pipe read end: (ipol, pid)}
+        workers = {}
+        # {pipe read end: [data chunks]}
+        outputs = {}
+
+        results = [None] * len(self.policies)
+
+        try:
+            for ipol, policy in enumerate(self.policies):
+                read_end, write_end = os.pipe()
+                pid = os.fork()
+
+                if pid == 0:
+                    # Worker process; never returns
+                    os.close(read_end)
+                    for fd in workers:
+                        os.close(fd)
+
+                    self._worker_main(ipol, inventory, target_sites[ipol], write_end)
+
+                os.close(write_end)
+                workers[read_end] = (ipol, pid)
+                outputs[read_end] = []
+
+            LOG.info('Started %d Detox workers.', len(workers))
+
+            while len(workers) != 0:
+                try:
+                    readable, _, _ = select.select(workers.keys(), [], [])
+                except select.error as err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                for fd in readable:
+                    data = os.read(fd, 65536)
+                    if data:
+                        outputs[fd].append(data)
+                        continue
+
+                    # EOF: the worker is done
+                    ipol, pid = workers.pop(fd)
+                    os.close(fd)
+                    _, status = os.waitpid(pid, 0)
+
+                    partition_name = self.policies[ipol].partition_name
+                    data = ''.join(outputs.pop(fd))
+
+                    if len(data) == 0:
+                        raise RuntimeError('Detox worker for %s died with exit status %d' % (partition_name, status))
+
+                    result, error = pickle.loads(data)
+                    if error is not None:
+                        raise RuntimeError('Detox worker for %s failed:\n%s' % (partition_name, error))
+
+                    LOG.info('Received decisions for %s.', partition_name)
+
+                    results[ipol] = result
+
+        finally:
+            # Workers still running at this point are abandoned because of an error
+            for fd, (ipol, pid) in workers.iteritems():
+                os.close(fd)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+
+        return results
+
+    def _worker_main(self, ipol, inventory, target_sites, write_end):
+        """
+        Entry point of the forked worker. Writes the pickled (result, error) to the pipe and exits without
+        running any cleanup, so that the MySQL connections inherited from the parent are not closed.
+        """
+
+        status = 0
+        try:
+            try:
+                output = (self._run_worker(ipol, inventory, target_sites), None)
+            except:
+                output = (None, traceback.format_exc())
+                status = 1
+
+            data = pickle.dumps(output, pickle.HIGHEST_PROTOCOL)
+            while len(data) != 0:
+                data = data[os.write(write_end, data):]
+
+        except:
+            status = 2
+
+        finally:
+            os._exit(status)
+
+    def _run_worker(self, ipol, inventory, target_sites):
+        """
+        Body of the worker process of _run_concurrent. The worker shares the open connections to the
+        inventory store and the history DB with the parent process and therefore must not touch either;
+        attribute producers open their own connections.
+        @return Output of _export_result
+        """
+
+        self._use_policy(ipol)
+
+        LOG.info('Building the partition view for %s.', self.policy.partition_name)
+        partition = inventory.partitions[self.policy.partition_name]
+        # The view is discarded with the process; no need to restore
+        partition_repository = PartitionView(inventory, partition, target_sites)
+
+        LOG.info('Loading dataset attributes.')
+        for plugin in self.policy.attr_producers:
+            plugin.load(partition_repository)
+
+        LOG.info('Applying policy to replicas.')
+        deleted, kept, protected, reowned = self._execute_policy(partition_repository)
+
+        quotas = dict((s.name, s.partitions[partition].quota * 1.e-12) for s in partition_repository.sites.itervalues())
+
+        return self._export_result(deleted, kept, protected, reowned, quotas)
+
+    def _export_result(self, deleted, kept, protected, reowned, quotas):
+        """
+        Translate the outputs of _execute_policy into plain names that can be sent across processes.
+        Changes the worker made to the inventory objects (growing flags and owners) are included.
+        """
+
+        def export(decisions):
+            exported = {}
+            for replica, matches in decisions.iteritems():
+                exported[(replica.dataset.name, replica.site.name)] = \
+                    dict((condition_id, [br.block.name for br in block_replicas]) for condition_id, block_replicas in matches.iteritems())
+
+            return exported
+
+        not_growing = [(r.dataset.name, r.site.name) for r in deleted.iterkeys() if not r.growing]
+
+        exported_reowned = {}
+        for replica, block_replicas in reowned.iteritems():
+            exported_reowned[(replica.dataset.name, replica.site.name)] = [(br.block.name, br.group.name) for br in block_replicas]
+
+        return export(deleted), export(kept), export(protected), exported_reowned, not_growing, quotas
+
+    def _import_result(self, inventory, result):
+        """
+        Inverse of _export_result. Replays the changes made by the worker on the inventory objects.
+        """
+
+        exported_deleted, exported_kept, exported_protected, exported_reowned, not_growing, exported_quotas = result
+
+        def find_replica(dataset_name, site_name):
+            replica = inventory.datasets[dataset_name].find_replica(site_name)
+            block_replicas = dict((br.block.name, br) for br in replica.block_replicas)
+            return replica, block_replicas
+
+        def restore(exported):
+            decisions = {}
+            for (dataset_name, site_name), matches in exported.iteritems():
+                replica, block_replicas = find_replica(dataset_name, site_name)
+                decisions[replica] = dict((condition_id, set(block_replicas[name] for name in names)) for condition_id, names in matches.iteritems())
+
+            return decisions
+
+        deleted = restore(exported_deleted)
+        kept = restore(exported_kept)
+        protected = restore(exported_protected)
+
+        for dataset_name, site_name in not_growing:
+            inventory.datasets[dataset_name].find_replica(site_name).growing = False
+
+        reowned = {}
+        for (dataset_name, site_name), entries in exported_reowned.iteritems():
+            replica, block_replicas = find_replica(dataset_name, site_name)
+            reowned[replica] = set()
+            for block_name, group_name in entries:
+                block_replica = block_replicas[block_name]
+                block_replica.group = inventory.groups[group_name]
+                reowned[replica].add(block_replica)
+
+        quotas = dict((inventory.sites[name], quota) for name, quota in exported_quotas.iteritems())
+
+        return deleted, kept, protected, reowned, quotas
+
+    def _use_policy(self, ipol):
+        self.policy = self.policies[ipol]
+        self.evaluator = self.evaluators[ipol]
+
+    def _start_cycle(self, comment, create_cycle):
+        """
+        @return  Cycle number if create_cycle is True, otherwise the partition name.
+        """
+
+        if create_cycle:
+            # fetch the deletion cycle number
+            cycle_tag = self.history.new_cycle(self.policy.partition_name, self.policy.policy_text, comment = comment, test = self.test_run)
+            LOG.info('Detox cycle %d for %s starting', cycle_tag, self.policy.partition_name)
+        else:
+            cycle_tag = self.policy.partition_name
+            LOG.info('Detox snapshot cycle for %s starting', self.policy.partition_name)
+
+        return cycle_tag
+
+    def _close_cycle(self, cycle_tag, inventory, deleted, kept, protected, reowned, quotas, create_cycle, deleted_block_replicas = None):
+        """
+        Record the decisions and commit the deletions and reassignments.
+        @param deleted_block_replicas  If not None, set of block replicas deleted in the same run. Block replicas
+                                       in the set are not deleted again, and the ones deleted here are added.
+        """
+
         LOG.info('Saving deletion decisions and site states.')
         self.history.save_cycle_state(cycle_tag, deleted, kept, protected, quotas)
 
         if create_cycle:
+            if deleted_block_replicas is not None:
+                to_delete = {}
+                for replica, matches in deleted.iteritems():
+                    for condition_id, block_replicas in matches.iteritems():
+                        block_replicas = block_replicas - deleted_block_replicas
+                        if len(block_replicas) != 0:
+                            to_delete.setdefault(replica, {})[condition_id] = block_replicas
+
+                for matches in to_delete.itervalues():
+                    for block_replicas in matches.itervalues():
+                        deleted_block_replicas.update(block_replicas)
+
+                deleted = to_delete
+
             LOG.info('Committing deletion.')
             comment = 'Dynamo -- Automatic cache release request for %s partition.' % self.policy.partition_name
             self._commit_deletions(cycle_tag, inventory, deleted, comment)
@@ -88,17 +407,27 @@ class Detox(object):
         LOG.info('Detox cycle completed')
 
     def _build_partition(self, inventory):
-        """Create a mini-inventory consisting only of replicas in the partition."""
+        """Create a view of the inventory consisting only of replicas in the partition at the target sites."""
+
+        partition = inventory.partitions[self.policy.partition_name]
 
-        partition_repository = ObjectRepository()
-        partition_repository._store = inventory._store
+        target_sites = self._find_target_sites(inventory)
+
+        # Create a view of the inventory, limiting to the current partition
+        # We will be stripping replicas off the view as we process the policy in iterations
+        LOG.info('Creating a partition view.')
+
+        return PartitionView(inventory, partition, target_sites)
+
+    def _find_target_sites(self, inventory):
+        """
+        @return  List of sites matching the target site definition of the policy.
+        """
 
         LOG.info('Identifying target sites.')
 
         partition = inventory.partitions[self.policy.partition_name]
 
-        partition.embed_tree(partition_repository)
-
         # Ask each site if deletion should be triggered.
         target_sites = set() # target sites of this detox cycle
         tape_is_target = False
@@ -116,7 +445,7 @@ class Detox(object):
 
         if len(target_sites) == 0:
             LOG.info('No site matches the target definition.')
-            return partition_repository
+            return []
 
         # Safety measure - if there are empty (no block rep) tape replicas, create block replicas with size 0 and
         # add them into the partition. We will not report back to the main process though (i.e. won't call inventory.update).
@@ -134,94 +463,10 @@ class Detox(object):
                     # Add to the site partition
                     site.partitions[partition].replicas[replica] = None
 
-        # Create a copy of the inventory, limiting to the current partition
-        # We will be stripping replicas off the image as we process the policy in iterations
-        LOG.info('Creating a partition image.')
-
-        for group in inventory.groups.itervalues():
-            group.embed_into(partition_repository)
-
-        # Now clone the sites, datasets, and replicas
-        # Basically a copy-paste of various embed_into() functions ommitting the checks
-
-        # make a map to avoid excessive lookups
-        block_to_clone = {}
-        for site in target_sites:
-            site_clone = site.embed_into(partition_repository)
-
-            site_partition = site.partitions[partition]
-            site_partition_clone = site_partition.embed_tree(partition_repository)
-
-            for dataset_replica, block_replica_set in site_partition.replicas.iteritems():
-                dataset = dataset_replica.dataset
-
-                try:
-                    dataset_clone = partition_repository.datasets[dataset.name]
-
-                except KeyError:
-                    dataset_clone = dataset.embed_into(partition_repository)
-
-                    for block in dataset.blocks:
-                        block_clone = Block(
-                            block.name,
-                            dataset_clone,
-                            size = block.size,
-                            num_files = block.num_files,
-                            is_open = block.is_open,
-                            last_update = block.last_update,
-                            bid = block.id
-                        )
-                        dataset_clone.blocks.add(block_clone)
-
-                        block_to_clone[block] = block_clone
-
-                if dataset_replica.group is None:
-                    group = None
-                else:
-                    group = partition_repository.groups[dataset_replica.group.name]
-
-                replica_clone = DatasetReplica(
-                    dataset_clone,
-                    site_clone,
-                    growing = dataset_replica.growing,
-                    group = group
-                )
-                dataset_clone.replicas.add(replica_clone)
-                site_clone.add_dataset_replica(replica_clone, add_block_replicas = False)
-
-                if block_replica_set is None:
-                    # all block reps in partition
-                    block_replica_set = dataset_replica.block_replicas
-                    full_replica = True
-                    site_partition_clone.replicas[replica_clone] = None
-                else:
-                    full_replica = False
-                    block_replica_clone_set = site_partition_clone.replicas[replica_clone] = set()
-
-                for block_replica in block_replica_set:
-                    block_clone = block_to_clone[block_replica.block]
-                    if block_replica.is_complete():
-                        size = -1
-                    else:
-                        size = block_replica.size
-
-                    block_replica_clone = BlockReplica(
-                        block_clone,
-                        site_clone,
-                        partition_repository.groups[block_replica.group.name],
-                        is_custodial = block_replica.is_custodial,
-                        size = size,
-                        last_update = block_replica.last_update,
-                        file_ids = block_replica.file_ids
-                    )
-
-                    replica_clone.block_replicas.add(block_replica_clone)
-                    block_clone.replicas.add(block_replica_clone)
-
-                    if not full_replica:
-                        block_replica_clone_set.add(block_replica_clone)
+                # block replicas were added directly
+                site.reset_occupancy()
 
-        return partition_repository
+        return list(target_sites)
 
     def _execute_policy(self, repository):
         """
@@ -274,12 +519,34 @@ class Detox(object):
                 s = replica_map[condition_id] = set()
                 return s
 
+        # Policy evaluation results carried over iterations. {replica: actions}
+        # Replicas whose inputs change (see invalidate) are taken out and re-evaluated.
+        evaluated = {}
+
+        # Delete candidates ordered by the policy sort key. {site: CandidateQueue}
+        # Queues are carried over iterations; replicas whose inputs change are re-keyed.
+        candidate_queues = {}
+        rekey = set()
+
+        if self.policy.dependency_scope == Attr.SCOPE_DATASET:
+            def invalidate(replica):
+                for r in replica.dataset.replicas:
+                    evaluated.pop(r, None)
+                    rekey.add(r)
+        else:
+            def invalidate(replica):
+                evaluated.pop(replica, None)
+                rekey.add(replica)
+
         iteration = 0
 
         # now iterate through deletions, updating site usage as we go
         while True:
             iteration += 1
-            LOG.info('Iteration %d, evaluating %d replicas', iteration, len(all_replicas))
+
+            to_evaluate = [r for r in all_replicas if r not in evaluated]
+
+            LOG.info('Iteration %d, evaluating %d out of %d replicas', iteration, len(to_evaluate), len(all_replicas))
 
             # Delete candidates: replicas that match Dismiss lines and are on sites where deletion is triggered.
             # We will only move a few replicas (on a single site up to deletion_per_iteration) from
@@ -297,13 +564,21 @@ class Detox(object):
             empty_replicas = set()
             start = time.time()
 
+            if self.evaluator is None:
+                evaluated.update((r, self.policy.evaluate(r)) for r in to_evaluate)
+            else:
+                evaluated.update(zip(to_evaluate, self.evaluator.evaluate(to_evaluate)))
+
             for replica in all_replicas:
-                # Call policy.evaluate for each replica
                 # Function evaluate() returns a list of actions. If the replica matches a dataset-level policy,
                 # there is only one element in the returned list.
                 # Block-level actions are triggered only if the condition does not apply to all blocks.
                 # Sort the evaluation results into the three candidate containers above.
-                actions = self.policy.evaluate(replica)
+                try:
+                    actions = evaluated[replica]
+                except KeyError:
+                    # invalidated by a deletion earlier in this loop
+                    actions = evaluated[replica] = self.policy.evaluate(replica)
 
                 # Keep track of block replicas matching block-level conditions
                 block_replicas = set(replica.block_replicas)
@@ -329,6 +604,7 @@ class Detox(object):
                         # the two sets overlap only when reowning causes the block replica to go out of the partition
                         # unlinked - reowned are returned as to_delete
                         to_delete = self._unlink_block_replicas(replica, partition, action.block_replicas, repository, reowned, block_replicas)
+                        invalidate(replica)
 
                         if len(to_delete) != 0:
                             # to_delete list contains blocks that should actually be deleted, instead of just kicked out
@@ -357,6 +633,7 @@ class Detox(object):
                     elif isinstance(action, Delete):
                         # delete a full dataset or a remainder after block-level operations
                         to_delete = self._unlink_block_replicas(replica, partition, block_replicas, repository, reowned)
+                        invalidate(replica)
 
                         if len(to_delete) != 0:
                             get_list(deleted, replica, condition_id).update(to_delete)
@@ -377,11 +654,14 @@ class Detox(object):
                             get_list(keep_candidates, replica, condition_id).update(block_replicas)
 
             for replica in empty_replicas:
-                replica.unlink_from(repository)
+                repository.delete(replica)
 
             all_replicas -= empty_replicas
             all_replicas -= ignored_replicas
 
+            for replica in ignored_replicas:
+                evaluated.pop(replica, None)
+
             LOG.info('Took %f seconds to evaluate', time.time() - start)
             LOG.info(' %d dataset replicas in deletion candidates', len(delete_candidates))
 
@@ -393,13 +673,31 @@ class Detox(object):
 
                 break
 
+            # bring the candidate queues up to date; only new and changed candidates are (re-)inserted
+            for replica in rekey:
+                try:
+                    candidate_queues[replica.site].discard(replica)
+                except KeyError:
+                    pass
+
+            rekey.clear()
+
+            for replica in delete_candidates.iterkeys():
+                try:
+                    queue = candidate_queues[replica.site]
+                except KeyError:
+                    queue = candidate_queues[replica.site] = CandidateQueue(self.policy.candidate_sort_key)
+
+                if replica not in queue:
+                    queue.push(replica)
+
+            # all sites where delete candidates are
+            candidate_sites = set(r.site for r in delete_candidates.iterkeys())
+
             # now figure out which of deletion candidates to actually delete
             if self.policy.iterative_deletion:
                 # we will delete from one site at a time
 
-                # all sites where delete candidates are
-                candidate_sites = set(r.site for r in delete_candidates.iterkeys())
-
                 # fraction of protected data at each candidate site
                 protected_fraction = dict((s, 0. if quotas[s] > 0. else 1.) for s in candidate_sites)
 
@@ -417,60 +715,78 @@ class Detox(object):
                 # find the site with the highest protected fraction                            
                 selected_site = max(candidate_sites, key = lambda site: protected_fraction[site])
 
-                # all delete candidates at the site
-                candidates_at_site = [r for r in delete_candidates.iterkeys() if r.site == selected_site]
-
-                # sorted list of replicas to delete
-                replicas_to_delete = sorted(candidates_at_site, key = self.policy.candidate_sort_key)
+                sites_to_process = [selected_site]
 
                 deleted_volume = 0.
 
             else:
-                replicas_to_delete = sorted(delete_candidates.iterkeys(), key = self.policy.candidate_sort_key)
+                # sites are independent - process one after another
+                sites_to_process = sorted(candidate_sites, key = lambda site: site.name)
 
-            for replica in replicas_to_delete:
-                site = replica.site
+            for site in sites_to_process:
+                queue = candidate_queues[site]
 
-                if site not in triggered_sites:
-                    # Site was de-triggered. Move this replica to keep_candidates.
-                    for condition_id, matches in delete_candidates[replica].iteritems():
-                        get_list(keep_candidates, replica, condition_id).update(matches)
+                while True:
+                    replica = queue.peek()
+                    if replica is None:
+                        break
 
-                    continue
+                    if replica not in delete_candidates:
+                        # should not happen; queues and delete_candidates are synchronized above
+                        queue.pop()
+                        continue
 
-                if self.policy.iterative_deletion:
-                    quota = quotas[site]
+                    if self.policy.iterative_deletion:
+                        quota = quotas[site]
+    
+                        # have we deleted more than allowed in a single iteration?
+                        if quota > 0. and deleted_volume / quota > self.deletion_per_iteration:
+                            break
 
-                    # have we deleted more than allowed in a single iteration?
-                    if quota > 0. and deleted_volume / quota > self.deletion_per_iteration:
-                        break
+                    queue.pop()
 
-                LOG.debug('Deleting replica: %s', str(replica))
+                    LOG.debug('Deleting replica: %s', str(replica))
 
-                for condition_id, matches in delete_candidates[replica].iteritems():
-                    to_delete = self._unlink_block_replicas(replica, partition, matches, repository, reowned)
+                    invalidate(replica)
 
-                    if len(to_delete) != 0:
-                        get_list(deleted, replica, condition_id).update(to_delete)
+                    for condition_id, matches in delete_candidates[replica].iteritems():
+                        to_delete = self._unlink_block_replicas(replica, partition, matches, repository, reowned)
 
-                        if self.policy.iterative_deletion:
-                            deleted_volume += sum(br.size for br in to_delete)
+                        if len(to_delete) != 0:
+                            get_list(deleted, replica, condition_id).update(to_delete)
 
-                if len(replica.block_replicas) == 0:
-                    if replica in dataset_level_delete_candidates:
-                        replica.growing = False
-                    
-                    replica.unlink_from(repository)
-                    all_replicas.remove(replica)
+                            if self.policy.iterative_deletion:
+                                deleted_volume += sum(br.size for br in to_delete)
+
+                    if len(replica.block_replicas) == 0:
+                        if replica in dataset_level_delete_candidates:
+                            replica.growing = False
+                        
+                        repository.delete(replica)
+                        all_replicas.remove(replica)
+
+                    site_partition = site.partitions[partition]
 
-                site_partition = site.partitions[partition]
+                    # has the site reached the stop-deletion threshold?
+                    for cond in self.policy.stop_condition:
+                        if cond.match(site_partition):
+                            triggered_sites.remove(site)
+                            break
 
-                # has the site reached the stop-deletion threshold?
-                for cond in self.policy.stop_condition:
-                    if cond.match(site_partition):
-                        triggered_sites.remove(site)
+                    if site not in triggered_sites:
                         break
 
+                if site not in triggered_sites:
+                    # Site was de-triggered. Move the remaining candidates to keep_candidates.
+                    for replica in queue:
+                        if replica not in delete_candidates:
+                            continue
+
+                        for condition_id, matches in delete_candidates[replica].iteritems():
+                            get_list(keep_candidates, replica, condition_id).update(matches)
+
+                    candidate_queues.pop(site)
+
         # done iterating
 
         LOG.info(' %d dataset replicas in delete list', len(deleted))
@@ -532,7 +848,7 @@ class Detox(object):
 
         if len(blocks_to_unlink) != 0:
             for block_replica in blocks_to_unlink:
-                block_replica.unlink_from(repository)
+                repository.delete(block_replica)
 
             # if this replica was put in reowned list earlier, take it out
             try:
@@ -661,7 +977,10 @@ class Detox(object):
             for block_replica in block_replicas:
                 original_block_replica = original_block_replicas[block_replica.block.name]
 
-                if original_block_replica != block_replica:
+                if original_block_replica is block_replica:
+                    # the partition view changes the group of the inventory object directly
+                    inventory.register_update(original_block_replica)
+                elif original_block_replica != block_replica:
                     original_block_replica.copy(block_replica)
                     inventory.register_update(original_block_replica)
 
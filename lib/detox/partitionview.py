@@ -0,0 +1,171 @@
+import logging
+
+from dynamo.core.inventory import ObjectRepository
+from dynamo.dataformat import SitePartition, DatasetReplica, BlockReplica
+
+LOG = logging.getLogger(__name__)
+
+class PartitionView(ObjectRepository):
+    """
+    Repository of the replicas of one partition at a set of sites, made of the live inventory objects.
+
+    Instead of cloning the inventory, the view substitutes the containers of the live objects (replica
+    sets of datasets and blocks, dataset replica lists of sites, site partitions) with filtered copies so
+    that only the replicas in the partition at the given sites are visible. Containers that need no
+    filtering are shared with the inventory until the view deletes an object through them (copy on write).
+    The original containers are put back with restore(); changes to the member values of the objects
+    (e.g. BlockReplica.group, DatasetReplica.growing) are not reverted.
+    """
+
+    def __init__(self, inventory, partition, sites):
+        """
+        @param inventory   DynamoInventory
+        @param partition   Partition
+        @param sites       List of sites to include
+        """
+
+        ObjectRepository.__init__(self)
+
+        self._store = inventory._store
+        # groups are never modified
+        self.groups = inventory.groups
+
+        # [(object, attribute name, original value)]
+        self._originals = []
+        # set of (id(object), attribute name) whose values are private to the view
+        self._owned = set()
+
+        self._add_partition_tree(partition)
+
+        # {dataset: set(dataset replicas)}
+        dataset_replicas = {}
+
+        for site in sites:
+            self.sites.add(site)
+
+            site_partition = site.partitions[partition]
+
+            site_partitions = {}
+            for part in self.partitions.itervalues():
+                site_partitions[part] = SitePartition(site, part, site.partitions[part]._quota)
+
+            view_site_partition = site_partitions[partition]
+
+            for replica, block_replica_set in site_partition.replicas.iteritems():
+                if block_replica_set is None:
+                    view_site_partition.replicas[replica] = None
+                else:
+                    view_site_partition.replicas[replica] = set(block_replica_set)
+                    # only part of the replica is in the partition
+                    self._set(replica, 'block_replicas', set(block_replica_set))
+                    self._set(replica, '_sizes', None)
+
+                try:
+                    dataset_replicas[replica.dataset].add(replica)
+                except KeyError:
+                    dataset_replicas[replica.dataset] = set([replica])
+
+            self._set(site, 'partitions', site_partitions)
+            self._set(site, '_dataset_replicas', dict((r.dataset, r) for r in site_partition.replicas.iterkeys()))
+
+        for dataset, replicas in dataset_replicas.iteritems():
+            self.datasets.add(dataset)
+
+            # dataset attrs are filled by the policy producers for this view
+            self._set(dataset, 'attr', {})
+
+            if len(replicas) != len(dataset.replicas):
+                self._set(dataset, 'replicas', replicas)
+                self._set(dataset, '_replicas_index', None)
+
+            block_replicas = dict((block, []) for block in dataset.blocks)
+            for replica in replicas:
+                for block_replica in replica.block_replicas:
+                    block_replicas[block_replica.block].append(block_replica)
+
+            for block, brs in block_replicas.iteritems():
+                if len(brs) != len(block.replicas):
+                    self._set(block, 'replicas', set(brs))
+                    self._set(block, '_replicas_index', None)
+
+        LOG.info('Partition view of %s has %d sites, %d datasets, and %d objects with filtered content.', \
+            partition.name, len(self.sites), len(self.datasets), len(self._owned))
+
+    def delete(self, obj): #override
+        """
+        Make the containers modified by the deletion private to the view, then delete as usual.
+        """
+
+        if type(obj) is BlockReplica:
+            dataset_replica = obj.site.find_dataset_replica(obj.block.dataset)
+            self._own_block_replica_links(obj, dataset_replica)
+
+            if len(dataset_replica.block_replicas) == 1:
+                # unlinking the last block replica can unlink the dataset replica
+                self._own_dataset_replica_links(dataset_replica)
+
+        elif type(obj) is DatasetReplica:
+            self._own_dataset_replica_links(obj)
+            for block_replica in obj.block_replicas:
+                self._own_block_replica_links(block_replica, obj)
+
+        return ObjectRepository.delete(self, obj)
+
+    def restore(self):
+        """
+        Put the original containers back to the inventory objects. The view is unusable afterwards.
+        """
+
+        LOG.info('Restoring %d inventory object attributes.', len(self._originals))
+
+        for obj, attr, value in reversed(self._originals):
+            setattr(obj, attr, value)
+
+        self._originals = []
+        self._owned = set()
+
+        self.sites.clear()
+        self.datasets.clear()
+
+    def _add_partition_tree(self, partition):
+        self.partitions.add(partition)
+
+        if partition.subpartitions is not None:
+            for subp in partition.subpartitions:
+                self._add_partition_tree(subp)
+
+    def _set(self, obj, attr, value):
+        key = (id(obj), attr)
+        if key not in self._owned:
+            self._owned.add(key)
+            self._originals.append((obj, attr, getattr(obj, attr)))
+
+        setattr(obj, attr, value)
+
+    def _own(self, obj, attr):
+        """
+        Replace a container shared with the inventory with a private copy.
+        @return True if a copy was made.
+        """
+
+        if (id(obj), attr) in self._owned:
+            return False
+
+        container = getattr(obj, attr)
+        self._set(obj, attr, type(container)(container))
+        return True
+
+    def _own_block_replica_links(self, block_replica, dataset_replica):
+        if self._own(dataset_replica, 'block_replicas'):
+            self._set(dataset_replica, '_sizes', None)
+
+        block = block_replica.block
+        if self._own(block, 'replicas'):
+            self._set(block, '_replicas_index', None)
+
+    def _own_dataset_replica_links(self, dataset_replica):
+        self._own(dataset_replica.site, '_dataset_replicas')
+
+        dataset = dataset_replica.dataset
+        if self._own(dataset, 'replicas'):
+            self._set(dataset, '_replicas_index', None)
@@ -0,0 +1,209 @@
+"""
+Column-wise evaluation of the Detox policy stack.
+
+Instead of walking the predicate objects of each policy line for one replica at a time, the
+attribute values of all replicas are extracted into NumPy columns and each policy line is
+resolved as a mask over the whole replica set. Only the leading dataset-level lines that do
+not depend on block replica attributes are evaluated this way; replicas that are left undecided
+by those lines are handed to the object path (DetoxPolicy.evaluate) starting from the first
+line that cannot be vectorized.
+"""
+
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import dynamo.policy.attrs as attrs
+import dynamo.policy.predicates as predicates
+from dynamo.detox.detoxpolicy import DatasetAction
+
+LOG = logging.getLogger(__name__)
+
+class UnvectorizableColumn(Exception):
+    """Raised when attribute values cannot be stored in a column of the expected type."""
+    pass
+
+class VectorizedPolicyEvaluator(object):
+    """
+    Evaluate DetoxPolicy lines over a list of replicas in bulk.
+    """
+
+    def __init__(self, policy):
+        """
+        @param policy  DetoxPolicy object
+        """
+
+        self.policy = policy
+
+        # Index of the first policy line that must be evaluated through the object path
+        self.num_vectorized_lines = len(policy.policy_lines)
+        for iline, line in enumerate(policy.policy_lines):
+            if not VectorizedPolicyEvaluator.is_vectorizable(line):
+                self.num_vectorized_lines = iline
+                break
+
+        LOG.info('Vectorized policy evaluation covers %d out of %d lines.', self.num_vectorized_lines, len(policy.policy_lines))
+
+    @staticmethod
+    def available():
+        return np is not None
+
+    @staticmethod
+    def is_vectorizable(line):
+        """
+        A line can be evaluated column-wise if its decision is at the dataset level and none of
+        its variables return a list of block replica values.
+        """
+
+        if not issubclass(line.decision.action_cls, DatasetAction):
+            return False
+
+        for pred in line.condition.predicates:
+            if isinstance(pred.variable, attrs.BlockReplicaAttr):
+                return False
+
+        return True
+
+    def evaluate(self, replicas):
+        """
+        @param replicas  List of dataset replicas
+        @return  List of action lists aligned with replicas, same as [policy.evaluate(r) for r in replicas]
+        """
+
+        if len(replicas) == 0:
+            return []
+
+        if self.num_vectorized_lines == 0:
+            return map(self.policy.evaluate, replicas)
+
+        try:
+            matched_lines = self._match_lines(replicas)
+        except UnvectorizableColumn as ex:
+            LOG.warning('Falling back to per-replica policy evaluation: %s', str(ex))
+            return map(self.policy.evaluate, replicas)
+
+        policy_lines = self.policy.policy_lines
+
+        results = []
+        for replica, iline in zip(replicas, matched_lines):
+            if iline < 0:
+                results.append(self.policy.evaluate(replica, first_line = self.num_vectorized_lines))
+            else:
+                line = policy_lines[iline]
+                results.append([line.decision.action(line)])
+
+        return results
+
+    def _match_lines(self, replicas):
+        """
+        @param replicas  List of dataset replicas
+        @return  Array of indices of the first matching line for each replica (-1 if none of the vectorized lines matched)
+        """
+
+        num_replicas = len(replicas)
+
+        matched_lines = np.full(num_replicas, -1, dtype = np.int32)
+        undecided = np.ones(num_replicas, dtype = np.bool_)
+
+        # {variable: (values, known)}; columns are filled lazily for the rows that need them
+        columns = {}
+
+        for iline in xrange(self.num_vectorized_lines):
+            line = self.policy.policy_lines[iline]
+
+            mask = undecided.copy()
+            for pred in line.condition.predicates:
+                if not mask.any():
+                    break
+
+                values = self._get_column(columns, pred.variable, replicas, mask)
+                mask &= self._eval_predicate(pred, values, mask)
+
+            if mask.any():
+                line.has_match = True
+                matched_lines[mask] = iline
+                undecided &= ~mask
+
+                if not undecided.any():
+                    break
+
+        return matched_lines
+
+    def _get_column(self, columns, variable, replicas, mask):
+        try:
+            values, known = columns[variable]
+        except KeyError:
+            if variable.vtype == attrs.Attr.BOOL_TYPE:
+                dtype = np.bool_
+            elif variable.vtype in (attrs.Attr.NUMERIC_TYPE, attrs.Attr.TIME_TYPE):
+                dtype = np.float64
+            else:
+                dtype = np.object_
+
+            values = np.zeros(len(replicas), dtype = dtype)
+            known = np.zeros(len(replicas), dtype = np.bool_)
+            columns[variable] = (values, known)
+
+        get = variable.get
+        missing = np.flatnonzero(mask & ~known)
+        for irow in missing:
+            value = get(replicas[irow])
+            if values.dtype == np.object_:
+                # containers would need the OR logic of Predicate.__call__
+                if not isinstance(value, basestring):
+                    raise UnvectorizableColumn('Variable %s returned %s' % (type(variable).__name__, repr(value)))
+            elif value is None:
+                raise UnvectorizableColumn('Variable %s returned None' % type(variable).__name__)
+
+            try:
+                values[irow] = value
+            except (TypeError, ValueError):
+                raise UnvectorizableColumn('Variable %s returned %s' % (type(variable).__name__, repr(value)))
+
+        known[missing] = True
+
+        return values
+
+    def _eval_predicate(self, pred, values, mask):
+        """
+        @param pred    Predicate
+        @param values  Column of LHS values
+        @param mask    Rows to evaluate
+        @return  Boolean array (only the rows in mask are meaningful)
+        """
+
+        pred_type = type(pred)
+
+        if pred_type is predicates.Assert:
+            return values.astype(np.bool_)
+        elif pred_type is predicates.Negate:
+            return ~values.astype(np.bool_)
+
+        if values.dtype != np.object_:
+            if pred_type is predicates.Lt:
+                return values < pred.rhs
+            elif pred_type is predicates.Gt:
+                return values > pred.rhs
+            elif pred_type is predicates.Eq:
+                return values == pred.rhs
+            elif pred_type is predicates.Neq:
+                return values != pred.rhs
+            elif pred_type is predicates.In:
+                return np.in1d(values, pred.rhs)
+            elif pred_type is predicates.Notin:
+                return ~np.in1d(values, pred.rhs)
+
+        # Generic case (text values and regular expressions): evaluate once per distinct value
+        distinct = {}
+        result = np.zeros(len(values), dtype = np.bool_)
+        for irow in np.flatnonzero(mask):
+            value = values[irow]
+            try:
+                result[irow] = distinct[value]
+            except KeyError:
+                result[irow] = distinct[value] = bool(pred._eval(value))
+
+        return result
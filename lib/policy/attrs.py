@@ -17,10 +17,17 @@ class Attr(object):
 
     BOOL_TYPE, NUMERIC_TYPE, TEXT_TYPE, TIME_TYPE = range(4)
 
-    def __init__(self, vtype, attr = '', args = None):
+    # What the value depends on when evaluated for a replica, in increasing order of extent.
+    # STATIC: does not change while replicas are being deleted (dataset and site properties)
+    # REPLICA: changes when the replica itself is modified
+    # DATASET: changes when any replica of the dataset is modified
+    SCOPE_STATIC, SCOPE_REPLICA, SCOPE_DATASET = range(3)
+
+    def __init__(self, vtype, attr = '', args = None, scope = SCOPE_DATASET):
         self.vtype = vtype
         self.attr = attr
         self.args = args
+        self.scope = scope
 
         # Names of dataset.attr used by the instance
         self.required_attrs = []
@@ -66,8 +73,16 @@ class Attr(object):
 class DatasetAttr(Attr):
     """Extract an attribute from the dataset regardless of the type of replica passed __call__"""
 
-    def __init__(self, vtype, attr = None, args = None, dict_attr = None, dict_default = 0):
-        Attr.__init__(self, vtype, attr = attr, args = args)
+    def __init__(self, vtype, attr = None, args = None, dict_attr = None, dict_default = 0, scope = None):
+        if scope is None:
+            # Simple attributes and attrs set by the producers are fixed during a Detox cycle.
+            # Computed values are assumed to depend on the replicas of the dataset.
+            if attr is not None or dict_attr is not None:
+                scope = Attr.SCOPE_STATIC
+            else:
+                scope = Attr.SCOPE_DATASET
+
+        Attr.__init__(self, vtype, attr = attr, args = args, scope = scope)
 
         if dict_attr is not None:
             self.required_attrs = [dict_attr]
@@ -91,8 +106,8 @@ class DatasetAttr(Attr):
 class DatasetReplicaAttr(Attr):
     """Extract an attribute from a dataset replica. If a block replica is passed, return the attribute of the owning dataset replica."""
 
-    def __init__(self, vtype, attr = None, args = None):
-        Attr.__init__(self, vtype, attr = attr, args = args)
+    def __init__(self, vtype, attr = None, args = None, scope = Attr.SCOPE_REPLICA):
+        Attr.__init__(self, vtype, attr = attr, args = args, scope = scope)
 
     def get(self, replica):
         if type(replica) is BlockReplica:
@@ -105,8 +120,8 @@ class DatasetReplicaAttr(Attr):
 class BlockReplicaAttr(Attr):
     """Extract an attribute from a block replica. If a dataset replica is passed, return a list of values."""
 
-    def __init__(self, vtype, attr = None, args = None):
-        Attr.__init__(self, vtype, attr = attr, args = args)
+    def __init__(self, vtype, attr = None, args = None, scope = Attr.SCOPE_REPLICA):
+        Attr.__init__(self, vtype, attr = attr, args = args, scope = scope)
 
     def get(self, replica):
         if type(replica) is BlockReplica:
@@ -119,7 +134,7 @@ class ReplicaSiteAttr(Attr):
     """Extract an attribute from the site of a replica."""
 
     def __init__(self, vtype, attr = None, args = None):
-        Attr.__init__(self, vtype, attr = attr, args = args)
+        Attr.__init__(self, vtype, attr = attr, args = args, scope = Attr.SCOPE_STATIC)
 
     def get(self, replica):
         return self._get(replica.site)
@@ -56,13 +56,7 @@ class MySQLReplicaLock(object):
                 dataset_pattern, block_name = item_name, None
 
             if '*' in dataset_pattern:
-                pat_exp = re.compile(fnmatch.translate(dataset_pattern))
-                
-                datasets = []
-                for dataset in inventory.datasets.values():
-                    # this is highly inefficient but I can't think of a better way
-                    if pat_exp.match(dataset.name):
-                        datasets.append(dataset)
+                datasets = inventory.datasets.match(dataset_pattern)
             else:
                 try:
                     dataset = inventory.datasets[dataset_pattern]
@@ -67,7 +67,7 @@ class DatasetOnTape(DatasetAttr):
 
 class DatasetRelease(DatasetAttr):
     def __init__(self):
-        DatasetAttr.__init__(self, Attr.TEXT_TYPE)
+        DatasetAttr.__init__(self, Attr.TEXT_TYPE, scope = Attr.SCOPE_STATIC)
 
     def _get(self, dataset):
         version = dataset.software_version
@@ -119,7 +119,7 @@ class ReplicaIncomplete(DatasetReplicaAttr):
 
 class ReplicaNumFullDiskCopyCommonOwner(DatasetReplicaAttr):
     def __init__(self):
-        DatasetReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
+        DatasetReplicaAttr.__init__(self, Attr.NUMERIC_TYPE, scope = Attr.SCOPE_DATASET)
 
     def _get(self, replica):
         owners = set(br.group for br in replica.block_replicas)
@@ -135,7 +135,7 @@ class ReplicaNumFullDiskCopyCommonOwner(DatasetReplicaAttr):
 
 class ReplicaNumFullOtherCopyCommonOwner(DatasetReplicaAttr):
     def __init__(self):
-        DatasetReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
+        DatasetReplicaAttr.__init__(self, Attr.NUMERIC_TYPE, scope = Attr.SCOPE_DATASET)
 
     def _get(self, replica):
         owners = set(br.group for br in replica.block_replicas)
@@ -179,7 +179,7 @@ class ReplicaIsLastSource(BlockReplicaAttr):
     """True if there is an incomplete replica of the block somewhere and there is no block replica."""
 
     def __init__(self):
-        BlockReplicaAttr.__init__(self, Attr.BOOL_TYPE)
+        BlockReplicaAttr.__init__(self, Attr.BOOL_TYPE, scope = Attr.SCOPE_DATASET)
 
     def _get(self, replica):
         if not replica.is_complete():
@@ -226,7 +226,7 @@ class ReplicaIsLocked(BlockReplicaAttr):
 
 class BlockNumFullDiskCopy(BlockReplicaAttr):
     def __init__(self):
-        BlockReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
+        BlockReplicaAttr.__init__(self, Attr.NUMERIC_TYPE, scope = Attr.SCOPE_DATASET)
 
     def _get(self, replica):
         num = 0
@@ -238,7 +238,7 @@ class BlockNumFullDiskCopy(BlockReplicaAttr):
 
 class BlockReplicaOnTape(BlockReplicaAttr):
     def __init__(self):
-        BlockReplicaAttr.__init__(self, Attr.BOOL_TYPE)
+        BlockReplicaAttr.__init__(self, Attr.BOOL_TYPE, scope = Attr.SCOPE_DATASET)
 
     def _get(self, replica):
         for rep in replica.block.replicas:
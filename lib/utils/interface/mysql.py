@@ -117,6 +117,9 @@ class MySQL(object):
         # In nested functions with each one locking different tables, we need to call UNLOCK TABLES
         # only after the outermost function asks for it.
         self._locked_tables = []
+
+        # Depth of nested begin_transaction() calls. Statements are not committed while nonzero.
+        self._transaction_depth = 0
         
         # Use with care! If False, table locks and temporary tables cannot be used
         self.reuse_connection = config.get('reuse_connection', MySQL._default_config.get('reuse_connection', True))
@@ -227,13 +230,15 @@ class MySQL(object):
                 for _ in range(num_attempts):
                     try:
                         cursor.execute(sql, args)
-                        self._connection.commit()
+                        if self._transaction_depth == 0:
+                            self._connection.commit()
                         break
                     except MySQLdb.OperationalError as err:
-                        if not (self.reuse_connection and err.args[0] == 2006):
+                        if not (self.reuse_connection and err.args[0] == 2006) or self._transaction_depth != 0:
                             raise
                             #2006 = MySQL server has gone away
                             #If we are reusing connections, this type of error is to be ignored
+                            #(unless we are in a transaction, in which case the earlier statements are lost)
 
                         if not silent:
                             LOG.error(str(sys.exc_info()[1]))
@@ -685,6 +690,55 @@ class MySQL(object):
         else:
             self._connection_lock.release()
 
+    def begin_transaction(self):
+        """
+        Start a transaction. Statements issued from this thread are not committed until the matching
+        commit_transaction(). Transactions can be nested; only the outermost commit_transaction() commits.
+        Note that statements on non-transactional tables (e.g. MyISAM) take effect immediately regardless.
+        """
+
+        if not self.reuse_connection:
+            raise RuntimeError('MySQL transactions cannot be used when reuse_connection = False.')
+
+        # acquire thread lock so that other threads don't write into our transaction
+        self._connection_lock.acquire()
+
+        self._transaction_depth += 1
+
+    def commit_transaction(self):
+        """
+        Commit the current transaction if the transaction depth is 1.
+        """
+
+        if self._transaction_depth == 0:
+            raise RuntimeError('Call to commit_transaction does not match begin_transaction')
+
+        try:
+            self._transaction_depth -= 1
+
+            if self._transaction_depth == 0 and self._connection is not None:
+                self._connection.commit()
+
+        except:
+            self._transaction_depth = 0
+            self._fully_unlock()
+            raise
+        else:
+            self._connection_lock.release()
+
+    def rollback_transaction(self):
+        """
+        Roll back the current transaction, regardless of the nesting depth.
+        """
+
+        self._transaction_depth = 0
+
+        try:
+            if self._connection is not None:
+                self._connection.rollback()
+        finally:
+            self._fully_unlock()
+
     def _form_select_many_sql(self, table, fields):
         if type(fields) is str:
             fields = (fields,)
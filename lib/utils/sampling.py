@@ -0,0 +1,113 @@
+import random
+
+class WeightedSampler(object):
+    """
+    Random draws of keys with probabilities proportional to their weights. Weights are held in
+    a Fenwick (binary indexed) tree so that both a draw and a weight update cost O(log n).
+    """
+
+    def __init__(self, weights = []):
+        """
+        @param weights  Iterable of (key, weight)
+        """
+
+        weights = list(weights)
+
+        self._keys = []
+        self._index = {} # {key: position}
+        self._weights = []
+
+        for key, weight in weights:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._weights.append(0.)
+
+        # 1-based tree
+        self._tree = [0.] * (len(self._keys) + 1)
+        self._num_nonzero = 0
+
+        for key, weight in weights:
+            self.set_weight(key, weight)
+
+    def __len__(self):
+        """Number of keys with nonzero weights."""
+        return self._num_nonzero
+
+    def __contains__(self, key):
+        try:
+            return self._weights[self._index[key]] != 0.
+        except KeyError:
+            return False
+
+    def weight(self, key):
+        return self._weights[self._index[key]]
+
+    def total(self):
+        return self._prefix_sum(len(self._keys))
+
+    def set_weight(self, key, weight):
+        """
+        Change the weight of a key given at construction. Weight 0 takes the key out of the draws.
+        """
+
+        if weight < 0.:
+            raise ValueError('Negative weight %f' % weight)
+
+        pos = self._index[key]
+
+        current = self._weights[pos]
+        if current == 0. and weight != 0.:
+            self._num_nonzero += 1
+        elif current != 0. and weight == 0.:
+            self._num_nonzero -= 1
+
+        self._weights[pos] = weight
+
+        delta = weight - current
+        i = pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & (-i)
+
+    def remove(self, key):
+        self.set_weight(key, 0.)
+
+    def sample(self):
+        """
+        @return  A key drawn at random, or None if all weights are zero.
+        """
+
+        if self._num_nonzero == 0:
+            return None
+
+        x = random.random() * self.total()
+
+        # descend the tree for the smallest position with prefix sum > x
+        pos = 0
+        step = 1
+        while step * 2 < len(self._tree):
+            step *= 2
+
+        while step != 0:
+            next_pos = pos + step
+            if next_pos < len(self._tree) and self._tree[next_pos] <= x:
+                pos = next_pos
+                x -= self._tree[next_pos]
+
+            step /= 2
+
+        if pos >= len(self._keys) or self._weights[pos] == 0.:
+            # rounding errors in the tree sums; take the closest key with a weight
+            candidates = [p for p in xrange(len(self._keys)) if self._weights[p] != 0.]
+            pos = min(candidates, key = lambda p: abs(p - pos))
+
+        return self._keys[pos]
+
+    def _prefix_sum(self, num):
+        s = 0.
+        i = num
+        while i > 0:
+            s += self._tree[i]
+            i -= i & (-i)
+
+        return s
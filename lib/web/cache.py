@@ -0,0 +1,114 @@
+import time
+import collections
+
+class ResponseCache(object):
+    """
+    LRU cache of serialized web responses bound by the total size of the cached strings.
+    Entries are valid for one inventory version; the cache is emptied when the version changes.
+    """
+
+    def __init__(self, max_size):
+        """
+        @param max_size  Maximum total size of the cached response bodies in bytes.
+        """
+
+        self.max_size = max_size
+
+        self._version = None
+        # {key: (body, content_type, headers)}
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_version(self, version):
+        """
+        Declare the inventory version the following calls refer to. Drops all entries if the version changed.
+        """
+
+        if version != self._version:
+            self.clear()
+            self._version = version
+
+    def get(self, key):
+        """
+        @param key  Hashable key
+        @return (body, content_type, headers) or None
+        """
+
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            return None
+
+        # move to the most recently used end
+        self._entries[key] = entry
+
+        return entry
+
+    def put(self, key, body, content_type, headers):
+        """
+        Add a response. Responses larger than a quarter of the cache are not stored.
+        """
+
+        size = len(body)
+        if size > self.max_size / 4:
+            return
+
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key)[0])
+
+        while len(self._entries) != 0 and self._size + size > self.max_size:
+            _, (old_body, _, _) = self._entries.popitem(last = False)
+            self._size -= len(old_body)
+
+        self._entries[key] = (body, content_type, list(headers))
+        self._size += size
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+
+class IdentityCache(object):
+    """
+    Cache of user identification and authorization results keyed by the certificate DN.
+    Entries expire ttl seconds after they were filled.
+    """
+
+    def __init__(self, ttl):
+        """
+        @param ttl  Lifetime of the entries in seconds.
+        """
+
+        self.ttl = ttl
+
+        # {dn: (expiration time, (user name, user id, user dn), [(role, target)])}
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, dn):
+        """
+        @param dn  Client DN
+        @return ((user name, user id, user dn), authlist) or None
+        """
+
+        try:
+            expiration, userinfo, authlist = self._entries[dn]
+        except KeyError:
+            return None
+
+        if time.time() > expiration:
+            self._entries.pop(dn)
+            return None
+
+        return userinfo, authlist
+
+    def put(self, dn, userinfo, authlist):
+        self._entries[dn] = (time.time() + self.ttl, userinfo, authlist)
+
+    def clear(self):
+        self._entries.clear()
@@ -4,6 +4,8 @@ class WebModule(object):
         self.must_authenticate = False
         self.require_authorizer = False
         self.require_appmanager = False
+        # Set to True if the response depends only on the request and the inventory content
+        self.cacheable = False
         self.content_type = 'application/json'
         self.additional_headers = []
         self.message = ''
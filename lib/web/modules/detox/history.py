@@ -326,7 +326,11 @@ class DetoxDatasetSearch(WebDetoxHistory):
         data = {'results': [], 'conditions': {0: 'No policy match'}}
         conditions = data['conditions']
 
-        decisions = self.detox_history.get_deletion_decisions(self.cycle, size_only = False)
+        if any('*' in p or '?' in p for p in pattern_strings):
+            decisions = self.detox_history.get_deletion_decisions(self.cycle, size_only = False)
+        else:
+            # exact names - look up only the listed datasets
+            decisions = self.detox_history.get_deletion_decisions(self.cycle, size_only = False, datasets = pattern_strings)
 
         multi_action = {}
         for site_name, site_decisions in decisions.iteritems():
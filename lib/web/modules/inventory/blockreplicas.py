@@ -14,6 +14,7 @@ class ListBlockReplicas(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.cacheable = True
 
     def run(self, caller, request, inventory):
         dset_name = ''
@@ -27,15 +28,7 @@ class ListBlockReplicas(WebModule):
             return []
         
         # collect information from the inventory and registry according to the requests
-        datasets = []
-        pattern = re.compile(fnmatch.translate(dset_name))
-        if '*' in dset_name:
-            for thename in inventory.datasets.iterkeys():
-                if pattern.match(thename):
-                    datasets.append(inventory.datasets[thename])
-        else:
-            if dset_name in inventory.datasets:
-                datasets.append(inventory.datasets[dset_name])
+        datasets = inventory.datasets.match(dset_name)
         
 
         
@@ -91,8 +84,10 @@ class ListBlockReplicas(WebModule):
                     blockreps[block_obj].append(blockrep_obj)
            
         
-        response = []
-        
+        # records are generated while the response is streamed
+        return {'block': self._make_lines(blocks, blockreps)}
+
+    def _make_lines(self, blocks, blockreps):
         for dset_obj in blocks:
             for block_obj in blocks[dset_obj]:
                 repline = []
@@ -112,9 +107,7 @@ class ListBlockReplicas(WebModule):
 
                 line = {'name': block_obj.full_name(), 'files': block_obj.num_files, 'bytes': block_obj.size, 
                         'is_open': self.crt(block_obj.is_open), 'id': block_obj.id, 'replica': repline }
-                response.append(line)
-        
-        return {'block': response}
+                yield line
 
     def crt(self,boolval):
         if boolval == True: return 'y'
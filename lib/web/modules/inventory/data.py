@@ -14,6 +14,7 @@ class ListData(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.cacheable = True
 
     def run(self, caller, request, inventory):
         if 'block' not in request:
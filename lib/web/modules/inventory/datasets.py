@@ -1,6 +1,3 @@
-import fnmatch
-import re
-
 from dynamo.web.modules._base import WebModule
 from dynamo.dataformat import Dataset
 
@@ -9,23 +6,16 @@ class ListDatasets(WebModule):
     Simple dataset listing.
     """
 
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.cacheable = True
+
     def run(self, caller, request, inventory):
         datasets = []
     
         # collect information from the inventory and registry according to the requests
         if 'dataset' in request:
-            match_name = request['dataset']
-            if '*' in match_name:
-                pattern = re.compile(fnmatch.translate(match_name))
-                for name in inventory.datasets.iterkeys():
-                    if pattern.match(name):
-                        datasets.append(inventory.datasets[name])
-                
-            else:
-                try:
-                    datasets.append(inventory.datasets[match_name])
-                except KeyError:
-                    pass
+            datasets = inventory.datasets.match(request['dataset'])
     
         response = []
         for dataset in datasets:
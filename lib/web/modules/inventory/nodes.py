@@ -20,6 +20,7 @@ class NodesList(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.cacheable = True
 
 
     def run(self, caller, request, inventory):
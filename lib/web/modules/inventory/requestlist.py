@@ -84,16 +84,7 @@ class RequestList(WebModule):
             if len(site_names) < 1: site_names = None
 
         if 'dataset' in request:
-            data_names = []
-            dset_name = request['dataset']
-
-            if '*' in dset_name:
-                pattern = re.compile(fnmatch.translate(dset_name))
-                for thename in inventory.datasets.iterkeys():
-                    if pattern.match(thename):
-                        data_names.append(thename)
-            elif dset_name in inventory.datasets:
-                    data_names.append(dset_name)
+            data_names = inventory.datasets.match_names(request['dataset'])
             if len(data_names) < 1: data_names = None
 
 
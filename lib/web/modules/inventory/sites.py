@@ -9,6 +9,10 @@ class ListSites(WebModule):
     Simple site listing.
     """
 
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.cacheable = True
+
     def run(self, caller, request, inventory):
         sites = set()
     
@@ -200,6 +200,10 @@ def filter_and_categorize(request, inventory, counts_only = False):
 
 
 class TotalSizeListing(WebModule):
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.cacheable = True
+
     def run(self, caller, request, inventory):
         """
         @return {'statistic': 'size', 'content': [{key: key_name, size: size in TB}]}
@@ -227,6 +231,10 @@ class TotalSizeListing(WebModule):
 
 
 class ReplicationFactorListing(WebModule):
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.cacheable = True
+
     def run(self, caller, request, inventory):
         """
         @return {'statistic': 'replication', 'content': [{key: key_name, mean: mean rep factor, rms: rms rep factor}]}
@@ -255,6 +263,10 @@ class ReplicationFactorListing(WebModule):
 
 
 class SiteUsageListing(WebModule):
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.cacheable = True
+
     def run(self, caller, request, inventory):
         """
         @return {'statistic': 'usage', 'content': [{'site': site_name, 'usage': [{key: key_name, size: size}]}]}
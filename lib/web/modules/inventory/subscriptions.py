@@ -19,6 +19,7 @@ class SubscriptionsList(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.cacheable = True
 
     def get_replicas(self, item_name, inventory, data_blocks):
         dset_name = item_name
@@ -26,13 +27,7 @@ class SubscriptionsList(WebModule):
         if '#' in item_name:
             dset_name, _, block_name = item_name.partition('#')
 
-        if '*' in dset_name:
-            pattern = re.compile(fnmatch.translate(dset_name))
-            for thename,dset_obj in inventory.datasets.iteritems():
-                if pattern.match(thename):
-                    data_blocks[dset_obj] = []
-        elif dset_name in inventory.datasets:
-            dset_obj = inventory.datasets[dset_name]
+        for dset_obj in inventory.datasets.match(dset_name):
             data_blocks[dset_obj] = []
 
         if block_name is not None:
@@ -161,10 +156,8 @@ class SubscriptionsList(WebModule):
                 return {'dataset' : []}
             self.get_replicas(block_name,inventory,data_blocks)
 
-        dset_hash_lines = []
-        for dset_obj in data_blocks:
-            dset_hash = self.make_json(dset_obj,data_blocks,request,inventory)
-            dset_hash_lines.append(dset_hash)
+        # records are generated while the response is streamed
+        dset_hash_lines = (self.make_json(dset_obj,data_blocks,request,inventory) for dset_obj in data_blocks)
 
         return {'dataset': dset_hash_lines }
         
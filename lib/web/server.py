@@ -3,21 +3,30 @@ import sys
 import time
 import traceback
 import json
+import zlib
+import types
+import itertools
 import logging
 import logging.handlers
 import socket
+import signal
 import collections
 import warnings
+import threading
 import multiprocessing
+import hashlib
 import cStringIO
 from cgi import parse_qs, escape
 from flup.server.fcgi_fork import WSGIServer
 
 import dynamo.core.serverutils as serverutils
+from dynamo.core.inventory import ObjectRepository, DynamoInventory
+from dynamo.dataformat import ObjectError
 import dynamo.web.exceptions as exceptions
 # Actual modules imported at the bottom of this file
 from dynamo.web.modules import modules, load_modules
 from dynamo.web.modules._html import HTMLMixin
+from dynamo.web.cache import ResponseCache, IdentityCache
 
 from dynamo.utils.transform import unicode2str
 from dynamo.utils.log import reset_logger
@@ -66,11 +75,61 @@ class WebServer(object):
 
         # Preforked WSGI server
         # Preforking = have at minimum min_idle and at maximum max_idle child processes listening to the out-facing port.
-        # There can be at most max_procs children. Each child process is single-use to ensure changes to shared resources (e.g. inventory)
-        # made in a child process does not affect the other processes.
-        prefork_config = {'minSpare': config.get('min_idle', 1), 'maxSpare': config.get('max_idle', 5), 'maxChildren': config.get('max_procs', 10), 'maxRequests': 1}
+        # There can be at most max_procs children. By default each child process is single-use to ensure changes to shared resources
+        # (e.g. inventory) made in a child process does not affect the other processes.
+        # With persistent_workers, children serve up to max_requests (0 = unlimited) requests and are recycled when they are older than
+        # max_worker_age seconds, use more than max_worker_memory MB, have served a write-enabled request, or have an outdated inventory.
+        self.persistent_workers = config.get('persistent_workers', False)
+        if self.persistent_workers:
+            max_requests = config.get('max_requests', 0)
+        else:
+            max_requests = 1
+
+        prefork_config = {'minSpare': config.get('min_idle', 1), 'maxSpare': config.get('max_idle', 5), 'maxChildren': config.get('max_procs', 10), 'maxRequests': max_requests}
         self.wsgi_server = WSGIServer(self.main, bindAddress = config.socket, umask = 0, **prefork_config)
 
+        self.max_worker_age = config.get('max_worker_age', 3600)
+        self.max_worker_memory = config.get('max_worker_memory', 0)
+
+        # Inventory updates are sent to the server process as (generation, update commands) and applied to the
+        # inventory image the workers are forked from. The generation counter is shared by all processes.
+        self.inventory_updates = None
+        self.inventory_generation = multiprocessing.Value('L', 0, lock = True)
+
+        # Responses of cacheable (read-only) modules are cached per process, keyed by the request and the inventory image
+        # version, and are tagged with an ETag. The size is given in MB; 0 disables the cache (ETags are still sent).
+        cache_size = config.get('response_cache_size', 100)
+        if cache_size > 0:
+            self.response_cache = ResponseCache(cache_size * 1048576)
+        else:
+            self.response_cache = None
+
+        # Responses are gzip-compressed with this level (0 = never) if the client accepts it and the body is at least
+        # gzip_min_size bytes long. Streamed responses are always compressed when accepted.
+        self.gzip_level = config.get('gzip_level', 6)
+        self.gzip_min_size = config.get('gzip_min_size', 4096)
+
+        # User identities and authorizations of HTTPS clients are cached per process for identity_cache_ttl seconds (0 = no cache).
+        # All entries are dropped when the modification time of the identity_marker file changes (touched by dynamo-user-auth).
+        identity_cache_ttl = config.get('identity_cache_ttl', 300)
+        if identity_cache_ttl > 0:
+            self.identity_cache = IdentityCache(identity_cache_ttl)
+        else:
+            self.identity_cache = None
+
+        self.identity_marker = config.get('identity_marker', '')
+        self._identity_marker_mtime = None
+
+        # Distinguishes the image versions of this server instance from those of a previous run
+        self._image_epoch = int(time.time())
+
+        # Process-local states of the inventory image and of the worker
+        self._image_generation = 0
+        self._image_updating = False
+        self._worker_pid = 0
+        self._worker_start_time = 0
+        self._retire_worker = False
+
         self.server_proc = None
 
         self.active_count = multiprocessing.Value('I', 0, lock = True)
@@ -94,6 +153,8 @@ class WebServer(object):
         if self.server_proc and self.server_proc.is_alive():
             raise RuntimeError('Web server is already running')
 
+        self._prepare_image()
+
         self.server_proc = multiprocessing.Process(target = self._serve)
         self.server_proc.daemon = True
         self.server_proc.start()
@@ -135,6 +196,8 @@ class WebServer(object):
 
         # A new WSGI server will overtake the socket. New requests will be handled by new_server_proc
         LOG.debug('Starting new web server.')
+        self._prepare_image()
+
         new_server_proc = multiprocessing.Process(target = self._serve)
         new_server_proc.daemon = True
         new_server_proc.start()
@@ -154,6 +217,141 @@ class WebServer(object):
 
         LOG.info('Started web server (PID %d).', self.server_proc.pid)
 
+    def refresh(self, update_commands):
+        """
+        Bring the inventory of the web server up to date after updates were applied to the server inventory.
+        With persistent workers, the update commands are applied to the image in the web server process and
+        the workers forked from an older image retire after their current request. Otherwise the web server
+        is restarted.
+        @param update_commands  List of (cmd, code) applied to the server inventory
+        """
+
+        if not self.persistent_workers or self.image_error.value:
+            self.restart()
+            return
+
+        with self.inventory_generation.get_lock():
+            self.inventory_generation.value += 1
+            generation = self.inventory_generation.value
+
+        LOG.debug('Sending %d updates to the web server (generation %d).', len(update_commands), generation)
+
+        self.inventory_updates.put((generation, update_commands))
+
+    def _prepare_image(self):
+        # Called before forking a new web server process, which starts with a fresh copy of the server inventory.
+        # Each web server process reads its own update queue.
+        with self.inventory_generation.get_lock():
+            self.inventory_generation.value += 1
+            self._image_generation = self.inventory_generation.value
+
+        self._image_updating = False
+        if self.persistent_workers:
+            self.inventory_updates = multiprocessing.Queue()
+            # Set by the web server process when an update could not be applied to the image
+            self.image_error = multiprocessing.Array('c', 2048, lock = False)
+
+    def check_image(self):
+        """
+        Restart the web server if its process could not bring the inventory image up to date.
+        Called periodically from the server main loop.
+        """
+
+        if self.persistent_workers and self.image_error.value:
+            LOG.error('Web server failed to apply inventory updates:\n%s', self.image_error.value)
+            self.restart()
+
+    def _apply_inventory_updates(self):
+        """
+        Thread in the web server process applying the inventory updates to the image the workers are forked from.
+        A worker forked while an update is ongoing sees _image_updating = True and refuses to serve.
+        Nothing is logged from this thread, because a worker forked while the thread holds the logging lock would
+        deadlock at the first log message. Failures are reported through image_error instead; the image generation
+        is then not advanced until the server restarts the web server (see check_image).
+        Once the image is advanced, the prefork parent is asked to replace its children if the flup version supports
+        gradual purging through SIGUSR1; otherwise the children retire after their next request.
+        """
+
+        inventory = self.dynamo_server.inventory
+
+        can_purge = hasattr(signal, 'SIGUSR1') and hasattr(self.wsgi_server, '_usr1Handler')
+
+        while True:
+            try:
+                generation, update_commands = self.inventory_updates.get()
+            except:
+                self.image_error.value = traceback.format_exc()[-2047:]
+                return
+
+            self._image_updating = True
+
+            error = None
+
+            # Only in memory, as when replaying the snapshot journal
+            for cmd, code in update_commands:
+                try:
+                    obj = inventory.make_object(code)
+                    if cmd == DynamoInventory.CMD_UPDATE:
+                        ObjectRepository.update(inventory, obj)
+                    elif cmd == DynamoInventory.CMD_DELETE:
+                        try:
+                            ObjectRepository.delete(inventory, obj)
+                        except (KeyError, ObjectError):
+                            pass
+                except:
+                    # Apply the rest of the batch anyway; the image is replaced at the restart
+                    if error is None:
+                        error = traceback.format_exc()
+
+            if error is None:
+                self._image_generation = generation
+            else:
+                self.image_error.value = error[-2047:]
+
+            self._image_updating = False
+
+            if error is None and can_purge:
+                # Idle children exit and are replaced by forks of the new image; busy ones finish their request first
+                os.kill(os.getpid(), signal.SIGUSR1)
+
+    def _start_worker_request(self):
+        pid = os.getpid()
+        if pid != self._worker_pid:
+            # First request served by this worker
+            self._worker_pid = pid
+            self._worker_start_time = time.time()
+            self._retire_worker = False
+
+    def _end_worker_request(self):
+        """
+        Decide whether the persistent worker should be recycled after the current request.
+        """
+
+        if not self._retire_worker:
+            if self._image_generation != self.inventory_generation.value:
+                # The inventory was updated after this worker was forked
+                self._retire_worker = True
+            elif self.max_worker_age > 0 and time.time() - self._worker_start_time > self.max_worker_age:
+                self._retire_worker = True
+            elif self.max_worker_memory > 0 and self._worker_memory() > self.max_worker_memory:
+                self._retire_worker = True
+
+        if self._retire_worker:
+            # The preforked child exits after the current request once its request count reaches maxRequests
+            self.wsgi_server._maxRequests = 1
+
+    @staticmethod
+    def _worker_memory():
+        """Resident memory of the current process in MB."""
+
+        try:
+            with open('/proc/self/statm') as source:
+                rss_pages = int(source.read().split()[1])
+        except (IOError, IndexError, ValueError):
+            return 0.
+
+        return rss_pages * os.sysconf('SC_PAGE_SIZE') / 1048576.
+
     def _serve(self):
         if self.log_path:
             reset_logger()
@@ -193,6 +391,11 @@ class WebServer(object):
         except KeyboardInterrupt:
             os._exit(0)
 
+        if self.persistent_workers:
+            updater = threading.Thread(target = self._apply_inventory_updates)
+            updater.daemon = True
+            updater.start()
+
         try:
             self.wsgi_server.run()
         except SystemExit as exc:
@@ -203,6 +406,9 @@ class WebServer(object):
             os._exit(exc.code)
 
     def main(self, environ, start_response):
+        if self.persistent_workers:
+            self._start_worker_request()
+
         # Increment the active count so that the parent process won't be killed before this function returns
         with self.active_count.get_lock():
             self.active_count.value += 1
@@ -229,6 +435,11 @@ class WebServer(object):
         sys.stdout = stream
         sys.stderr = stream
 
+        # Set to True if the response is streamed; the request is then completed when the stream ends
+        streaming = False
+        # Filled with the request log for the end of the stream
+        request_log = []
+
         try:
             self.code = 200 # HTTP response code
             self.content_type = 'application/json' # content type string
@@ -236,12 +447,20 @@ class WebServer(object):
             self.callback = None # set to callback function name if this is a JSONP request
             self.message = '' # string
             self.phedex_request = '' # backward compatibility
+            self.etag = None # set for cacheable responses
+            self.cache_key = None # set for cacheable responses not found in the cache
+            self.cached_response = False # True if content is a complete response body from the cache
 
             content = self._main(environ)
 
+            # Generator of JSON text pieces if the content contains generators of records
+            body_chunks = None
+
             # Maybe we can use some standard library?
             if self.code == 200:
                 status = 'OK'
+            elif self.code == 304:
+                status = 'Not Modified'
             elif self.code == 400:
                 status = 'Bad Request'
             elif self.code == 403:
@@ -253,7 +472,10 @@ class WebServer(object):
             elif self.code == 503:
                 status = 'Service Unavailable'
 
-            if self.content_type == 'application/json':
+            if self.code == 304 or self.cached_response:
+                pass
+
+            elif self.content_type == 'application/json':
                 if self.phedex_request != '':
                     if type(content) is not dict:
                         self.code == 500
@@ -269,28 +491,76 @@ class WebServer(object):
                                                 'request_date': time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime()), 'request_timestamp': time.time(),
                                                 'request_url': url, 'request_version': '2.2.1'}}
                         json_data['phedex'].update(content)
-    
-                        content = json.dumps(json_data)
+
+                        if WebServer._has_generator(content):
+                            body_chunks = WebServer._iter_json(json_data)
+                        else:
+                            content = json.dumps(json_data)
 
                 else:
                     json_data = {'result': status, 'message': self.message}
                     if content is not None:
                         json_data['data'] = content
     
-                    # replace content with the json string
-                    start = time.time()
-                    if self.callback is not None:
-                        content = '%s(%s)' % (self.callback, json.dumps(json_data))
+                    if WebServer._has_generator(content):
+                        body_chunks = WebServer._iter_json(json_data)
+                        if self.callback is not None:
+                            body_chunks = itertools.chain(['%s(' % self.callback], body_chunks, [')'])
+
                     else:
-                        content = json.dumps(json_data)
+                        # replace content with the json string
+                        start = time.time()
+                        if self.callback is not None:
+                            content = '%s(%s)' % (self.callback, json.dumps(json_data))
+                        else:
+                            content = json.dumps(json_data)
 
-                    root_logger.info('Make JSON: %s seconds', time.time() - start)
+                        root_logger.info('Make JSON: %s seconds', time.time() - start)
 
             headers = [('Content-Type', self.content_type)] + self.headers
 
-            start_response('%d %s' % (self.code, status), headers)
+            if self.etag is not None:
+                headers.append(('ETag', self.etag))
+
+            if self.code == 304:
+                start_response('%d %s' % (self.code, status), headers)
+                return ''
 
-            return content + '\n'
+            use_gzip = self._accepts_gzip(environ)
+            if self.gzip_level > 0:
+                headers.append(('Vary', 'Accept-Encoding'))
+
+            if body_chunks is None:
+                if self.cache_key is not None and self.code == 200 and type(content) is str:
+                    self.response_cache.put(self.cache_key, content, self.content_type, self.headers)
+
+                body = content + '\n'
+
+                if use_gzip and type(body) is str and len(body) >= self.gzip_min_size:
+                    headers.append(('Content-Encoding', 'gzip'))
+                    body = ''.join(self._gzip_chunks([body]))
+
+                start_response('%d %s' % (self.code, status), headers)
+
+                return body
+
+            else:
+                root_logger.info('Streaming JSON response.')
+
+                body_chunks = WebServer._buffer_chunks(itertools.chain(body_chunks, ['\n']))
+
+                if self.cache_key is not None and self.code == 200:
+                    body_chunks = self._cache_chunks(body_chunks, self.cache_key, self.content_type, self.headers)
+
+                if use_gzip:
+                    headers.append(('Content-Encoding', 'gzip'))
+                    body_chunks = self._gzip_chunks(body_chunks)
+
+                start_response('%d %s' % (self.code, status), headers)
+
+                streaming = True
+
+                return self._stream(environ, body_chunks, request_log)
 
         finally:
             sys.stdout = stdout
@@ -306,9 +576,157 @@ class WebServer(object):
             else:
                 log = 'return:\n%s\n%s%s' % (delim, ''.join('  %s\n' % line for line in log_tmp.split('\n')), delim)
 
-            with self.active_count.get_lock():
-                LOG.info('%s-%s %s (%s:%s) %s', environ['REQUEST_SCHEME'], environ['REQUEST_METHOD'], environ['REQUEST_URI'], environ['REMOTE_ADDR'], environ['REMOTE_PORT'], log)
-                self.active_count.value -= 1
+            if streaming:
+                request_log.append(log)
+            else:
+                self._close_request(environ, log)
+
+            if self.persistent_workers:
+                self._end_worker_request()
+
+    def _close_request(self, environ, log):
+        with self.active_count.get_lock():
+            LOG.info('%s-%s %s (%s:%s) %s', environ['REQUEST_SCHEME'], environ['REQUEST_METHOD'], environ['REQUEST_URI'], environ['REMOTE_ADDR'], environ['REMOTE_PORT'], log)
+            self.active_count.value -= 1
+
+    def _stream(self, environ, body_chunks, request_log):
+        """
+        Response iterable of a streamed request. The module code producing the records runs while the
+        response is written. Errors cannot be reported through the status code any more and result in
+        a truncated response.
+        """
+
+        try:
+            for chunk in body_chunks:
+                yield chunk
+
+        except Exception:
+            # GeneratorExit (client disconnected and the stream was closed) is not an error
+            LOG.error('Exception while streaming the response of %s:\n%s', environ['REQUEST_URI'], traceback.format_exc())
+
+        finally:
+            if len(request_log) != 0:
+                log = request_log[0]
+            else:
+                log = 'empty log'
+
+            self._close_request(environ, log)
+
+    def _accepts_gzip(self, environ):
+        if self.gzip_level <= 0:
+            return False
+
+        try:
+            accept_encoding = environ['HTTP_ACCEPT_ENCODING']
+        except KeyError:
+            return False
+
+        return 'gzip' in [enc.partition(';')[0].strip() for enc in accept_encoding.split(',')]
+
+    def _gzip_chunks(self, chunks):
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+
+        yield compressor.flush()
+
+    def _cache_chunks(self, chunks, key, content_type, headers):
+        """
+        Pass the chunks through and store the full body in the response cache if it fits.
+        """
+
+        max_size = self.response_cache.max_size / 4
+        pieces = []
+        size = 0
+
+        for chunk in chunks:
+            if pieces is not None:
+                pieces.append(chunk)
+                size += len(chunk)
+                if size > max_size:
+                    pieces = None
+
+            yield chunk
+
+        if pieces is not None:
+            # body without the trailing newline, as for non-streamed responses
+            self.response_cache.put(key, ''.join(pieces)[:-1], content_type, headers)
+
+    @staticmethod
+    def _buffer_chunks(chunks, size = 65536):
+        """
+        Join small pieces of text into chunks of at least the given size.
+        """
+
+        buf = []
+        buf_size = 0
+        for chunk in chunks:
+            buf.append(chunk)
+            buf_size += len(chunk)
+            if buf_size >= size:
+                yield ''.join(buf)
+                buf = []
+                buf_size = 0
+
+        if len(buf) != 0:
+            yield ''.join(buf)
+
+    @staticmethod
+    def _has_generator(obj):
+        """
+        @return True if obj is a generator or a dict holding a generator (at any depth of nested dicts).
+        """
+
+        if type(obj) is types.GeneratorType:
+            return True
+        elif type(obj) is dict:
+            for value in obj.itervalues():
+                if WebServer._has_generator(value):
+                    return True
+
+        return False
+
+    @staticmethod
+    def _iter_json(obj):
+        """
+        Generate the JSON representation of obj in pieces. Generators in obj are written as JSON arrays
+        one element at a time.
+        """
+
+        if type(obj) is types.GeneratorType:
+            yield '['
+            first = True
+            for elem in obj:
+                if first:
+                    first = False
+                else:
+                    yield ', '
+
+                for chunk in WebServer._iter_json(elem):
+                    yield chunk
+
+            yield ']'
+
+        elif type(obj) is dict and WebServer._has_generator(obj):
+            yield '{'
+            first = True
+            for key, value in obj.iteritems():
+                if first:
+                    first = False
+                else:
+                    yield ', '
+
+                yield json.dumps(key) + ': '
+
+                for chunk in WebServer._iter_json(value):
+                    yield chunk
+
+            yield '}'
+
+        else:
+            yield json.dumps(obj)
 
     def _main(self, environ):
         """
@@ -330,14 +748,24 @@ class WebServer(object):
             authlist = []
 
         elif environ['REQUEST_SCHEME'] == 'https':
-            authorizer = self.dynamo_server.manager.master.create_authorizer()
-
             # Client DN must match a known user
             try:
-                dn = WebServer.format_dn(environ['SSL_CLIENT_S_DN'])
-                userinfo = authorizer.identify_user(dn = dn, check_trunc = True)
-                if userinfo is None:
-                    raise exceptions.AuthorizationError()
+                client_dn = WebServer.format_dn(environ['SSL_CLIENT_S_DN'])
+
+                cached = self._get_cached_identity(client_dn)
+                if cached is None:
+                    authorizer = self.dynamo_server.manager.master.create_authorizer()
+
+                    userinfo = authorizer.identify_user(dn = client_dn, check_trunc = True)
+                    if userinfo is None:
+                        raise exceptions.AuthorizationError()
+
+                    authlist = authorizer.list_user_auth(userinfo[0])
+
+                    if self.identity_cache is not None:
+                        self.identity_cache.put(client_dn, userinfo, authlist)
+                else:
+                    userinfo, authlist = cached
 
                 user, user_id, dn = userinfo
 
@@ -348,8 +776,6 @@ class WebServer(object):
             except:
                 return self._internal_server_error()
 
-            authlist = authorizer.list_user_auth(user)
-
         else:
             self.code = 400
             self.message = 'Only HTTP or HTTPS requests are allowed.'
@@ -410,7 +836,18 @@ class WebServer(object):
             self.message = 'Resource only available with HTTPS.'
             return
 
+        if self._image_updating:
+            # This worker was forked in the middle of an inventory image update. A worker forked from an older but
+            # complete image serves the request and retires afterwards (see _end_worker_request).
+            self._retire_worker = True
+            self.code = 503
+            self.message = 'Server cannot execute %s/%s at the moment because the inventory is being updated.' % (module, command)
+            return
+
         if provider.write_enabled:
+            # Changes made to the inventory must not be visible to later requests
+            self._retire_worker = True
+
             self.dynamo_server.manager.master.lock()
 
             try:
@@ -508,6 +945,11 @@ class WebServer(object):
             ## Step 5
             caller = WebServer.User(user, dn, user_id, authlist)
 
+            if provider.cacheable:
+                cached = self._check_response_cache(environ, mode, module, command, request, provider)
+                if cached is not None:
+                    return cached
+
             if self.dynamo_server.inventory.loaded:
                 inventory = self.dynamo_server.inventory.create_proxy()
                 if provider.write_enabled:
@@ -541,6 +983,79 @@ class WebServer(object):
 
         return content
 
+    def _get_cached_identity(self, dn):
+        """
+        @param dn  Client DN
+        @return ((user name, user id, user dn), authlist) or None
+        """
+
+        if self.identity_cache is None:
+            return None
+
+        if self.identity_marker:
+            try:
+                mtime = os.stat(self.identity_marker).st_mtime
+            except OSError:
+                mtime = None
+
+            if mtime != self._identity_marker_mtime:
+                # Users or authorizations have changed
+                self.identity_cache.clear()
+                self._identity_marker_mtime = mtime
+
+        return self.identity_cache.get(dn)
+
+    def _check_response_cache(self, environ, mode, module, command, request, provider):
+        """
+        Set the ETag of a cacheable response and look for the response in the cache.
+        @return Response body if the response can be served without running the module, otherwise None.
+        """
+
+        if self._image_generation != self.inventory_generation.value:
+            # This process serves from an image older than the latest inventory (a child of a web server being
+            # replaced by restart(), or a persistent worker that retires after this request). The response is
+            # neither cached nor tagged, so that it cannot be confirmed later as current.
+            return None
+
+        # The body comes from this process's image; version the tag and the cache accordingly
+        version = (self._image_epoch, self._image_generation)
+
+        if provider.input_data is None:
+            input_data = None
+        else:
+            input_data = json.dumps(provider.input_data, sort_keys = True)
+
+        normalized_request = tuple(sorted((key, tuple(value) if type(value) is list else value) for key, value in request.iteritems()))
+
+        key = (mode, module, command, self.phedex_request, normalized_request, input_data)
+
+        self.etag = '"%s"' % hashlib.md5(repr((version, key))).hexdigest()
+
+        try:
+            if_none_match = environ['HTTP_IF_NONE_MATCH']
+        except KeyError:
+            pass
+        else:
+            if self.etag in [tag.strip() for tag in if_none_match.split(',')]:
+                self.code = 304
+                return ''
+
+        if self.response_cache is None:
+            return None
+
+        self.response_cache.set_version(version)
+
+        cached = self.response_cache.get(key)
+        if cached is None:
+            self.cache_key = key
+            return None
+
+        body, self.content_type, headers = cached
+        self.headers = list(headers)
+        self.cached_response = True
+
+        return body
+
     def _internal_server_error(self):
         self.code = 500
         self.content_type = 'text/plain'
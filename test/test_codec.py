@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+import unittest
+import marshal
+
+from dynamo import dataformat
+from dynamo.core import codec
+from dynamo.core.inventory import DynamoInventory
+
+
+def make_objects():
+    # A small linked inventory with one object of each type
+    partition = dataformat.Partition('Physics', pid = 1)
+    site = dataformat.Site('T2_US_MIT', host = 'se.mit.edu', status = dataformat.Site.STAT_READY, sid = 2)
+    site_partition = dataformat.SitePartition(site, partition, quota = 100.)
+    group = dataformat.Group('AnalysisOps', olevel = dataformat.Group.OL_DATASET, gid = 3)
+    dataset = dataformat.Dataset('/Primary/Processed-v1/AOD', status = dataformat.Dataset.STAT_VALID, last_update = 1500000000, did = 4)
+    block = dataformat.Block(dataformat.Block.to_internal_name('0123abcd'), dataset, size = 2000, num_files = 2, last_update = 1500000000, bid = 5)
+    lfile = dataformat.File('/store/data/file.root', block, size = 1000, fid = 6)
+    dataset_replica = dataformat.DatasetReplica(dataset, site, growing = True, group = group)
+    complete_replica = dataformat.BlockReplica(block, site, group, is_custodial = True, last_update = 1500000000)
+    partial_replica = dataformat.BlockReplica(block, site, group, size = 1000, last_update = 1500000000, file_ids = (6,))
+
+    return [partition, site, site_partition, group, dataset, block, lfile, dataset_replica, complete_replica, partial_replica]
+
+
+class TestCodec(unittest.TestCase):
+    def assertRoundTrip(self, objects, codes):
+        for obj, code in zip(objects, codes):
+            decoded = codec.decode(code)
+            self.assertEqual(type(decoded), type(obj))
+
+            if type(obj) is dataformat.BlockReplica:
+                # an unlinked block replica cannot tell if it is complete and therefore cannot be encoded
+                self.assertEqual(decoded._block_full_name(), obj._block_full_name())
+                self.assertEqual(decoded._site_name(), obj._site_name())
+                self.assertEqual(decoded._group_name(), obj._group_name())
+                self.assertEqual(decoded.is_custodial, obj.is_custodial)
+                self.assertEqual(decoded.last_update, obj.last_update)
+                if obj.is_complete():
+                    self.assertEqual(decoded.size, -1)
+                else:
+                    self.assertEqual((decoded.size, decoded.file_ids), (obj.size, obj.file_ids))
+            else:
+                self.assertEqual(codec.encode(decoded), codec.encode(obj))
+
+    def test_encode_decode(self):
+        objects = make_objects()
+        codes = [codec.encode(obj) for obj in objects]
+        for code in codes:
+            self.assertEqual(type(code), tuple)
+
+        self.assertRoundTrip(objects, codes)
+
+    def test_pack_unpack(self):
+        objects = make_objects()
+        codes = [codec.unpack(codec.pack(codec.encode(obj))) for obj in objects]
+
+        self.assertRoundTrip(objects, codes)
+
+    def test_pack_batch(self):
+        objects = make_objects()
+
+        commands = []
+        for obj in objects:
+            commands.append((DynamoInventory.CMD_UPDATE, codec.encode(obj)))
+        commands.append((DynamoInventory.CMD_DELETE, codec.encode(objects[-1])))
+
+        unpacked = codec.unpack_batch(codec.pack_batch(commands))
+        self.assertEqual(unpacked, commands)
+
+        self.assertRoundTrip(objects, [code for _, code in unpacked[:-1]])
+
+        self.assertEqual(codec.unpack_batch(codec.pack_batch([])), [])
+
+    def test_version_mismatch(self):
+        code = codec.encode(make_objects()[0])
+
+        self.assertRaises(dataformat.OperationalError, codec.unpack, marshal.dumps((codec.CODEC_VERSION + 1, code)))
+        self.assertRaises(dataformat.OperationalError, codec.unpack_batch, marshal.dumps((codec.CODEC_VERSION + 1, [(0, code)])))
+
+    def test_unknown_type(self):
+        self.assertRaises(dataformat.ObjectError, codec.encode, 'not an object')
+
+    def test_legacy_repr(self):
+        # make_object accepts the repr strings written by older servers
+        inventory = DynamoInventory.__new__(DynamoInventory)
+        for obj in make_objects():
+            if type(obj) is dataformat.BlockReplica:
+                # repr of an unlinked block replica is not available
+                continue
+
+            self.assertEqual(repr(inventory.make_object(repr(obj))), repr(obj))
+
+
+if __name__ == '__main__':
+    unittest.main()
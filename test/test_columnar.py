@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import marshal
+import tempfile
+import unittest
+
+from dynamo.dataformat import IntegrityError
+from dynamo.detox.columnar import ColumnarSnapshot
+
+
+SITES = [(1, 'ready', 100.), (2, 'morgue', 0.), (3, 'ready', 50.)]
+
+# (site_id, dataset_id, size, decision, condition), ordered by site_id then dataset_id
+REPLICAS = [
+    (1, 10, 1.5, 'delete', 3),
+    (1, 11, 2.5, 'keep', 0),
+    (1, 12, 0.5, 'protect', 4),
+    (3, 10, 1.5, 'keep', 0),
+    (3, 12, 0.5, 'delete', 3),
+    (4, 11, 2.5, 'protect', 5) # site not in the site list
+]
+
+class TestColumnarSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'snapshot.col')
+
+        ColumnarSnapshot(self.path).write(SITES, REPLICAS)
+        self.archive = ColumnarSnapshot(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_exists(self):
+        self.assertTrue(self.archive.exists())
+        self.assertFalse(ColumnarSnapshot(self.path + '.none').exists())
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_sites(self):
+        self.assertEqual(self.archive.get_sites(), {1: ('ready', 100., 3), 2: ('morgue', 0., 0), 3: ('ready', 50., 2), 4: (None, 0, 1)})
+
+    def test_volumes(self):
+        self.assertEqual(self.archive.get_volumes(), {1: {'delete': 1.5, 'keep': 2.5, 'protect': 0.5}, 2: {}, 3: {'keep': 1.5, 'delete': 0.5}, 4: {'protect': 2.5}})
+
+    def test_site_replicas(self):
+        self.assertEqual(self.archive.get_site_replicas(1), [r[1:] for r in REPLICAS if r[0] == 1])
+        self.assertEqual(self.archive.get_site_replicas(2), [])
+        self.assertEqual(self.archive.get_site_replicas(5), [])
+
+    def test_dataset_replicas(self):
+        for dataset_id in [10, 11, 12, 13]:
+            expected = [(r[0],) + r[2:] for r in REPLICAS if r[1] == dataset_id]
+            self.assertEqual(self.archive.get_dataset_replicas(dataset_id), expected)
+
+    def test_iterate(self):
+        self.assertEqual(list(self.archive.iterate()), REPLICAS)
+
+    def test_empty(self):
+        path = os.path.join(self.tmpdir, 'empty.col')
+        ColumnarSnapshot(path).write([], [])
+
+        archive = ColumnarSnapshot(path)
+        self.assertEqual(archive.get_sites(), {})
+        self.assertEqual(list(archive.iterate()), [])
+
+    def test_bad_format(self):
+        path = os.path.join(self.tmpdir, 'bad.col')
+        with open(path, 'wb') as output:
+            marshal.dump(('dynamo-inventory-snapshot', 1), output)
+
+        self.assertRaises(IntegrityError, ColumnarSnapshot(path).get_sites)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+
+import re
+import fnmatch
+import random
+import pickle
+import unittest
+
+from dynamo.core.inventory import DatasetKeyDict
+
+
+PATTERNS = [
+    '/Beta*/*/AOD',
+    '/Beta*',
+    '*/RAW',
+    '/Alpha1?/*',
+    '/[AB]*/Run1*/MINIAOD',
+    '*',
+    '/Zeta3/Run2-v1/AOD',
+    '/Zeta1/*/NANO*',
+    'nomatch*',
+    '/Gamma2/Run[0-2]-v?/RAW'
+]
+
+class NamedObject(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class TestDatasetKeyDict(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+
+        self.datasets = DatasetKeyDict()
+        # plain dict with the same content
+        self.reference = {}
+
+    def random_name(self):
+        primary = random.choice(['Alpha', 'Beta', 'BetaX', 'Gamma', 'Zeta'])
+        tier = random.choice(['AOD', 'MINIAOD', 'RAW', 'NANOAOD'])
+        return '/%s%d/Run%d-v%d/%s' % (primary, random.randint(0, 30), random.randint(0, 5), random.randint(1, 3), tier)
+
+    def check(self):
+        for pattern in PATTERNS:
+            regex = re.compile(fnmatch.translate(pattern))
+            expected = sorted(name for name in self.reference if regex.match(name))
+
+            self.assertEqual(self.datasets.match_names(pattern), expected)
+            self.assertEqual(self.datasets.match(pattern), [self.reference[name] for name in expected])
+
+    def test_literal(self):
+        self.datasets.add(NamedObject('/A/B/C'))
+
+        self.assertEqual(self.datasets.match_names('/A/B/C'), ['/A/B/C'])
+        self.assertEqual(self.datasets.match_names('/A/B/D'), [])
+
+    def test_modifications(self):
+        for iteration in xrange(300):
+            op = random.random()
+            if op < 0.5:
+                obj = NamedObject(self.random_name())
+                self.datasets.add(obj)
+                self.reference[obj.name] = obj
+
+            elif op < 0.6:
+                objs = [NamedObject(self.random_name()) for _ in xrange(random.randint(1, 200))]
+                self.datasets.update((obj.name, obj) for obj in objs)
+                self.reference.update((obj.name, obj) for obj in objs)
+
+            elif op < 0.8 and len(self.reference) != 0:
+                name = random.choice(self.reference.keys())
+                if random.random() < 0.5:
+                    del self.datasets[name]
+                else:
+                    self.datasets.pop(name)
+
+                self.reference.pop(name)
+
+            elif op < 0.81:
+                self.datasets.clear()
+                self.reference.clear()
+
+            else:
+                self.assertEqual(self.datasets.pop('absent', None), None)
+                obj = self.datasets.setdefault('/Beta1/Run1-v1/AOD', NamedObject('/Beta1/Run1-v1/AOD'))
+                self.reference.setdefault(obj.name, obj)
+
+            if iteration % 7 == 0:
+                self.check()
+
+        self.check()
+
+    def test_pickle(self):
+        for _ in xrange(100):
+            name = self.random_name()
+            self.datasets[name] = name
+
+        copied = pickle.loads(pickle.dumps(self.datasets, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(type(copied), DatasetKeyDict)
+        self.assertEqual(dict(copied), dict(self.datasets))
+        self.assertEqual(copied.match_names('*'), sorted(self.datasets))
+
+
+if __name__ == '__main__':
+    unittest.main()
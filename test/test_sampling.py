@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+
+import unittest
+import random
+import collections
+
+from dynamo.utils.sampling import WeightedSampler
+
+
+class TestWeightedSampler(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+
+    def draw(self, sampler, num = 20000):
+        counts = collections.Counter(sampler.sample() for _ in xrange(num))
+        return dict((key, count / float(num)) for key, count in counts.iteritems())
+
+    def test_empty(self):
+        sampler = WeightedSampler()
+        self.assertEqual(len(sampler), 0)
+        self.assertEqual(sampler.sample(), None)
+
+    def test_weights(self):
+        sampler = WeightedSampler([('a', 1.), ('b', 3.), ('c', 0.), ('d', 4.)])
+
+        self.assertEqual(len(sampler), 3)
+        self.assertFalse('c' in sampler)
+        self.assertFalse('x' in sampler)
+        self.assertAlmostEqual(sampler.total(), 8.)
+
+        fractions = self.draw(sampler)
+        self.assertFalse('c' in fractions)
+        for key, weight in [('a', 1.), ('b', 3.), ('d', 4.)]:
+            self.assertAlmostEqual(fractions[key], weight / 8., delta = 0.02)
+
+    def test_set_weight(self):
+        sampler = WeightedSampler([(i, 1.) for i in xrange(10)])
+
+        sampler.set_weight(3, 11.)
+        sampler.remove(5)
+
+        self.assertEqual(len(sampler), 9)
+        self.assertFalse(5 in sampler)
+        self.assertAlmostEqual(sampler.weight(3), 11.)
+        self.assertAlmostEqual(sampler.total(), 19.)
+
+        fractions = self.draw(sampler)
+        self.assertFalse(5 in fractions)
+        self.assertAlmostEqual(fractions[3], 11. / 19., delta = 0.02)
+
+        for i in xrange(10):
+            sampler.remove(i)
+
+        self.assertEqual(len(sampler), 0)
+        self.assertEqual(sampler.sample(), None)
+
+        sampler.set_weight(7, 2.)
+        self.assertEqual(sampler.sample(), 7)
+
+    def test_negative_weight(self):
+        sampler = WeightedSampler([('a', 1.)])
+        self.assertRaises(ValueError, sampler.set_weight, 'a', -1.)
+
+
+if __name__ == '__main__':
+    unittest.main()